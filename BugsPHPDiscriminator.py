@@ -1,132 +1,274 @@
-import json
-import re
 import os
-import subprocess as sp
+import shutil
+import time
 
-def getResults(bug_no, preds, root, bug_details):
-    test_bugs = json.load(open('./bugsPHP/bug_metadata.json', 'r'))
+from validation.metadata import bug_key, load_metadata
+from validation.patching import patch_bug, write_atomically
+from validation.result_cache import content_key, get_result_cache
+from validation.schemata import build_schema, probe_phpunit, run_schema, schema_eligible
+from validation.syntax import SyntaxPreScreen
+from validation.test_runner import FAILED, NO_RESULTS, PASSED, TIMED_OUT, run_tests
+from validation.workspace import get_workspace
 
-    bug_data = bug_details[0].split('_')
-    repo_owner = bug_data[0]
-    repo_name = bug_data[1]
-    bug_no = bug_data[3]
+# `php -l` runs after the token scan when a PHP binary is on the PATH
+PHP_LINT = True
 
-    # print(repo_name, bug_no, os.getcwd())
-
-    filtered_bug = list(filter(lambda x: (x['repo_name'] == repo_name and x['bug_no'] == int(bug_no)), test_bugs))
-    bug = filtered_bug[0]
-
-    generated_bug_lines = preds
-
-    changed_file_paths = bug['changed_file_paths']
-
-    print(' =================================================================== ' , repo_name,  'bug_no', bug_no)
-    sp.Popen(['python3', 'main.py', '-p', repo_owner+'--'+repo_name, '-b', str(bug_no), '-t', 'checkout', '-v', 'buggy', '-o', '/tmp'], 
-                cwd="./bugsPHP/").communicate()
+# test results of patched file contents, None to always run the tests
+RESULT_CACHE = '/tmp/phpfixer-results.sqlite'
+RESULT_CACHE_BYTES = 1 << 30
 
-    sp.Popen(['python3', 'main.py', '-p', repo_owner+'--'+repo_name, '-b', str(bug_no), '-t', 'install', '-v', 'buggy', '-o', '/tmp'], 
-                cwd="./bugsPHP/", universal_newlines=True, stdout=sp.PIPE, stderr=sp.PIPE).communicate()
+# installed vendor directories shared by the bugs with the same composer.lock, None to install every checkout
+VENDOR_CACHE = '/tmp/phpfixer-vendor'
 
+# COMPOSER_HOME of a local package mirror for offline installs, None to install from the network
+COMPOSER_MIRROR = None
 
-    all_changing_file_lines = []
+# kill a test task at its first failing test instead of running the rest
+FAIL_FAST = True
 
-    for i in range(len(changed_file_paths)):
-        path = changed_file_paths[i]
-        file_path = '/tmp/' + repo_name + '/' + path
+# seconds before a hung test task is killed, None to wait for it
+FAILING_TEST_TIMEOUT = 600
+ALL_TESTS_TIMEOUT = 1800
 
-        f = open(file_path, "r")
-        all_file_lines = f.readlines()
-        f.close()
+# part of the cache key: results of other test tasks, or decided from their output another way, are not reused
+TEST_COMMAND = 'failing-test-only,test;streamed'
 
-        all_changing_file_lines.append(all_file_lines)
+# the PHP binary of the patch schema runner, the schema is only used when it is on the PATH
+PHP = 'php'
 
-        buggy_line_list = bug['changed_lines'][i]
+# cache key part of the results of getSchemaResults, their failing tests ran in a process shared by the candidates
+SCHEMA_TEST_COMMAND = 'schema:failing-test-only,test;streamed'
 
-        # generated_patch_list = patch_data['bug_data'][i]
+_prescreen = None
 
-        all_lines = all_file_lines.copy()
-        line_added = 0
 
-        for index in range(len(buggy_line_list)):
-            buggy_lines = buggy_line_list[index]
-            buggy_line_start = 0
-            buggy_line_end = 0
+def get_prescreen():
+    """The syntax pre-screen of this process, its counters add up over the candidates it validates."""
+    global _prescreen
+    if _prescreen is None:
+        _prescreen = SyntaxPreScreen(lint=PHP_LINT)
+    return _prescreen
 
 
-            if len(buggy_lines['buggy']) > 1:
-                buggy_line_start = buggy_lines['buggy'][0]
-                buggy_line_end = buggy_lines['buggy'][-1]
-                all_lines[buggy_line_start -1: buggy_line_end] = [generated_bug_lines] + ["" for i in range(len(buggy_lines['buggy'])-1)]
-                if len( buggy_lines['fixed']) > len( buggy_lines['buggy']):
-                    line_added += len( buggy_lines['fixed']) - len(buggy_lines['buggy'])
-                else:
-                    line_added -= len( buggy_lines['buggy']) - len( buggy_lines['fixed'])
+def _buggy_sources(key, bug, workspace, result_cache):
+    # the buggy sources come from the result cache when it has seen the bug, a cache hit needs no checkout
+    changed_file_paths = bug['changed_file_paths']
+    buggy_sources = result_cache.buggy_sources(key, changed_file_paths) if result_cache is not None else None
+    if buggy_sources is None:
+        workspace.prepare(key.repo_owner, key.repo_name, key.bug_no, changed_file_paths)
+        buggy_sources = {}
+        for path in changed_file_paths:
+            f = open(os.path.join(workspace.snapshot_dir, path), "r")
+            buggy_sources[path] = f.read()
+            f.close()
+        if result_cache is not None:
+            result_cache.put_buggy_sources(key, buggy_sources)
+    return buggy_sources
+
+
+def _test_patch(key, workspace, failed_test=None):
+    """
+    Runs the failing tests, unless their outcome is given as `failed_test`, then all tests, on the patched workspace;
+    returns (execResult, output, timed_out).
+    """
+    repo_owner, repo_name, bug_no = key
+
+    # the outcome is decided while the output streams in, FAIL_FAST stops at the first failing test
+    if failed_test is None:
+        failed_test = run_tests(repo_owner, repo_name, bug_no, 'failing-test-only', workspace.root,
+                                fail_fast=FAIL_FAST, timeout=FAILING_TEST_TIMEOUT)
+
+    all_test = None
+    if failed_test.status == PASSED:
+        all_test = run_tests(repo_owner, repo_name, bug_no, 'test', workspace.root,
+                             fail_fast=FAIL_FAST, timeout=ALL_TESTS_TIMEOUT)
 
-            elif len(buggy_lines['buggy']) == 1:
-                buggy_line_start = buggy_lines['buggy'][0]
-                buggy_line_end = buggy_lines['buggy'][0]
-                all_lines[buggy_line_start -1] = generated_bug_lines
-                if len( buggy_lines['fixed']) > len( buggy_lines['buggy']):
-                    line_added += len( buggy_lines['fixed']) - len(buggy_lines['buggy'])
-                else:
-                    line_added -= len( buggy_lines['buggy']) - len( buggy_lines['fixed'])
+    execResult = ''
 
-            else:
-                buggy_line_end = buggy_lines['fixed'][0] - line_added
-                buggy_line_start = buggy_lines['fixed'][0] - line_added
-                all_lines = all_lines[0:buggy_line_start-1] + [generated_bug_lines] + all_lines[buggy_line_start-1:]
-                line_added += len( buggy_lines['fixed'])
+    if failed_test.status == TIMED_OUT:
+        execResult = 'testTimeout'
+        print('Failing Test Cases Timed Out')
 
-            
-        file = open(file_path, 'w')
+    elif failed_test.status == NO_RESULTS:
+        execResult = 'noTestResults'
+        print('No Test Results')
 
-        for line in all_lines:
-            file.write(line)
-        file.close()
+    elif failed_test.status == FAILED:
+        execResult = 'failedFailingTests'
+        print('Failed Failing Test Cases' )
 
+    elif failed_test.status == PASSED:
+        execResult = 'passedFailingTests'
+        print('Pass Failing Test Cases' )
 
-    failed_test_results = sp.Popen(['python3', 'main.py', '-p', repo_owner+'--'+repo_name, '-b', str(bug_no), '-t', 'failing-test-only', '-v', 'buggy', '-o', '/tmp'], 
-                            cwd="./bugsPHP/", universal_newlines=True, stdout=sp.PIPE, stderr=sp.PIPE).communicate()
+        # plausible
+        if all_test.status == PASSED:
+            execResult = 'passAllTests'
+            print('Plausible!!')
 
-    failed_test_results = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?][ -/][@-~])').sub('', failed_test_results[0])
+    print(execResult)
+    timed_out = TIMED_OUT in (failed_test.status, all_test and all_test.status)
+    return execResult, failed_test.output + (all_test.output if all_test else ''), timed_out
 
-    failed_test = failed_test_results.split('\n'),
 
-    failed_test_status = 'success' if(('ERRORS!' not in failed_test) and ('FAILURES!' not in failed_test) and ('OK' in failed_test)) else 'failed'
+def _print_stats(workspace, result_cache):
+    if result_cache is not None:
+        print(result_cache.format_stats())
+    print(get_prescreen().format_stats())
+    if workspace.vendor_cache is not None:
+        print(workspace.vendor_cache.format_stats())
 
 
-    all_test = ''
-    if(failed_test_status == 'success'):
-        all_test_result = sp.Popen(['python3', 'main.py', '-p', repo_owner+'--'+repo_name, '-b', str(bug_no), '-t', 'test', '-v', 'buggy', '-o', '/tmp'], 
-                                        cwd="./bugsPHP/", universal_newlines=True, stdout=sp.PIPE, stderr=sp.PIPE).communicate()
-        all_test_result =  re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?][ -/][@-~])').sub('', all_test_result[0])
+def getResults(bug_no, preds, root, bug_details, workspace_root='/tmp'):
+    key = bug_key(bug_details[0])
+    repo_owner, repo_name, bug_no = key
 
-        all_test = all_test_result.split('\n')
+    # print(repo_name, bug_no, os.getcwd())
 
-    execResult = ''
-    
-    if ('ERRORS!' not in failed_test) and ('FAILURES!' not in failed_test) and ('OK' not in failed_test):
-        execResult = 'noTestResults'
-        print('No Test Results')
-           
-    elif ('ERRORS!' in failed_test) or ('FAILURES!' in failed_test):
-        execResult = 'failedFailingTests'
-        print('Failed Failing Test Cases' ) 
+    # indexed once per process instead of parsing bug_metadata.json for every candidate
+    bug = load_metadata().get(repo_name, bug_no)
 
-    elif ('ERRORS!' not in failed_test) and ('FAILURES!' not in failed_test) and ('OK' in failed_test):
-        execResult = 'passedFailingTests'
-        print('Pass Failing Test Cases' )   
+    generated_bug_lines = preds
 
-        # plausible
-        if ('ERRORS!' not in all_test) and ('FAILURES!' not in all_test) and ('OK' in all_test):
-            execResult = 'passAllTests'
-            print('Plausible!!')    
+    changed_file_paths = bug['changed_file_paths']
 
-    print(execResult)
+    print(' =================================================================== ' , repo_name,  'bug_no', bug_no)
+    start = time.time()
+
+    # checkout and install once per bug, the changed files are reset to the buggy version for every candidate
+    workspace = get_workspace(workspace_root, VENDOR_CACHE, COMPOSER_MIRROR)
+    result_cache = get_result_cache(RESULT_CACHE, RESULT_CACHE_BYTES)
+
+    buggy_sources = _buggy_sources(key, bug, workspace, result_cache)
+
+    # the patched files are built in memory, the workspace is only written for candidates that get tested
+    patched_sources = patch_bug(bug, buggy_sources, generated_bug_lines)
+
+    if result_cache is not None:
+        cache_key = content_key(key, patched_sources, TEST_COMMAND)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            execResult = cached[0]
+            print('Cached', execResult)
+            print(result_cache.format_stats())
+            return execResult
+
+    # a candidate that does not parse is rejected without starting PHPUnit
+    prescreen = get_prescreen()
+    rejection = prescreen.screen({path: (buggy_sources[path], patched_sources[path]) for path in changed_file_paths})
+    if rejection is not None:
+        execResult = 'syntaxError'
+        print('Syntax Error', rejection)
+        print(execResult)
+        print(prescreen.format_stats())
+        return execResult
+
+    workspace.prepare(repo_owner, repo_name, bug_no, changed_file_paths)
+    workspace.restore()
+    prepare_time = time.time() - start
+
+    for path, patched_source in patched_sources.items():
+        write_atomically(os.path.join(workspace.path, path), patched_source)
+
+    execResult, output, timed_out = _test_patch(key, workspace)
+
+    if result_cache is not None and not timed_out:
+        result_cache.put(cache_key, key, TEST_COMMAND, execResult, output)
+    _print_stats(workspace, result_cache)
+    print('validated in {:.1f}s ({:.1f}s preparing the workspace, {} checkouts for {} candidates so far)'.format(
+        time.time() - start, prepare_time, workspace.prepares, workspace.restores))
     return execResult
-            
 
 
+def getSchemaResults(candidates, bug_details, workspace_root='/tmp'):
+    """
+    The execResult of every candidate of a single-hunk bug, with the failing tests of all candidates run in one PHP
+    process that boots PHPUnit once (see `validation.schemata`): the changed file becomes a patch schema of the
+    candidates, and a forked PHPUnit run per candidate selects its copy, so the candidates do not pay for PHP
+    start-up, autoloading and the test bootstrap one by one. The candidates that pass their failing tests then run
+    all tests with the BugsPHP test task, as in `getResults`.
+
+    Cache hits and syntax errors are decided before, like in `getResults`. Bugs with more than one hunk, runs
+    without PHP, a PHPUnit command that could not be probed or a schema that could not boot fall back to
+    `getResults` for every candidate.
+    """
+    key = bug_key(bug_details[0])
+    repo_owner, repo_name, bug_no = key
+    bug = load_metadata().get(repo_name, bug_no)
+    if not schema_eligible(bug) or shutil.which(PHP) is None:
+        return [getResults(None, candidate, None, bug_details, workspace_root=workspace_root) for candidate in candidates]
+
+    path = bug['changed_file_paths'][0]
+    print(' =================================================================== ' , repo_name,  'bug_no', bug_no, 'schema of', len(candidates))
+    start = time.time()
+
+    workspace = get_workspace(workspace_root, VENDOR_CACHE, COMPOSER_MIRROR)
+    result_cache = get_result_cache(RESULT_CACHE, RESULT_CACHE_BYTES)
+    buggy_sources = _buggy_sources(key, bug, workspace, result_cache)
+    prescreen = get_prescreen()
+
+    results = [None] * len(candidates)
+    cache_keys = {}
+    schema_sources = {}
+    for index, candidate in enumerate(candidates):
+        patched_sources = patch_bug(bug, buggy_sources, candidate)
+        if result_cache is not None:
+            # a result of getResults is as good as one of the schema
+            cached = result_cache.get(content_key(key, patched_sources, TEST_COMMAND))
+            cache_keys[index] = content_key(key, patched_sources, SCHEMA_TEST_COMMAND)
+            cached = cached or result_cache.get(cache_keys[index])
+            if cached is not None:
+                results[index] = cached[0]
+                continue
+        rejection = prescreen.screen({path: (buggy_sources[path], patched_sources[path])})
+        if rejection is not None:
+            print('Syntax Error', index, rejection)
+            results[index] = 'syntaxError'
+            continue
+        schema_sources[index] = patched_sources[path]
+
+    schema = None
+    if schema_sources:
+        workspace.prepare(repo_owner, repo_name, bug_no, bug['changed_file_paths'])
+        workspace.restore()
+        phpunit_run = probe_phpunit(workspace)
+        if phpunit_run is not None:
+            schema_files = build_schema(path, schema_sources)
+            for schema_path, source in schema_files.items():
+                write_atomically(os.path.join(workspace.path, schema_path), source)
+            try:
+                schema = run_schema(phpunit_run, os.path.join(workspace.path, path), list(schema_sources),
+                                    timeout=FAILING_TEST_TIMEOUT, fail_fast=FAIL_FAST, php=PHP)
+            finally:
+                for schema_path in schema_files:
+                    if schema_path != path:
+                        os.remove(os.path.join(workspace.path, schema_path))
+                workspace.restore()
+        if schema is not None:
+            print('schema: booted in {:.1f}s, failing tests of {} of {} candidates in {:.1f}s'.format(
+                schema.boot_seconds, len(schema.outcomes), len(schema_sources), time.time() - start))
+
+    for index, patched_source in schema_sources.items():
+        failed_test = schema.outcomes.get(index) if schema is not None else None
+        if failed_test is None:
+            # not run by the schema, validated on its own
+            results[index] = getResults(None, candidates[index], None, bug_details, workspace_root=workspace_root)
+            continue
+        if failed_test.status == PASSED:
+            workspace.prepare(repo_owner, repo_name, bug_no, bug['changed_file_paths'])
+            write_atomically(os.path.join(workspace.path, path), patched_source)
+        try:
+            execResult, output, timed_out = _test_patch(key, workspace, failed_test=failed_test)
+        finally:
+            if failed_test.status == PASSED:
+                workspace.restore()
+        results[index] = execResult
+        if result_cache is not None and not timed_out:
+            result_cache.put(cache_keys[index], key, SCHEMA_TEST_COMMAND, execResult, output)
+
+    _print_stats(workspace, result_cache)
+    print('validated {} candidates in {:.1f}s'.format(len(candidates), time.time() - start))
+    return results
 
 
 if __name__ == '__main__':
@@ -0,0 +1,511 @@
+# Benchmarks for the multi-source T5 models on the test set, e.g.
+#   python benchmark.py attention --model ./model/t5-base-serial --samples 10
+#   python benchmark.py --architecture parallel --model ./model/t5-base-parallel decode
+#   python benchmark.py --samples 100 adaptive
+#   python benchmark.py --samples 200 batching
+#   python benchmark.py speculative --draft-model ./model/t5-small-serial
+#   python benchmark.py --samples 5 workspace --results result.csv
+#   python benchmark.py --samples 5 schemata --results result.csv
+import argparse
+import csv
+import json
+import os
+import time
+import warnings
+
+import pandas as pd
+import torch
+from torch import cuda
+from torch.utils.data import DataLoader
+from transformers import T5Tokenizer
+
+import loader
+from inference.adaptive import AdaptiveBeamSearch, hunk_lengths
+from inference.batching import BatchPlanner, available_memory, collate_multi_source, source_lengths
+from inference.speculative import SpeculativeDecoder
+from model_source.t5_for_multi_source import T5ForMultiSourceConditionalGeneration
+from model_source.t5_for_multi_source_parallel_weighted import T5ForMultiSourceParallelConditionalGeneration
+
+
+MODEL_CLASSES = {
+    'serial': T5ForMultiSourceConditionalGeneration,
+    'parallel': T5ForMultiSourceParallelConditionalGeneration,
+}
+
+DTYPES = {
+    'float32': torch.float32,
+    'float16': torch.float16,
+    'bfloat16': torch.bfloat16,
+}
+
+
+def load_model(args, device, dtype=None, path=None, architecture=None):
+    model = MODEL_CLASSES[architecture or args.architecture].from_pretrained(path or args.model)
+    return model.to(device, dtype=dtype or DTYPES[args.dtype]).eval()
+
+
+def load_test_df(args):
+    test_df = pd.read_csv(args.data, encoding='latin-1', delimiter='\t')
+    return test_df[['bugid', 'bug', 'buggy', 'additional_info', 'patch']].head(args.samples).reset_index(drop=True)
+
+
+def load_inputs(args, tokenizer, device):
+    test_df = load_test_df(args)
+    test_set = loader.GeneratorDatasetForMultiSource(test_df, tokenizer, args.max_len, args.max_len)
+
+    inputs = []
+    for index in range(len(test_set)):
+        data = test_set[index]
+        # the same inputs as test.py
+        input_ids = torch.cat((data['input_ids_1'], data['input_ids_1'])).unsqueeze(0).to(device)
+        attention_mask = torch.cat((data['attention_mask_1'], data['attention_mask_1'])).unsqueeze(0).to(device)
+        labels = data['target_ids'][: args.max_length].unsqueeze(0).to(device)
+        inputs.append((input_ids, attention_mask, labels))
+    return inputs
+
+
+def generate(model, input_ids, attention_mask, args):
+    return model.generate(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        max_length=args.max_length,
+        num_beams=args.num_beams,
+        length_penalty=1.0,
+        early_stopping=True,
+        num_return_sequences=args.num_beams,
+        return_dict_in_generate=True,
+        output_scores=True,
+        )
+
+
+def measure(fn, device):
+    """Runs `fn` and returns its result, the wall time and the peak CUDA memory (None on CPU)."""
+    if device == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    result = fn()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    peak_memory = torch.cuda.max_memory_allocated() if device == 'cuda' else None
+    return result, elapsed, peak_memory
+
+
+def format_memory(peak_memory):
+    return 'n/a' if peak_memory is None else '{:.1f} MiB'.format(peak_memory / 2**20)
+
+
+def attention_benchmark(args, tokenizer, device):
+    """
+    Compares the `sdpa` attention backend with `eager`: the teacher-forced logits have to agree within `--atol` and
+    the beams are compared, then the generation time and peak CUDA memory of both backends are reported.
+    """
+    model = load_model(args, device)
+    inputs = load_inputs(args, tokenizer, device)
+
+    results = {}
+    for backend in ('eager', 'sdpa'):
+        model.set_attention_backend(backend)
+        logits, outputs, elapsed, peak_memory = [], [], 0.0, 0
+        with torch.no_grad():
+            for input_ids, attention_mask, labels in inputs:
+                logits.append(model(input_ids=input_ids, attention_mask=attention_mask, labels=labels).logits.float())
+                output, seconds, memory = measure(lambda: generate(model, input_ids, attention_mask, args), device)
+                outputs.append(output)
+                elapsed += seconds
+                peak_memory = None if memory is None else max(peak_memory, memory)
+        results[backend] = (logits, outputs, elapsed, peak_memory)
+
+    eager_logits, eager_outputs = results['eager'][:2]
+    sdpa_logits, sdpa_outputs = results['sdpa'][:2]
+    max_diff = max((a - b).abs().max().item() for a, b in zip(eager_logits, sdpa_logits))
+    same_top_beam = sum(torch.equal(a.sequences[0], b.sequences[0]) for a, b in zip(eager_outputs, sdpa_outputs))
+    same_beams = sum(
+        a.sequences.shape == b.sequences.shape and torch.equal(a.sequences, b.sequences)
+        for a, b in zip(eager_outputs, sdpa_outputs)
+        )
+
+    print('samples: {}, beams: {}, dtype: {}, device: {}'.format(len(inputs), args.num_beams, args.dtype, device))
+    print('max abs logit difference: {:.3g} (atol {:.3g})'.format(max_diff, args.atol))
+    print('identical top beam: {}/{}, identical beams: {}/{}'.format(same_top_beam, len(inputs), same_beams, len(inputs)))
+    for backend, (_, _, elapsed, peak_memory) in results.items():
+        print('{:>5}: {:.2f} s/sample, peak memory {}'.format(backend, elapsed / len(inputs), format_memory(peak_memory)))
+
+    return max_diff <= args.atol
+
+
+def batching_benchmark(args, tokenizer, device):
+    """
+    Bugs/hour of the generation of test.py with one bug per `generate()` call and both sources padded to `--max-len`,
+    as before the batch planner, and with the `BatchPlanner` batches padded to their longest source: the candidates
+    of every bug have to be the same, then the bugs/hour of both are reported.
+    """
+    model = load_model(args, device)
+    test_df = load_test_df(args)
+    test_set = loader.GeneratorDatasetForMultiSource(test_df, tokenizer, args.max_len, args.max_len)
+    planner = BatchPlanner(
+        model.config,
+        num_beams=args.num_beams,
+        max_length=args.max_length,
+        memory_budget=available_memory(device, args.memory_fraction),
+        max_batch_size=args.max_batch_size,
+        dtype_bytes=torch.finfo(model.dtype).bits // 8,
+        )
+    batches = planner.plan(source_lengths(tokenizer, test_df.additional_info, test_df.buggy, args.max_len))
+    loaders = {
+        'per bug': DataLoader(test_set, batch_size=1),
+        'batched': DataLoader(test_set, batch_sampler=batches, collate_fn=collate_multi_source),
+        }
+
+    def decode(sequence):
+        return tokenizer.decode(sequence, skip_special_tokens=True, clean_up_tokenization_spaces=True)
+
+    candidates, elapsed = {}, {}
+    with torch.no_grad():
+        for flow, data_loader in loaders.items():
+            candidates[flow], elapsed[flow] = {}, 0.0
+            for index, data in enumerate(data_loader):
+                # the same inputs as test.py
+                input_ids = torch.cat((data['input_ids_1'], data['input_ids_1']), dim=1).to(device)
+                attention_mask = torch.cat((data['attention_mask_1'], data['attention_mask_1']), dim=1).to(device)
+                if index == 0:
+                    # warm up the kernels before timing
+                    generate(model, input_ids, attention_mask, args)
+                output, seconds, _ = measure(lambda: generate(model, input_ids, attention_mask, args), device)
+                elapsed[flow] += seconds
+                sequences = output.sequences.view(len(data['bugid']), args.num_beams, -1)
+                for bugid, bug_sequences in zip(data['bugid'].tolist(), sequences):
+                    candidates[flow][bugid] = [decode(sequence) for sequence in bug_sequences]
+
+    bugs = len(test_set)
+    identical = sum(candidates['per bug'][bugid] == candidates['batched'][bugid] for bugid in candidates['per bug'])
+    print('bugs: {}, beams: {}, batches: {} (up to {} bugs), device: {}'.format(
+        bugs, args.num_beams, len(batches), max(len(batch) for batch in batches), device))
+    print('identical candidates: {}/{}'.format(identical, bugs))
+    for flow in loaders:
+        print('{:>8}: {:.1f} bugs/hour'.format(flow, bugs * 3600 / max(elapsed[flow], 1e-9)))
+    print('speedup: {:.2f}x'.format(elapsed['per bug'] / max(elapsed['batched'], 1e-9)))
+
+    return identical == bugs
+
+
+def decode_benchmark(args, tokenizer, device):
+    """
+    Decode latency of the fp32 model, of fp16 with the decoder inf clamps, and of the half-precision inference mode
+    without them (fp16 after a calibration run over the samples, bf16).
+    """
+    inputs = load_inputs(args, tokenizer, device)
+    calibration_batches = [
+        dict(input_ids=input_ids, attention_mask=attention_mask, max_length=args.max_length, num_beams=args.num_beams)
+        for input_ids, attention_mask, _ in inputs
+        ]
+
+    print('samples: {}, beams: {}, device: {}'.format(len(inputs), args.num_beams, device))
+    for precision in args.precisions:
+        model = load_model(args, device, dtype=torch.float32)
+        if precision == 'float16-clamp':
+            model.to(torch.float16)
+        elif precision == 'float16':
+            if not model.enable_half_precision_inference(torch.float16, calibration_batches):
+                print('{:>14}: calibration overflowed, the inf clamps stay on'.format(precision))
+                continue
+        elif precision == 'bfloat16':
+            model.enable_half_precision_inference(torch.bfloat16)
+
+        elapsed, steps = 0.0, 0
+        with torch.no_grad():
+            # warm up the kernels before timing
+            generate(model, inputs[0][0], inputs[0][1], args)
+            for input_ids, attention_mask, _ in inputs:
+                output, seconds, _ = measure(lambda: generate(model, input_ids, attention_mask, args), device)
+                elapsed += seconds
+                steps += output.sequences.shape[1] - 1
+        print('{:>14}: {:.2f} s/sample, {:.2f} ms/decoding step (inf clamp mode: {})'.format(
+            precision, elapsed / len(inputs), 1000 * elapsed / steps, model.config.inf_clamp_mode))
+
+        del model
+        if device == 'cuda':
+            torch.cuda.empty_cache()
+
+    return True
+
+
+def exact_match(candidate, patch):
+    # the decoded candidates are not spaced like the source code
+    return ''.join(candidate.split()) == ''.join(str(patch).split())
+
+
+def adaptive_benchmark(args, tokenizer, device):
+    """
+    Compares the adaptive beam search with the fixed `--num-beams` search of test.py: beam steps (beams x decoding
+    steps), time and the top-k recall of the reference patch (whitespace-insensitive exact match).
+    """
+    model = load_model(args, device)
+    inputs = load_inputs(args, tokenizer, device)
+    test_df = load_test_df(args)
+    lengths = hunk_lengths(tokenizer, test_df.buggy)
+
+    def decode(sequence):
+        return tokenizer.decode(sequence, skip_special_tokens=True, clean_up_tokenization_spaces=True)
+
+    adaptive = AdaptiveBeamSearch(decode, initial_beams=args.initial_beams, max_beams=args.num_beams, max_length=args.max_length)
+    fixed_candidates, adaptive_candidates = [], []
+    fixed_steps, fixed_time, adaptive_time = 0, 0.0, 0.0
+    with torch.no_grad():
+        for index, (input_ids, attention_mask, _) in enumerate(inputs):
+            output, seconds, _ = measure(lambda: generate(model, input_ids, attention_mask, args), device)
+            fixed_candidates.append([decode(sequence) for sequence in output.sequences])
+            fixed_steps += args.num_beams * (output.sequences.shape[1] - 1)
+            fixed_time += seconds
+
+            results, seconds, _ = measure(
+                lambda: adaptive.generate(model, input_ids, attention_mask, [lengths[index]]), device)
+            adaptive_candidates.append(results[0][0])
+            adaptive_time += seconds
+
+    print('samples: {}, beams: {} (adaptive from {}), device: {}'.format(len(inputs), args.num_beams, args.initial_beams, device))
+    print('fixed:    {} beam steps, {:.2f} s/sample'.format(fixed_steps, fixed_time / len(inputs)))
+    print('adaptive: {} beam steps, {:.2f} s/sample, {} generations'.format(
+        adaptive.beam_steps, adaptive_time / len(inputs), adaptive.generations))
+    print('compute saved: {:.1%} of the beam steps, {:.1%} of the time'.format(
+        1 - adaptive.beam_steps / max(fixed_steps, 1), 1 - adaptive_time / max(fixed_time, 1e-9)))
+    for k in sorted({1, 5, 10, args.num_beams}):
+        fixed_recall = sum(any(exact_match(c, patch) for c in candidates[:k]) for candidates, patch in zip(fixed_candidates, test_df.patch))
+        adaptive_recall = sum(any(exact_match(c, patch) for c in candidates[:k]) for candidates, patch in zip(adaptive_candidates, test_df.patch))
+        print('top-{} recall: fixed {}/{}, adaptive {}/{}'.format(k, fixed_recall, len(inputs), adaptive_recall, len(inputs)))
+
+    return True
+
+
+def speculative_benchmark(args, tokenizer, device):
+    """
+    Greedy decoding with and without the draft model: the speculative sequences have to be identical to the greedy
+    ones, then the acceptance rate of the draft tokens, the tokens per decoder forward of the model and the latency
+    are reported. The model is also decoded as its own draft, which accepts every drafted EOS: these sequences have to
+    be identical to the greedy ones as well.
+    """
+    model = load_model(args, device)
+    draft_model = load_model(args, device, path=args.draft_model, architecture=args.draft_architecture)
+    inputs = load_inputs(args, tokenizer, device)
+    speculative = SpeculativeDecoder(model, draft_model, num_draft_tokens=args.num_draft_tokens)
+
+    identical, identical_self, greedy_time, speculative_time = 0, 0, 0.0, 0.0
+    with torch.no_grad():
+        # warm up the kernels before timing
+        speculative.generate(inputs[0][0], inputs[0][1], max_length=args.max_length)
+        speculative.reset_stats()
+        for input_ids, attention_mask, _ in inputs:
+            greedy, seconds, _ = measure(
+                lambda: model.generate(input_ids=input_ids, attention_mask=attention_mask, max_length=args.max_length, num_beams=1),
+                device)
+            greedy_time += seconds
+            sequences, seconds, _ = measure(
+                lambda: speculative.generate(input_ids, attention_mask, max_length=args.max_length), device)
+            speculative_time += seconds
+            identical += greedy.shape == sequences.shape and torch.equal(greedy, sequences)
+            self_drafted = SpeculativeDecoder(model, model, num_draft_tokens=args.num_draft_tokens).generate(
+                input_ids, attention_mask, max_length=args.max_length)
+            identical_self += greedy.shape == self_drafted.shape and torch.equal(greedy, self_drafted)
+
+    print('samples: {}, draft tokens: {} (adapted up to {}), device: {}'.format(
+        len(inputs), args.num_draft_tokens, speculative.max_draft_tokens, device))
+    print('identical to greedy: {}/{} ({}/{} with the model as its own draft)'.format(
+        identical, len(inputs), identical_self, len(inputs)))
+    print('acceptance rate: {:.1%} ({}/{} draft tokens), {:.2f} tokens per forward of the model'.format(
+        speculative.acceptance_rate, speculative.accepted, speculative.drafted, speculative.tokens_per_forward))
+    print('greedy:      {:.3f} s/sample'.format(greedy_time / len(inputs)))
+    print('speculative: {:.3f} s/sample ({:.2f}x), {} forwards of the model, {} of the draft'.format(
+        speculative_time / len(inputs), greedy_time / max(speculative_time, 1e-9), speculative.model_forwards,
+        speculative.draft_forwards))
+
+    return identical == identical_self == len(inputs)
+
+
+def load_candidates(path, samples, candidates_per_bug):
+    """The best `candidates_per_bug` candidates of the first `samples` bugs of a tsv or jsonl result file of test.py."""
+    candidates = {}
+    with open(path, newline='') as handle:
+        if path.endswith('.jsonl'):
+            rows = [json.loads(line) for line in handle]
+            rows = [(row['bug'], row['patch']) for row in sorted(rows, key=lambda row: row['rank'])]
+        else:
+            rows = [(row[1], row[2]) for row in csv.reader(handle, delimiter='\t', escapechar=' ', quoting=csv.QUOTE_NONE)]
+    for bug, patch in rows:
+        if bug in candidates or len(candidates) < samples:
+            candidates.setdefault(bug, [])
+            if len(candidates[bug]) < candidates_per_bug:
+                candidates[bug].append(patch)
+    return candidates
+
+
+def workspace_benchmark(args, tokenizer, device):
+    """
+    Validation time per candidate when every candidate checks out and installs its bug, as `getResults` did before
+    the workspaces, and with the `BugWorkspace` of `getResults` that does it once per bug: the results have to be the
+    same. Both screen the syntax of the candidates first, the result and vendor caches are off.
+    """
+    import BugsPHPDiscriminator
+    from validation.metadata import bug_key, load_metadata
+    from validation.patching import patch_bug, write_atomically
+    from validation.workspace import BugWorkspace, run_task
+
+    BugsPHPDiscriminator.RESULT_CACHE = None
+    BugsPHPDiscriminator.VENDOR_CACHE = None
+    candidates = load_candidates(args.results, args.samples, args.candidates)
+
+    def checkout_per_candidate(bug, candidate):
+        key = bug_key(bug)
+        metadata = load_metadata().get(key.repo_name, key.bug_no)
+        checkout = os.path.join(args.workspace_root, key.repo_name)
+        run_task(key.repo_owner, key.repo_name, key.bug_no, 'checkout', args.workspace_root, capture=False)
+        run_task(key.repo_owner, key.repo_name, key.bug_no, 'install', args.workspace_root)
+        buggy_sources = {}
+        for path in metadata['changed_file_paths']:
+            with open(os.path.join(checkout, path)) as handle:
+                buggy_sources[path] = handle.read()
+        patched_sources = patch_bug(metadata, buggy_sources, candidate)
+        if BugsPHPDiscriminator.get_prescreen().screen(
+                {path: (buggy_sources[path], patched_sources[path]) for path in patched_sources}) is not None:
+            return 'syntaxError'
+        for path, patched_source in patched_sources.items():
+            write_atomically(os.path.join(checkout, path), patched_source)
+        return BugsPHPDiscriminator._test_patch(key, BugWorkspace(args.workspace_root))[0]
+
+    def per_bug(bug, candidate):
+        return BugsPHPDiscriminator.getResults(None, candidate, None, [bug], workspace_root=args.workspace_root)
+
+    results, elapsed = {}, {}
+    for flow, validate in (('checkout per candidate', checkout_per_candidate), ('workspace per bug', per_bug)):
+        start = time.time()
+        results[flow] = [validate(bug, candidate) for bug, bug_candidates in candidates.items() for candidate in bug_candidates]
+        elapsed[flow] = time.time() - start
+
+    tested = len(results['workspace per bug'])
+    identical = sum(a == b for a, b in zip(results['checkout per candidate'], results['workspace per bug']))
+    print('bugs: {}, candidates: {}'.format(len(candidates), tested))
+    print('identical results: {}/{}'.format(identical, tested))
+    for flow, seconds in elapsed.items():
+        print('{:>22}: {:.2f} s/candidate'.format(flow, seconds / max(tested, 1)))
+    print('speedup: {:.2f}x'.format(elapsed['checkout per candidate'] / max(elapsed['workspace per bug'], 1e-9)))
+
+    return identical == tested
+
+
+def schemata_benchmark(args, tokenizer, device):
+    """
+    Validation time per candidate of single-hunk bugs with one PHP/PHPUnit process per candidate (`getResults`) and
+    with the patch schema that boots PHPUnit once per bug (`getSchemaResults`): the results have to be the same. The
+    workspace of a bug is prepared before each flow, outside the timing, and the result cache is off.
+    """
+    import BugsPHPDiscriminator
+    from validation.metadata import bug_key, load_metadata
+    from validation.schemata import schema_eligible
+    from validation.workspace import get_workspace
+
+    BugsPHPDiscriminator.RESULT_CACHE = None
+    candidates = load_candidates(args.results, args.samples, args.candidates)
+    metadata = load_metadata()
+    workspace = get_workspace(args.workspace_root, BugsPHPDiscriminator.VENDOR_CACHE, BugsPHPDiscriminator.COMPOSER_MIRROR)
+
+    results = {'process per candidate': [], 'schema per bug': []}
+    elapsed = dict.fromkeys(results, 0.0)
+    bugs = 0
+    for bug, bug_candidates in candidates.items():
+        key = bug_key(bug)
+        bug_metadata = metadata.get(key.repo_name, key.bug_no)
+        if not schema_eligible(bug_metadata):
+            continue
+        bugs += 1
+
+        workspace.prepare(key.repo_owner, key.repo_name, key.bug_no, bug_metadata['changed_file_paths'])
+        start = time.time()
+        results['process per candidate'] += [
+            BugsPHPDiscriminator.getResults(None, candidate, None, [bug], workspace_root=args.workspace_root)
+            for candidate in bug_candidates]
+        elapsed['process per candidate'] += time.time() - start
+
+        workspace.prepare(key.repo_owner, key.repo_name, key.bug_no, bug_metadata['changed_file_paths'])
+        start = time.time()
+        results['schema per bug'] += BugsPHPDiscriminator.getSchemaResults(
+            bug_candidates, [bug], workspace_root=args.workspace_root)
+        elapsed['schema per bug'] += time.time() - start
+
+    tested = len(results['schema per bug'])
+    identical = sum(a == b for a, b in zip(results['process per candidate'], results['schema per bug']))
+    print('single-hunk bugs: {}, candidates: {}'.format(bugs, tested))
+    print('identical results: {}/{}'.format(identical, tested))
+    for flow, seconds in elapsed.items():
+        print('{:>22}: {:.2f} s/candidate'.format(flow, seconds / max(tested, 1)))
+    print('speedup: {:.2f}x'.format(elapsed['process per candidate'] / max(elapsed['schema per bug'], 1e-9)))
+
+    return identical == tested
+
+
+# benchmarks of the validation, they need no model
+VALIDATION_BENCHMARKS = ('workspace', 'schemata')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the multi-source T5 models')
+    parser.add_argument('--model', default='./model/t5-base-serial')
+    parser.add_argument('--architecture', choices=sorted(MODEL_CLASSES), default='serial')
+    parser.add_argument('--data', default='./data/test.csv')
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--max-len', type=int, default=512, help='source length of each encoder')
+    parser.add_argument('--max-length', type=int, default=100, help='max_length passed to generate()')
+    parser.add_argument('--num-beams', type=int, default=100)
+    parser.add_argument('--dtype', choices=sorted(DTYPES), default='float32')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    attention_parser = subparsers.add_parser('attention', help='parity and memory of the sdpa attention backend')
+    attention_parser.add_argument('--atol', type=float, default=1e-3)
+    attention_parser.set_defaults(run=attention_benchmark)
+
+    batching_parser = subparsers.add_parser('batching', help='bugs/hour with and without the batch planner of test.py')
+    batching_parser.add_argument('--max-batch-size', type=int, default=16)
+    batching_parser.add_argument('--memory-fraction', type=float, default=0.8)
+    batching_parser.set_defaults(run=batching_benchmark)
+
+    decode_parser = subparsers.add_parser('decode', help='decode latency with and without the fp16 inf clamps')
+    decode_parser.add_argument(
+        '--precisions',
+        nargs='+',
+        choices=['float32', 'float16-clamp', 'float16', 'bfloat16'],
+        default=['float32', 'float16-clamp', 'float16', 'bfloat16'],
+        )
+    decode_parser.set_defaults(run=decode_benchmark)
+
+    adaptive_parser = subparsers.add_parser('adaptive', help='compute and top-k recall of the adaptive beam search')
+    adaptive_parser.add_argument('--initial-beams', type=int, default=10)
+    adaptive_parser.set_defaults(run=adaptive_benchmark)
+
+    speculative_parser = subparsers.add_parser('speculative', help='acceptance rate and latency of speculative decoding')
+    speculative_parser.add_argument('--draft-model', required=True, help='a smaller multi-source model with the same tokenizer')
+    speculative_parser.add_argument('--draft-architecture', choices=sorted(MODEL_CLASSES), default='serial')
+    speculative_parser.add_argument('--num-draft-tokens', type=int, default=5)
+    speculative_parser.set_defaults(run=speculative_benchmark)
+
+    workspace_parser = subparsers.add_parser('workspace', help='validation time per candidate with and without workspaces')
+    workspace_parser.add_argument('--results', required=True, help='a tsv or jsonl result file of test.py')
+    workspace_parser.add_argument('--candidates', type=int, default=10, help='candidates validated per bug')
+    workspace_parser.add_argument('--workspace-root', default='/tmp')
+    workspace_parser.set_defaults(run=workspace_benchmark)
+
+    schemata_parser = subparsers.add_parser('schemata', help='validation time per candidate with and without the patch schema')
+    schemata_parser.add_argument('--results', required=True, help='a tsv or jsonl result file of test.py')
+    schemata_parser.add_argument('--candidates', type=int, default=10, help='candidates validated per bug')
+    schemata_parser.add_argument('--workspace-root', default='/tmp')
+    schemata_parser.set_defaults(run=schemata_benchmark)
+
+    args = parser.parse_args()
+
+    device = 'cuda' if cuda.is_available() else 'cpu'
+    tokenizer = T5Tokenizer.from_pretrained(args.model) if args.benchmark not in VALIDATION_BENCHMARKS else None
+    if not args.run(args, tokenizer, device):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    warnings.filterwarnings('ignore')
+    main()
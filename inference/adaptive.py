@@ -0,0 +1,94 @@
+import math
+
+import torch
+
+
+def buggy_hunk(buggy):
+    """The buggy lines of a `buggy` input, which reads `buggy: <hunk> context: <surrounding code>`."""
+    hunk = str(buggy).split('context:', 1)[0]
+    if hunk.lstrip().startswith('buggy:'):
+        hunk = hunk.lstrip()[len('buggy:'):]
+    return hunk.strip()
+
+
+def hunk_lengths(tokenizer, buggy_texts):
+    """Token length of the buggy hunk of every bug."""
+    return [len(tokenizer.encode(buggy_hunk(buggy))) for buggy in buggy_texts]
+
+
+def normalize_whitespace(candidate):
+    return ' '.join(candidate.split())
+
+
+class AdaptiveBeamSearch:
+    """
+    Beam search that starts narrow and widens only for the bugs that need it.
+
+    Every bug of a batch is first generated with `initial_beams` beams. A bug is generated again with `widen_factor`
+    times more beams (up to `max_beams`) while it has fewer than `min_unique` candidates that differ after whitespace
+    normalization, or while the beam scores of its candidates lie within `min_score_spread` of each other. `max_length`
+    follows the token length of the buggy hunk (`length_factor` x hunk + `length_margin`, within `min_length` and
+    `max_length`), as patches are rarely much longer than the code they replace.
+
+    `beam_steps` counts beams x decoding steps over all generations, the compute the search spent.
+    """
+
+    def __init__(self, decode, initial_beams=10, max_beams=100, widen_factor=10, min_unique=10, min_score_spread=1.0,
+                 length_factor=1.5, length_margin=16, min_length=32, max_length=100):
+        self.decode = decode
+        self.initial_beams = initial_beams
+        self.max_beams = max_beams
+        self.widen_factor = widen_factor
+        self.min_unique = min_unique
+        self.min_score_spread = min_score_spread
+        self.length_factor = length_factor
+        self.length_margin = length_margin
+        self.min_length = min_length
+        self.max_length = max_length
+        self.beam_steps = 0
+        self.generations = 0
+
+    def max_length_for(self, hunk_length):
+        max_length = int(math.ceil(self.length_factor * hunk_length)) + self.length_margin
+        return min(self.max_length, max(self.min_length, max_length))
+
+    def needs_more_beams(self, candidates, scores):
+        unique = len(set(normalize_whitespace(candidate) for candidate in candidates))
+        spread = float(scores.max() - scores.min()) if len(scores) > 1 else 0.0
+        return unique < self.min_unique or spread < self.min_score_spread
+
+    def generate(self, model, input_ids, attention_mask, hunk_lengths):
+        """
+        Returns the decoded candidates and the beam scores of every bug of the batch, best first. A bug gets as many
+        candidates as the beams of its last generation.
+        """
+        results = [None] * input_ids.shape[0]
+        pending = list(range(input_ids.shape[0]))
+        num_beams = self.initial_beams
+        while pending:
+            index = torch.tensor(pending, device=input_ids.device)
+            outputs = model.generate(
+                input_ids=input_ids.index_select(0, index),
+                attention_mask=attention_mask.index_select(0, index),
+                max_length=self.max_length_for(max(hunk_lengths[i] for i in pending)),
+                num_beams=num_beams,
+                length_penalty=1.0,
+                early_stopping=True,
+                num_return_sequences=num_beams,
+                return_dict_in_generate=True,
+                output_scores=True,
+            )
+            self.beam_steps += len(pending) * num_beams * (outputs.sequences.shape[1] - 1)
+            self.generations += 1
+
+            widened_beams = min(self.max_beams, num_beams * self.widen_factor)
+            still_pending = []
+            for j, i in enumerate(pending):
+                candidates = [self.decode(sequence) for sequence in outputs.sequences[j * num_beams:(j + 1) * num_beams]]
+                scores = outputs.sequences_scores[j * num_beams:(j + 1) * num_beams].float().cpu()
+                results[i] = (candidates, scores)
+                if num_beams < self.max_beams and self.needs_more_beams(candidates, scores):
+                    still_pending.append(i)
+            pending = still_pending
+            num_beams = widened_beams
+        return results
@@ -0,0 +1,97 @@
+import torch
+from torch.utils.data.dataloader import default_collate
+
+
+def available_memory(device, fraction=0.8):
+    """Bytes the generation may use on `device`: a fraction of the free CUDA memory, None (unbounded) on CPU."""
+    if not str(device).startswith('cuda'):
+        return None
+    free_memory, _ = torch.cuda.mem_get_info(device)
+    return int(free_memory * fraction)
+
+
+def source_lengths(tokenizer, texts_1, texts_2, max_len):
+    """Token length of every bug, the longer of its two sources once truncated to `max_len`."""
+    lengths = []
+    for text_1, text_2 in zip(texts_1, texts_2):
+        length_1 = len(tokenizer.encode(str(text_1), max_length=max_len, truncation=True))
+        length_2 = len(tokenizer.encode(str(text_2), max_length=max_len, truncation=True))
+        lengths.append(max(length_1, length_2))
+    return lengths
+
+
+def collate_multi_source(items):
+    """
+    Collates `GeneratorDatasetForMultiSource` items and drops the padding columns that no bug of the batch uses.
+    Both sources are cut to the same length because the models split the concatenated input in two halves.
+    """
+    batch = default_collate(items)
+    length = int(max(batch['attention_mask_1'].sum(dim=1).max(), batch['attention_mask_2'].sum(dim=1).max()))
+    for key in ('input_ids_1', 'attention_mask_1', 'input_ids_2', 'attention_mask_2'):
+        batch[key] = batch[key][:, :length]
+    return batch
+
+
+class BatchPlanner:
+    """
+    Groups bugs into `generate()` batches whose beams fit in memory.
+
+    Every bug expands into `num_beams` beams, each holding the encoder states and the cross-attention keys / values
+    of both sources plus a self-attention cache of up to `max_length` positions, so the memory of a batch grows with
+    `batch_size x num_beams x source length`. Bugs are sorted by length (longest first, so an oversized plan fails
+    on the first batch) and batched greedily while the estimate times `safety_factor` stays within `memory_budget`.
+    Without a budget (CPU) the batches are only capped by `max_batch_size`.
+    """
+
+    def __init__(self, config, num_beams, max_length, memory_budget=None, max_batch_size=16, dtype_bytes=4,
+                 safety_factor=2.0, sort_by_length=True):
+        self.num_layers = getattr(config, 'num_decoder_layers', None) or config.num_layers
+        self.num_heads = config.num_heads
+        self.inner_dim = config.num_heads * config.d_kv
+        self.d_model = config.d_model
+        self.vocab_size = config.vocab_size
+        self.num_beams = num_beams
+        self.max_length = max_length
+        self.memory_budget = memory_budget
+        self.max_batch_size = max_batch_size
+        self.dtype_bytes = dtype_bytes
+        self.safety_factor = safety_factor
+        self.sort_by_length = sort_by_length
+
+    def beam_bytes(self, source_length):
+        cross_attention = self.num_layers * 2 * 2 * source_length * self.inner_dim  # keys / values of both sources
+        encoder_states = 2 * source_length * self.d_model
+        # keys / values, plus the two reorder buffers of up to 1.5 times their size
+        self_attention = self.num_layers * 2 * self.max_length * self.inner_dim * 4
+        # logits, log-probabilities and beam scores of a step are float32
+        scores = 3 * self.vocab_size * 4
+        return (cross_attention + encoder_states + self_attention) * self.dtype_bytes + scores
+
+    def bug_bytes(self, source_length):
+        # the encoders run once per bug, before the beams are expanded
+        encoder_scores = 2 * self.num_heads * source_length ** 2 * 4
+        return self.num_beams * self.beam_bytes(source_length) + encoder_scores
+
+    def fits(self, batch_size, source_length):
+        if self.memory_budget is None:
+            return True
+        return batch_size * self.bug_bytes(source_length) * self.safety_factor <= self.memory_budget
+
+    def plan(self, lengths):
+        """Splits the bug indices into batches, `lengths` holds the source length of every bug."""
+        order = list(range(len(lengths)))
+        if self.sort_by_length:
+            order.sort(key=lambda index: -lengths[index])
+
+        batches = []
+        batch, batch_length = [], 0
+        for index in order:
+            length = max(batch_length, lengths[index])
+            if batch and (len(batch) >= self.max_batch_size or not self.fits(len(batch) + 1, length)):
+                batches.append(batch)
+                batch, length = [], lengths[index]
+            batch.append(index)
+            batch_length = length
+        if batch:
+            batches.append(batch)
+        return batches
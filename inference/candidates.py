@@ -0,0 +1,67 @@
+import re
+
+
+# PHP operators the decoded candidates can contain with spaces between their characters, longest first. Each of them
+# is invalid PHP when spaced, so joining them never changes the meaning of a candidate.
+SPACED_OPERATORS = ['<?php', '<=>', '===', '!==', '>=', '<=', '==', '!=', '->', '=>', '::']
+
+_SPACED_OPERATOR_PATTERN = re.compile(
+    '|'.join(r'\s*'.join(re.escape(character) for character in operator) for operator in SPACED_OPERATORS))
+
+# the PHP operators of more than one character, a token each
+PHP_OPERATORS = [
+    '<?php', '<=>', '**=', '...', '<<=', '>>=', '===', '!==', '??=', '?->',
+    '->', '=>', '::', '==', '!=', '<>', '<=', '>=', '&&', '||', '??', '++', '--', '+=', '-=', '*=', '/=', '.=', '%=',
+    '&=', '|=', '^=', '<<', '>>', '**', '?>',
+]
+
+# variables / identifiers / numbers, string literals (whitespace inside them matters), operators (longest first, so
+# `+=` is one token and `+ =` two) and single characters
+_PHP_TOKEN_PATTERN = re.compile(
+    r"""\$?\w+|'(?:[^'\\]|\\.)*'?|"(?:[^"\\]|\\.)*"?|"""
+    + '|'.join(re.escape(operator) for operator in sorted(PHP_OPERATORS, key=len, reverse=True))
+    + r'|\S')
+
+
+def detokenize(candidate):
+    """
+    Joins the PHP operators the tokenizer decodes with spaces in between (`> =` to `>=`, `= = =` to `===`, `- >` to
+    `->`, ...) in one pass over the candidate.
+    """
+    return _SPACED_OPERATOR_PATTERN.sub(lambda match: ''.join(match.group().split()), candidate)
+
+
+def token_key(candidate):
+    """The PHP tokens of a candidate: candidates with the same key differ only in whitespace outside of strings."""
+    return '\0'.join(_PHP_TOKEN_PATTERN.findall(candidate))
+
+
+def dedup_candidates(candidates, scores=None):
+    """
+    Collapses the candidates of one bug that are exact or token-level duplicates.
+
+    `candidates` are ranked best first, with their beam `scores` when available. Every unique patch keeps its first
+    (best ranked) spelling and the best score of its duplicates, and the result is ranked by that score, or by the
+    rank of the first duplicate without scores. Returns the unique candidates, their scores (None without scores),
+    how many beams produced each of them and the rank of the beam each kept spelling comes from.
+    """
+    unique = {}
+    for rank, candidate in enumerate(candidates):
+        key = token_key(candidate)
+        score = None if scores is None else float(scores[rank])
+        if key not in unique:
+            unique[key] = [candidate, score, rank, 0]
+        entry = unique[key]
+        entry[3] += 1
+        if score is not None and score > entry[1]:
+            entry[1] = score
+
+    entries = list(unique.values())
+    if scores is not None:
+        entries.sort(key=lambda entry: (-entry[1], entry[2]))
+    return (
+        [entry[0] for entry in entries],
+        None if scores is None else [entry[1] for entry in entries],
+        [entry[3] for entry in entries],
+        [entry[2] for entry in entries],
+    )
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+
+
+def fingerprint(paths, settings):
+    """
+    Hash of the files under `paths` (a model checkpoint directory, the data file, ...) and of the generation
+    `settings`, a run can only be resumed with the same fingerprint.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        for file in files:
+            if not os.path.isfile(file):
+                continue
+            digest.update(os.path.basename(file).encode())
+            with open(file, 'rb') as handle:
+                for chunk in iter(lambda: handle.read(1 << 20), b''):
+                    digest.update(chunk)
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class RunManifest:
+    """
+    Progress of a generation run, saved next to its result file so that a restarted run skips the finished bugs.
+
+    The manifest holds the run fingerprint, the completed bugids and the size of the result file once their rows
+    were on disk. `record()` is called after each flush of the result file (`ResultWriter(on_flush=...)`), a flush
+    only ever holds whole bugs, and the manifest is replaced atomically. Opening an existing manifest truncates the
+    result file back to the recorded size, which drops the rows of a bug that was being written when the run
+    stopped, so every bug ends up in the results exactly once.
+    """
+
+    def __init__(self, path, fingerprint, result_file):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.result_file = result_file
+        self.completed = set()
+        self.result_bytes = 0
+
+        if os.path.exists(path):
+            self._load()
+            self._recover()
+        elif os.path.exists(result_file) and os.path.getsize(result_file) > 0:
+            raise ValueError(
+                '{} has results but no run manifest ({}), move it away to start a new run'.format(result_file, path))
+        else:
+            self._save()
+
+    def _load(self):
+        with open(self.path) as handle:
+            manifest = json.load(handle)
+        if manifest['fingerprint'] != self.fingerprint or manifest['result_file'] != self.result_file:
+            raise ValueError(
+                '{} belongs to a run with another model, data, settings or result file, '
+                'remove it and {} to start a new run'.format(self.path, manifest['result_file']))
+        self.completed = set(manifest['completed'])
+        self.result_bytes = manifest['result_bytes']
+
+    def _recover(self):
+        size = os.path.getsize(self.result_file) if os.path.exists(self.result_file) else 0
+        if size < self.result_bytes:
+            raise ValueError('{} is shorter than recorded in {}'.format(self.result_file, self.path))
+        if size > self.result_bytes:
+            # rows of a bug that was not completed
+            with open(self.result_file, 'r+b') as handle:
+                handle.truncate(self.result_bytes)
+            print('dropped {} bytes of partial results from {}'.format(size - self.result_bytes, self.result_file))
+
+    def record(self, bugids, result_bytes):
+        """Marks `bugids` as completed once their rows are on disk and the result file is `result_bytes` long."""
+        self.completed.update(bugids)
+        self.result_bytes = result_bytes
+        self._save()
+
+    def _save(self):
+        manifest = {
+            'fingerprint': self.fingerprint,
+            'result_file': self.result_file,
+            'result_bytes': self.result_bytes,
+            'completed': sorted(self.completed),
+        }
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as handle:
+            json.dump(manifest, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,74 @@
+import gc
+from contextlib import contextmanager
+
+import torch
+
+
+class MemoryManager:
+    """
+    Tracks the peak CUDA memory of every generation and frees memory only when it is needed.
+
+    Releasing the caching allocator after every batch makes the next `generate()` allocate everything again, so the
+    pools are kept as long as the memory reserved by the allocator stays below `high_water_mark` (a fraction of the
+    device memory). Past it, the Python garbage collector runs, the `on_trim` callbacks release buffers kept
+    between generations (e.g. `BeamReorderCache.release`) and the unused cached blocks go back to the device. On CPU
+    only the GC is left to Python.
+    """
+
+    def __init__(self, device, high_water_mark=0.9, on_trim=()):
+        self.device = torch.device(device)
+        self.enabled = self.device.type == 'cuda'
+        self.high_water_mark = high_water_mark
+        self.on_trim = list(on_trim)
+        self.total_memory = torch.cuda.get_device_properties(self.device).total_memory if self.enabled else None
+        self.generations = 0
+        self.trims = 0
+        self.last_peak = 0
+        self.max_peak = 0
+
+    @contextmanager
+    def track(self):
+        """Wraps one generation: records its peak memory and trims afterwards when the high-water mark is crossed."""
+        if self.enabled:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        try:
+            yield
+        finally:
+            self.generations += 1
+            if self.enabled:
+                self.last_peak = torch.cuda.max_memory_allocated(self.device)
+                self.max_peak = max(self.max_peak, self.last_peak)
+                if torch.cuda.memory_reserved(self.device) > self.high_water_mark * self.total_memory:
+                    self.trim()
+
+    def trim(self):
+        gc.collect()
+        for release in self.on_trim:
+            release()
+        if self.enabled:
+            torch.cuda.empty_cache()
+        self.trims += 1
+
+    def stats(self):
+        """Allocator statistics for the run log, None on CPU."""
+        if not self.enabled:
+            return None
+        memory_stats = torch.cuda.memory_stats(self.device)
+        return {
+            'allocated': torch.cuda.memory_allocated(self.device),
+            'reserved': torch.cuda.memory_reserved(self.device),
+            'last_peak': self.last_peak,
+            'max_peak': self.max_peak,
+            'alloc_retries': memory_stats.get('num_alloc_retries', 0),
+            'ooms': memory_stats.get('num_ooms', 0),
+            'trims': self.trims,
+        }
+
+    def format_stats(self):
+        stats = self.stats()
+        if stats is None:
+            return 'memory: n/a (cpu)'
+        return 'memory: allocated {:.0f} MiB, reserved {:.0f} MiB, peak {:.0f} MiB (max {:.0f} MiB), ' \
+               'alloc retries {}, ooms {}, trims {}'.format(
+                   stats['allocated'] / 2**20, stats['reserved'] / 2**20, stats['last_peak'] / 2**20,
+                   stats['max_peak'] / 2**20, stats['alloc_retries'], stats['ooms'], stats['trims'])
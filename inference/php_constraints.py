@@ -0,0 +1,204 @@
+import torch
+from transformers import LogitsProcessor
+
+
+BRACKETS = ('()', '[]', '{}')
+
+# scanner modes: code, inside a '...' or "..." string (and right after a backslash in it), inside a comment
+CODE, SINGLE_QUOTED, DOUBLE_QUOTED, SINGLE_QUOTED_ESCAPE, DOUBLE_QUOTED_ESCAPE, LINE_COMMENT, BLOCK_COMMENT = range(7)
+
+# last non-whitespace character in code, DANGLING after a `->` / `::` that still needs its member
+NONE, MINUS, COLON, SLASH, STAR, DANGLING = range(6)
+
+# the (mode, last character) pairs the scanner can be in between two tokens
+STATES = [(CODE, last) for last in (NONE, MINUS, COLON, SLASH, DANGLING)] + [
+    (SINGLE_QUOTED, NONE), (DOUBLE_QUOTED, NONE), (SINGLE_QUOTED_ESCAPE, NONE), (DOUBLE_QUOTED_ESCAPE, NONE),
+    (LINE_COMMENT, NONE), (BLOCK_COMMENT, NONE), (BLOCK_COMMENT, STAR),
+]
+STATE_INDEX = {state: index for index, state in enumerate(STATES)}
+# states a candidate can end in: not inside a string or a block comment, nor after a dangling `->` / `::`
+FINAL_STATES = [STATE_INDEX[(CODE, last)] for last in (NONE, MINUS, COLON, SLASH)] + [STATE_INDEX[(LINE_COMMENT, NONE)]]
+
+
+def scan(text, state=(CODE, NONE)):
+    """
+    Scans PHP `text` from a scanner `state`. Returns the state it ends in, the net depth change of every bracket type
+    of `BRACKETS` and the lowest depth reached on the way (brackets in strings and comments do not count).
+    """
+    mode, last = state
+    depth = [0, 0, 0]
+    low = [0, 0, 0]
+    for character in text:
+        if mode == CODE:
+            if character.isspace():
+                continue
+            if character == "'" or character == '"':
+                mode, last = (SINGLE_QUOTED if character == "'" else DOUBLE_QUOTED), NONE
+            elif character == '#':
+                mode, last = LINE_COMMENT, NONE
+            elif last == SLASH and character in '/*':
+                mode, last = (LINE_COMMENT if character == '/' else BLOCK_COMMENT), NONE
+            elif (last == MINUS and character == '>') or (last == COLON and character == ':'):
+                last = DANGLING
+            else:
+                last = {'-': MINUS, ':': COLON, '/': SLASH}.get(character, NONE)
+                for k, (opening, closing) in enumerate(BRACKETS):
+                    if character == opening:
+                        depth[k] += 1
+                    elif character == closing:
+                        depth[k] -= 1
+                        low[k] = min(low[k], depth[k])
+        elif mode in (SINGLE_QUOTED, DOUBLE_QUOTED):
+            if character == '\\':
+                mode = SINGLE_QUOTED_ESCAPE if mode == SINGLE_QUOTED else DOUBLE_QUOTED_ESCAPE
+            elif character == ("'" if mode == SINGLE_QUOTED else '"'):
+                mode = CODE
+        elif mode in (SINGLE_QUOTED_ESCAPE, DOUBLE_QUOTED_ESCAPE):
+            mode = SINGLE_QUOTED if mode == SINGLE_QUOTED_ESCAPE else DOUBLE_QUOTED
+        elif mode == LINE_COMMENT:
+            if character == '\n':
+                mode = CODE
+        elif mode == BLOCK_COMMENT:
+            if last == STAR and character == '/':
+                mode, last = CODE, NONE
+            else:
+                last = STAR if character == '*' else NONE
+    return (mode, last), depth, low
+
+
+def hunk_bracket_bounds(hunk):
+    """
+    The bracket bounds a fix of the buggy `hunk` is held to: the lowest depth the hunk reaches (a hunk can close
+    brackets opened before it, `} else {`) and its net depth change, per bracket type.
+    """
+    _, depth, low = scan(hunk)
+    return low, depth
+
+
+class PHPSyntaxTables:
+    """
+    The effect of every token of the vocabulary on the PHP scanner, from every scanner state: the state after the
+    token (`next_state`), its net bracket depth change (`delta`) and the lowest depth it reaches (`low`), as
+    `(len(STATES), vocab_size)` tensors. Built once per tokenizer, special tokens leave the state as it is.
+    """
+
+    def __init__(self, tokenizer, vocab_size=None):
+        vocab_size = vocab_size or len(tokenizer)
+        special_ids = set(tokenizer.all_special_ids)
+        texts = [''] * vocab_size
+        for token_id, token in enumerate(tokenizer.convert_ids_to_tokens(list(range(min(vocab_size, len(tokenizer)))))):
+            if token_id not in special_ids and token is not None:
+                texts[token_id] = token.replace('▁', ' ')
+
+        next_state, delta, low = [], [], []
+        for state in STATES:
+            scans = [scan(text, state) for text in texts]
+            next_state.append([STATE_INDEX[end_state] for end_state, _, _ in scans])
+            delta.append([token_delta for _, token_delta, _ in scans])
+            low.append([token_low for _, _, token_low in scans])
+        low = torch.tensor(low, dtype=torch.long)
+
+        self.vocab_size = vocab_size
+        self.eos_token_id = tokenizer.eos_token_id
+        self.next_state = torch.tensor(next_state, dtype=torch.long)
+        self.delta = torch.tensor(delta, dtype=torch.long)
+        # only the tokens that close a bracket from some state are checked against the bounds
+        self.closing_ids = (low < 0).any(dim=2).any(dim=0).nonzero().squeeze(1)
+        self.closing_low = low[:, self.closing_ids]
+        self.final_states = torch.zeros(len(STATES), dtype=torch.bool)
+        self.final_states[FINAL_STATES] = True
+        self._devices = {}
+
+    def to(self, device):
+        """The tables on `device`, copied once."""
+        device = torch.device(device)
+        if device not in self._devices:
+            self._devices[device] = tuple(
+                tensor.to(device) for tensor in (self.next_state, self.delta, self.closing_ids, self.closing_low, self.final_states))
+        return self._devices[device]
+
+
+class PHPConstraintLogitsProcessor(LogitsProcessor):
+    """
+    Masks the tokens that can never lead to a PHP fragment the bug can be fixed with, for every beam at once.
+
+    Every beam carries a scanner state (inside a string / comment, dangling `->` / `::`) and the depth of each bracket
+    type, advanced by the table lookups of `PHPSyntaxTables` for its last token. A token is masked when it would close
+    a bracket below the lowest depth of the buggy hunk (`hunk_bracket_bounds`), and the end of sequence token while the
+    beam is inside a string or a block comment, after a dangling `->` / `::`, or while its bracket depths differ from
+    the net depth change of the hunk. `bounds` holds the bounds of every bug of the batch, the beams of a bug follow
+    each other as in `generate()`.
+
+    Beam search reorders the beams between steps, so the state of a beam is taken from the beam of the previous step
+    with the same prefix (matched through a hash of the prefix within the beams of a bug) instead of rescanning the
+    whole sequence. A beam without such a parent (a processor reused for another generation, another reordering of
+    the beams) is rescanned.
+    """
+
+    def __init__(self, tables, bounds):
+        self.tables = tables
+        self.bounds = list(bounds)
+        self.min_depth = torch.tensor([low for low, _ in self.bounds], dtype=torch.long).view(-1, len(BRACKETS))
+        self.final_depth = torch.tensor([depth for _, depth in self.bounds], dtype=torch.long).view(-1, len(BRACKETS))
+        self._weights = None
+        self._hashes = None
+        self._length = None
+        self._states = None
+        self._depths = None
+
+    def __getitem__(self, index):
+        """The processor of a slice of the bugs, e.g. for the halves of a batch that did not fit in memory."""
+        return PHPConstraintLogitsProcessor(self.tables, self.bounds[index])
+
+    def _prefix_hashes(self, input_ids):
+        # random 64 bit weight per position, the weighted sum wraps around on overflow
+        return (input_ids * self._weights[:input_ids.shape[1]]).sum(dim=1)
+
+    def _advance(self, states, depths, token_ids, next_state, delta):
+        return next_state[states, token_ids], depths + delta[states, token_ids]
+
+    def _scan(self, input_ids, next_state, delta):
+        # the sequences after the decoder start token, from the start state
+        states = torch.full((input_ids.shape[0],), STATE_INDEX[(CODE, NONE)], dtype=torch.long, device=input_ids.device)
+        depths = torch.zeros(input_ids.shape[0], len(BRACKETS), dtype=torch.long, device=input_ids.device)
+        for position in range(1, input_ids.shape[1]):
+            states, depths = self._advance(states, depths, input_ids[:, position], next_state, delta)
+        return states, depths
+
+    def __call__(self, input_ids, scores):
+        next_state, delta, closing_ids, closing_low, final_states = self.tables.to(input_ids.device)
+        num_bugs = self.min_depth.shape[0]
+        num_beams = input_ids.shape[0] // num_bugs
+        min_depth = self.min_depth.to(input_ids.device).repeat_interleave(num_beams, dim=0)
+        final_depth = self.final_depth.to(input_ids.device).repeat_interleave(num_beams, dim=0)
+
+        if self._weights is None or self._weights.shape[0] < input_ids.shape[1] or self._weights.device != input_ids.device:
+            generator = torch.Generator().manual_seed(0)
+            self._weights = torch.randint(-2**62, 2**62, (max(2 * input_ids.shape[1], 256),), generator=generator).to(input_ids.device)
+            self._hashes = None
+
+        prefix_hashes = self._prefix_hashes(input_ids[:, :-1])
+        if self._hashes is not None and self._hashes.shape[0] == input_ids.shape[0] and self._length == input_ids.shape[1] - 1:
+            # the beam of the previous step every beam continues, among the beams of the same bug
+            matches = prefix_hashes.view(num_bugs, num_beams, 1) == self._hashes.view(num_bugs, 1, num_beams)
+            parents = matches.long().argmax(dim=2) + torch.arange(num_bugs, device=input_ids.device).unsqueeze(1) * num_beams
+            parents = parents.view(-1)
+            states, depths = self._advance(self._states[parents], self._depths[parents], input_ids[:, -1], next_state, delta)
+            # argmax picks the first beam of the bug when no beam matches, its state does not belong to the sequence
+            orphans = ~matches.any(dim=2).view(-1)
+            if orphans.any():
+                states[orphans], depths[orphans] = self._scan(input_ids[orphans], next_state, delta)
+        else:
+            # first step of a generation
+            states, depths = self._scan(input_ids, next_state, delta)
+        self._hashes = self._prefix_hashes(input_ids)
+        self._length = input_ids.shape[1]
+        self._states, self._depths = states, depths
+
+        # (beams, closing tokens): the token would close a bracket below the bound
+        too_low = ((depths.unsqueeze(1) + closing_low[states]) < min_depth.unsqueeze(1)).any(dim=2)
+        scores[:, closing_ids] = scores[:, closing_ids].masked_fill(too_low, -float('inf'))
+
+        can_end = final_states[states] & (depths == final_depth).all(dim=1)
+        scores[:, self.tables.eos_token_id] = scores[:, self.tables.eos_token_id].masked_fill(~can_end, -float('inf'))
+        return scores
@@ -0,0 +1,129 @@
+import csv
+import json
+import os
+import queue
+import threading
+import time
+
+
+RESULT_FORMATS = ('tsv', 'jsonl')
+
+
+class ResultWriter:
+    """
+    Streams the generated candidates to one file from a background thread.
+
+    `write()` only queues the candidates of a bug, the thread formats them, buffers the rows and writes them through a
+    single open handle once `flush_rows` rows are pending or `flush_seconds` have passed, so the disk never blocks
+    generation. Formats:
+
+    - `tsv`: the legacy result.csv rows `bugid, bug, patch` (tab separated, unquoted, space as escape character)
+    - `jsonl`: one object per candidate with `bugid`, `bug`, `rank` (0 is the best beam), `score` and `patch`, plus
+      `token_logprobs` when they are given
+
+    The file is opened in append mode like result.csv always was. A flush only holds whole bugs, once it is synced to
+    disk `on_flush(bugids, file_size)` is called with the bugs it completed (see `RunManifest.record`). Errors of the
+    writer thread are raised by the next `write()` or by `close()`.
+    """
+
+    def __init__(self, path, format='tsv', flush_rows=1000, flush_seconds=5.0, max_pending_bugs=64, on_flush=None):
+        if format not in RESULT_FORMATS:
+            raise ValueError('format should be one of {}, got {}'.format(RESULT_FORMATS, format))
+        self.path = path
+        self.format = format
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.on_flush = on_flush
+        self.rows_written = 0
+
+        self._handle = open(path, 'a', newline='' if format == 'tsv' else None)
+        if format == 'tsv':
+            self._csv_writer = csv.writer(self._handle, delimiter='\t', escapechar=' ', quoting=csv.QUOTE_NONE)
+        self._queue = queue.Queue(maxsize=max_pending_bugs)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, bugid, bug, candidates, scores=None, token_logprobs=None):
+        """
+        Queues the ranked candidates of one bug, `scores` are their beam scores and `token_logprobs` the
+        log-probabilities of their tokens when available (`jsonl` only).
+        """
+        self._raise_error()
+        self._queue.put((
+            bugid,
+            bug,
+            list(candidates),
+            None if scores is None else list(scores),
+            None if token_logprobs is None else list(token_logprobs),
+        ))
+
+    def close(self):
+        """Writes the pending rows and closes the file."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if not self._handle.closed:
+            self._handle.close()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('Writing the results to {} failed'.format(self.path)) from error
+
+    def _rows(self, bugid, bug, candidates, scores, token_logprobs):
+        for rank, patch in enumerate(candidates):
+            if self.format == 'tsv':
+                yield [bugid, bug, patch]
+            else:
+                row = {'bugid': bugid, 'bug': bug, 'rank': rank, 'score': None if scores is None else float(scores[rank])}
+                if token_logprobs is not None:
+                    row['token_logprobs'] = token_logprobs[rank]
+                row['patch'] = patch
+                yield json.dumps(row)
+
+    def _flush(self, rows, bugids):
+        if not rows:
+            return
+        if self.format == 'tsv':
+            self._csv_writer.writerows(rows)
+        else:
+            self._handle.write('\n'.join(rows) + '\n')
+        self._handle.flush()
+        self.rows_written += len(rows)
+        if self.on_flush is not None:
+            os.fsync(self._handle.fileno())
+            self.on_flush(list(bugids), os.fstat(self._handle.fileno()).st_size)
+        rows.clear()
+        bugids.clear()
+
+    def _run(self):
+        rows, bugids = [], []
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.flush_seconds)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if item:
+                    rows.extend(self._rows(*item))
+                    bugids.append(item[0])
+                if len(rows) >= self.flush_rows or time.monotonic() - last_flush >= self.flush_seconds:
+                    self._flush(rows, bugids)
+                    last_flush = time.monotonic()
+            self._flush(rows, bugids)
+        except Exception as error:
+            self._error = error
+            # keep draining so that write() never blocks on a full queue
+            while self._queue.get() is not None:
+                pass
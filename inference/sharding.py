@@ -0,0 +1,108 @@
+import json
+import multiprocessing
+import os
+from collections import namedtuple
+
+import torch
+
+
+# one worker process of a sharded run: its bugs and the CPU cores it is pinned to
+Shard = namedtuple('Shard', ['index', 'count', 'bugids', 'cores'])
+
+
+def split_bugs(bugids, lengths, num_shards):
+    """
+    Deals the bugs out to `num_shards` shards, longest source first and round robin, so that every shard gets a
+    similar share of the decoding work. The split only depends on the bugs and their `lengths`.
+    """
+    order = sorted(range(len(bugids)), key=lambda i: (-lengths[i], i))
+    return [[int(bugids[i]) for i in order[shard::num_shards]] for shard in range(num_shards)]
+
+
+def shard_cores(num_shards, cores=None):
+    """Splits the cores this process may run on into `num_shards` contiguous groups of (almost) the same size."""
+    cores = sorted(cores if cores is not None else os.sched_getaffinity(0))
+    if num_shards > len(cores):
+        raise ValueError('{} shards need as many cores, only {} are available'.format(num_shards, len(cores)))
+    size, extra = divmod(len(cores), num_shards)
+    groups, start = [], 0
+    for shard in range(num_shards):
+        end = start + size + (shard < extra)
+        groups.append(cores[start:end])
+        start = end
+    return groups
+
+
+def pin_threads(cores):
+    """Pins the calling process to `cores` and sizes the torch thread pools to them."""
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    torch.set_num_interop_threads(1)
+
+
+def shard_file(path, shard):
+    return '{}.shard-{}-of-{}'.format(path, shard.index, shard.count)
+
+
+def export_shared_weights(model, path):
+    """
+    Saves the weights of `model` as a single file the shard workers memory-map, so that all of them share the page
+    cache of one copy of the weights. The file is only written again when the model was saved after it.
+    """
+    checkpoint_time = max(
+        os.path.getmtime(os.path.join(model.name_or_path, name)) for name in os.listdir(model.name_or_path))
+    if os.path.exists(path) and os.path.getmtime(path) >= checkpoint_time:
+        return path
+    temporary_path = path + '.tmp'
+    torch.save(model.state_dict(), temporary_path)
+    os.replace(temporary_path, path)
+    return path
+
+
+def load_shared_weights(model_class, model_path, weights_path):
+    """
+    Builds `model_class` from the config of `model_path` without initializing its weights and assigns the memory-mapped
+    tensors of `weights_path` (see `export_shared_weights`) to it.
+    """
+    config = model_class.config_class.from_pretrained(model_path)
+    with torch.device('meta'):
+        model = model_class(config)
+    state_dict = torch.load(weights_path, map_location='cpu', mmap=True, weights_only=True)
+    model.load_state_dict(state_dict, assign=True)
+    model.tie_weights()
+    model.name_or_path = model_path
+    return model
+
+
+def run_shards(target, shards):
+    """Runs `target(shard)` for every shard in its own spawned process and waits for all of them."""
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=target, args=(shard,), name='shard-{}'.format(shard.index)) for shard in shards]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    failed = [shard.index for shard, process in zip(shards, processes) if process.exitcode != 0]
+    if failed:
+        raise RuntimeError('Shards {} failed, run again to resume them'.format(failed))
+
+
+def merge_shards(shard_files, result_file, format, bugids):
+    """
+    Appends the rows of the shard result files to `result_file` in the order of `bugids` (the order of the test
+    data), the rows of a bug in the order they were written, and returns the size of the result file. The output
+    does not depend on which shard ran a bug or on when it finished.
+    """
+    rows = {}
+    for path in shard_files:
+        with open(path, newline='' if format == 'tsv' else None) as handle:
+            for line in handle:
+                bugid = int(line.split('\t', 1)[0]) if format == 'tsv' else json.loads(line)['bugid']
+                rows.setdefault(bugid, []).append(line)
+
+    with open(result_file, 'a', newline='' if format == 'tsv' else None) as handle:
+        for bugid in bugids:
+            handle.writelines(rows.get(int(bugid), []))
+        handle.flush()
+        os.fsync(handle.fileno())
+        return os.fstat(handle.fileno()).st_size
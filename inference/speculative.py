@@ -0,0 +1,149 @@
+import torch
+
+
+def crop_past_key_values(past_key_values, length):
+    """
+    Keeps the first `length` positions of the decoder self-attention cache. The cross-attention states of the
+    sources (the other entries of each layer) do not depend on the decoded tokens and are kept as they are.
+    """
+    return tuple(
+        (layer_past[0][:, :, :length], layer_past[1][:, :, :length]) + tuple(layer_past[2:])
+        for layer_past in past_key_values
+        )
+
+
+def encode(model, input_ids, attention_mask):
+    """The concatenated `encoder_outputs` of both sources, as `generate()` passes them to the decoder."""
+    return model.get_encoder_output({'input_ids': input_ids, 'attention_mask': attention_mask, 'return_dict': True})
+
+
+class SpeculativeDecoder:
+    """
+    Greedy decoding of a multi-source model assisted by a smaller multi-source `draft_model` with the same tokenizer.
+
+    The draft proposes up to `num_draft_tokens` tokens greedily, the model scores all of them in one decoder forward
+    over its KV cache and keeps the longest prefix it would have decoded itself, plus its own next token. The output
+    is the greedy output of the model (`generate(num_beams=1)`), the draft only changes how many decoder forwards of
+    the model it takes. As in `transformers` assisted generation, the number of draft tokens grows by 2 after a fully
+    accepted proposal and shrinks by 1 otherwise, within 1 and `max_draft_tokens`.
+
+    Both models keep their own dual-encoder `encoder_outputs` (the two sources concatenated along the sequence) and
+    get the encoder attention mask on every forward. The static cache decoding of the model has to be disabled.
+
+    `drafted` / `accepted` count the proposed and accepted draft tokens, `model_forwards` / `draft_forwards` the
+    decoder forwards of both models and `generated` the generated tokens.
+    """
+
+    def __init__(self, model, draft_model, num_draft_tokens=5, max_draft_tokens=20):
+        if model.config.vocab_size != draft_model.config.vocab_size:
+            raise ValueError('The draft model has a vocabulary of {} tokens, the model {}'.format(
+                draft_model.config.vocab_size, model.config.vocab_size))
+        if getattr(model, 'static_cache_max_length', None) is not None:
+            raise ValueError('Speculative decoding needs the static cache of the model to be disabled')
+        self.model = model
+        self.draft_model = draft_model
+        self.num_draft_tokens = num_draft_tokens
+        self.max_draft_tokens = max_draft_tokens
+        self.drafted = 0
+        self.accepted = 0
+        self.generated = 0
+        self.model_forwards = 0
+        self.draft_forwards = 0
+
+    @property
+    def acceptance_rate(self):
+        return self.accepted / self.drafted if self.drafted else 0.0
+
+    @property
+    def tokens_per_forward(self):
+        """Tokens generated per decoder forward of the model, 1.0 without a draft."""
+        return self.generated / self.model_forwards if self.model_forwards else 0.0
+
+    def reset_stats(self):
+        self.drafted = self.accepted = self.generated = self.model_forwards = self.draft_forwards = 0
+
+    @torch.no_grad()
+    def generate(self, input_ids, attention_mask, max_length=100):
+        """
+        Returns the greedy sequences of the batch (starting with the decoder start token, right padded with the pad
+        token). The bugs of a batch are decoded one after the other, the number of accepted tokens differs per bug.
+        """
+        sequences = [
+            self._generate_one(input_ids[i:i + 1], attention_mask[i:i + 1], max_length)
+            for i in range(input_ids.shape[0])
+            ]
+        output = sequences[0].new_full((len(sequences), max(s.shape[1] for s in sequences)), self.model.config.pad_token_id)
+        for i, sequence in enumerate(sequences):
+            output[i, :sequence.shape[1]] = sequence[0]
+        return output
+
+    def _forward(self, model, decoder_input_ids, encoder_outputs, attention_mask, past_key_values):
+        outputs = model(
+            decoder_input_ids=decoder_input_ids,
+            encoder_outputs=encoder_outputs,
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            use_cache=True,
+            return_dict=True,
+            )
+        return outputs.logits, outputs.past_key_values
+
+    def _generate_one(self, input_ids, attention_mask, max_length):
+        config = self.model.config
+        eos_token_id = config.eos_token_id
+        encoder_outputs = encode(self.model, input_ids, attention_mask)
+        draft_encoder_outputs = encode(self.draft_model, input_ids, attention_mask)
+
+        # the first token is decoded by the model alone, like generate() does, as the parallel model builds the
+        # cross-attention cache of both sources on the first step
+        sequence = torch.full((1, 1), config.decoder_start_token_id, dtype=torch.long, device=input_ids.device)
+        logits, past = self._forward(self.model, sequence, encoder_outputs, attention_mask, None)
+        self.model_forwards += 1
+        self.generated += 1
+        sequence = torch.cat((sequence, logits[:, -1:].argmax(dim=-1)), dim=1)
+        draft_past = None
+        cached, draft_cached = 1, 0
+        num_draft_tokens = self.num_draft_tokens
+        while sequence.shape[1] < max_length and sequence[0, -1].item() != eos_token_id:
+            # 1. greedy proposal of the draft, never past max_length
+            candidates = sequence
+            for _ in range(min(num_draft_tokens, max_length - sequence.shape[1] - 1)):
+                logits, draft_past = self._forward(
+                    self.draft_model, candidates[:, draft_cached:], draft_encoder_outputs, attention_mask, draft_past)
+                draft_cached = candidates.shape[1]
+                self.draft_forwards += 1
+                candidates = torch.cat((candidates, logits[:, -1:].argmax(dim=-1)), dim=1)
+                if candidates[0, -1].item() == eos_token_id:
+                    break
+            drafts = candidates[0, sequence.shape[1]:]
+
+            # 2. one forward of the model over the tokens it has not seen and the proposal
+            logits, past = self._forward(self.model, candidates[:, cached:], encoder_outputs, attention_mask, past)
+            self.model_forwards += 1
+            selected = logits[0, -len(drafts) - 1:].argmax(dim=-1)
+
+            # 3. the drafts up to the first disagreement, then the token of the model
+            matches = int((drafts == selected[:len(drafts)]).long().cumprod(dim=0).sum().item())
+            self.drafted += len(drafts)
+            self.accepted += matches
+            accepted_eos = (drafts[:matches] == eos_token_id).nonzero()
+            if len(accepted_eos):
+                # greedy decoding ends at the accepted EOS, the token the model selects after it is not part of it
+                end = int(accepted_eos[0].item()) + 1
+                sequence = torch.cat((sequence, drafts[:end].unsqueeze(0)), dim=1)
+                self.generated += end
+                break
+            sequence = torch.cat((sequence, drafts[:matches].unsqueeze(0), selected[matches:matches + 1].unsqueeze(0)), dim=1)
+            self.generated += matches + 1
+
+            # 4. the last token of the sequence is fed on the next forward
+            cached = sequence.shape[1] - 1
+            past = crop_past_key_values(past, cached)
+            draft_cached = min(draft_cached, cached)
+            draft_past = crop_past_key_values(draft_past, draft_cached) if draft_past is not None else None
+
+            if len(drafts) and matches == len(drafts):
+                num_draft_tokens = min(self.max_draft_tokens, num_draft_tokens + 2)
+            else:
+                num_draft_tokens = max(1, num_draft_tokens - 1)
+        return sequence
@@ -0,0 +1,173 @@
+import torch
+
+
+class BeamReorderCache:
+    """
+    Preallocated storage for reordering the decoder key / value cache between beam search steps.
+
+    Every cached layer is a tuple whose first `num_self_attn_states` tensors are the self-attention key / value
+    states, followed by the cross-attention key / value states (4 for the serial models, 2 for the parallel ones).
+    The self-attention states are gathered in place into one of two preallocated buffers that are used in turn
+    (ping-pong), so the gather never reads from the buffer it writes to and the same storage is reused across
+    steps and across `generate()` calls. The cross-attention states are returned as they are: beam search only
+    moves beams within the same input and those beams share the same encoder key / value projections.
+    """
+
+    def __init__(self, num_self_attn_states=2, growth_factor=1.5):
+        self.num_self_attn_states = num_self_attn_states
+        self.growth_factor = growth_factor
+        self._buffers = {}
+        self._slot = 0
+
+    def release(self):
+        """Drop the preallocated buffers so that the allocator can reuse their memory."""
+        self._buffers = {}
+        self._slot = 0
+
+    def _get_buffer(self, key, like):
+        buffers = self._buffers.setdefault(key, [None, None])
+        buffer = buffers[self._slot]
+        if (
+            buffer is None
+            or buffer.numel() < like.numel()
+            or buffer.dtype != like.dtype
+            or buffer.device != like.device
+        ):
+            # the self-attention states grow by one position per step, leave room for the next few
+            buffer = torch.empty(int(like.numel() * self.growth_factor), dtype=like.dtype, device=like.device)
+            buffers[self._slot] = buffer
+        return buffer[: like.numel()].view(like.shape)
+
+    def reorder(self, past_key_values, beam_idx):
+        beam_idx_per_device = {}
+        reordered_decoder_past = []
+        for layer_idx, layer_past_states in enumerate(past_key_values):
+            reordered_layer_past_states = []
+            for state_idx, layer_past_state in enumerate(layer_past_states[: self.num_self_attn_states]):
+                device = layer_past_state.device
+                if device not in beam_idx_per_device:
+                    beam_idx_per_device[device] = beam_idx.to(device)
+
+                reordered_state = self._get_buffer((layer_idx, state_idx), layer_past_state)
+                torch.index_select(layer_past_state, 0, beam_idx_per_device[device], out=reordered_state)
+                reordered_layer_past_states.append(reordered_state)
+
+            reordered_decoder_past.append(
+                tuple(reordered_layer_past_states) + tuple(layer_past_states[self.num_self_attn_states :])
+            )
+
+        self._slot = 1 - self._slot
+        return tuple(reordered_decoder_past)
+
+
+class StaticKVCache:
+    """
+    Fixed-shape decoder cache for static decoding.
+
+    The self-attention keys / values of every layer live in `(batch_size, n_heads, max_length, head_dim)` buffers that
+    are written at `position` instead of being concatenated, and the cross-attention keys / values are projected once
+    from the encoder states. Every tensor keeps its shape and storage for the whole generation, and `position` is a
+    tensor, so a decode step over this cache has no data-dependent Python branches and can be compiled with
+    `torch.compile` or captured as a CUDA graph. `length` mirrors `position` on the host for the reordering, which
+    runs outside of the decode step.
+    """
+
+    def __init__(self, self_keys, self_values, cross_key_values, cross_masks, self_bias, max_length):
+        self.self_keys = self_keys
+        self.self_values = self_values
+        self.cross_key_values = cross_key_values
+        self.cross_masks = cross_masks
+        self.self_bias = self_bias
+        self.max_length = max_length
+        self.position = torch.zeros(1, dtype=torch.long, device=self_keys[0].device)
+        self.length = 0
+        self._scratch = None
+
+    @classmethod
+    def allocate(cls, num_layers, batch_size, n_heads, head_dim, max_length, cross_key_values, cross_masks, self_bias):
+        like = cross_key_values[0][0]
+        shape = (batch_size, n_heads, max_length, head_dim)
+        self_keys = [torch.zeros(shape, dtype=like.dtype, device=like.device) for _ in range(num_layers)]
+        self_values = [torch.zeros(shape, dtype=like.dtype, device=like.device) for _ in range(num_layers)]
+        return cls(self_keys, self_values, cross_key_values, cross_masks, self_bias, max_length)
+
+    def matches(self, batch_size, max_length, cross_key_values, cross_masks):
+        return (
+            self.self_keys[0].shape[0] == batch_size
+            and self.max_length == max_length
+            and all(
+                cached.shape == new.shape and cached.dtype == new.dtype and cached.device == new.device
+                for cached_layer, new_layer in zip(self.cross_key_values, cross_key_values)
+                for cached, new in zip(cached_layer, new_layer)
+            )
+            and all(cached.shape == new.shape for cached, new in zip(self.cross_masks, cross_masks))
+        )
+
+    def reset(self, cross_key_values, cross_masks):
+        """Start a new generation in the same storage, which keeps captured CUDA graphs valid."""
+        for cached_layer, new_layer in zip(self.cross_key_values, cross_key_values):
+            for cached, new in zip(cached_layer, new_layer):
+                cached.copy_(new)
+        for cached, new in zip(self.cross_masks, cross_masks):
+            cached.copy_(new)
+        self.position.zero_()
+        self.length = 0
+        return self
+
+    def advance(self):
+        self.position.add_(1)
+        self.length += 1
+
+    def reorder(self, beam_idx):
+        # only the written positions have to follow their beam, the rest is masked out until it is overwritten
+        if self.length == 0:
+            return self
+        beam_idx = beam_idx.to(self.position.device)
+        for buffer in self.self_keys + self.self_values:
+            filled = buffer[:, :, : self.length]
+            if self._scratch is None or self._scratch.numel() < buffer.numel():
+                self._scratch = torch.empty(buffer.numel(), dtype=buffer.dtype, device=buffer.device)
+            reordered = self._scratch[: filled.numel()].view(filled.shape)
+            torch.index_select(filled, 0, beam_idx, out=reordered)
+            filled.copy_(reordered)
+        return self
+
+
+class CUDAGraphDecodeStep:
+    """
+    Replays a decode step captured as a CUDA graph.
+
+    `step(input_ids, static_cache)` must only read and write tensors of `static_cache`, the graph is captured again
+    whenever a different cache is passed in.
+    """
+
+    def __init__(self, step, warmup_steps=2):
+        self.step = step
+        self.warmup_steps = warmup_steps
+        self._graph = None
+        self._cache = None
+        self._static_input_ids = None
+        self._static_output = None
+
+    def _capture(self, input_ids, static_cache):
+        # the warmup steps write the keys / values of the current position, which the first replay writes again
+        self._static_input_ids = input_ids.clone()
+
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(self.warmup_steps):
+                self.step(self._static_input_ids, static_cache)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        self._graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(self._graph):
+            self._static_output = self.step(self._static_input_ids, static_cache)
+        self._cache = static_cache
+
+    def __call__(self, input_ids, static_cache):
+        if self._cache is not static_cache or self._static_input_ids.shape != input_ids.shape:
+            self._capture(input_ids, static_cache)
+        self._static_input_ids.copy_(input_ids)
+        self._graph.replay()
+        return self._static_output
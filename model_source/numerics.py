@@ -0,0 +1,28 @@
+import torch
+
+
+INF_CLAMP_MODES = ("clamp", "off", "check")
+
+
+def clamp_inf_values(hidden_states, mode="clamp", layer_idx=None, sublayer=None):
+    """
+    Overflow handling of the decoder hidden states after each sub-layer.
+
+    `clamp` is the T5 fp16 behaviour: clamp to the fp16 range (1000 below it once any value is inf), which costs a
+    reduction over the hidden states every time. `off` leaves them as they are, for bf16 or for fp16 models that
+    passed a calibration run. `check` is a debug guard that raises on non-finite values in any dtype, it waits for
+    the device on every call.
+    """
+    if mode == "clamp":
+        # clamp inf values to enable fp16 training
+        if hidden_states.dtype == torch.float16:
+            clamp_value = torch.where(
+                torch.isinf(hidden_states).any(),
+                torch.finfo(hidden_states.dtype).max - 1000,
+                torch.finfo(hidden_states.dtype).max,
+            )
+            hidden_states = torch.clamp(hidden_states, min=-clamp_value, max=clamp_value)
+    elif mode == "check":
+        if not torch.isfinite(hidden_states).all():
+            raise FloatingPointError(f"Non-finite {hidden_states.dtype} hidden states after the {sublayer} of decoder layer {layer_idx}")
+    return hidden_states
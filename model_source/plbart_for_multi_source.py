@@ -24,6 +24,7 @@ import gc
 import inspect
 import json
 import os
+from model_source.kv_cache import BeamReorderCache, StaticKVCache, CUDAGraphDecodeStep
 
 
 class PLBartDecoderLayer(nn.Module):
@@ -221,6 +222,63 @@ class PLBartDecoder(PLBartPreTrainedModel):
     def set_input_embeddings(self, value):
         self.embed_tokens = value
 
+    def _static_attention(self, attention, hidden_states, key_states, value_states, attention_mask):
+        bsz = hidden_states.shape[0]
+        query_states = attention._shape(attention.q_proj(hidden_states) * attention.scaling, -1, bsz)
+
+        attn_weights = torch.matmul(query_states, key_states.transpose(2, 3)) + attention_mask
+        attn_weights = nn.functional.softmax(attn_weights, dim=-1)
+
+        attn_output = torch.matmul(attn_weights, value_states).transpose(1, 2).reshape(bsz, -1, attention.embed_dim)
+        return attention.out_proj(attn_output)
+
+    def static_step(self, input_ids, static_cache):
+        """
+        Decodes the next token of every beam over a `StaticKVCache` (inference only, dropout is not applied).
+
+        The new self-attention keys / values are written at `static_cache.position` and the attention always spans
+        the `max_length` buffers, positions after the current one are masked by `static_cache.self_bias`. Shapes do not
+        depend on the position, so this step can be compiled or captured as a CUDA graph.
+        """
+        bsz = input_ids.shape[0]
+        position = static_cache.position
+
+        inputs_embeds = self.embed_tokens(input_ids) * self.embed_scale
+        positions = self.embed_positions.weight.index_select(0, position + self.embed_positions.offset)
+        hidden_states = self.layernorm_embedding(inputs_embeds + positions)
+
+        self_attn_mask = static_cache.self_bias.index_select(2, position)
+        encoder_attention_mask_1, encoder_attention_mask_2 = static_cache.cross_masks
+
+        for idx, decoder_layer in enumerate(self.layers):
+            self_attn = decoder_layer.self_attn
+            static_cache.self_keys[idx].index_copy_(2, position, self_attn._shape(self_attn.k_proj(hidden_states), -1, bsz))
+            static_cache.self_values[idx].index_copy_(2, position, self_attn._shape(self_attn.v_proj(hidden_states), -1, bsz))
+
+            residual = hidden_states
+            hidden_states = residual + self._static_attention(
+                self_attn, hidden_states, static_cache.self_keys[idx], static_cache.self_values[idx], self_attn_mask
+            )
+            hidden_states = decoder_layer.self_attn_layer_norm(hidden_states)
+
+            # both cross attentions add to the residual taken before the 1st one, as in `PLBartDecoderLayer`
+            key_states_1, value_states_1, key_states_2, value_states_2 = static_cache.cross_key_values[idx]
+            residual = hidden_states
+            hidden_states = residual + self._static_attention(
+                decoder_layer.encoder_attn_1, hidden_states, key_states_1, value_states_1, encoder_attention_mask_1
+            )
+            hidden_states = decoder_layer.encoder_attn_layer_norm_1(hidden_states)
+            hidden_states = residual + self._static_attention(
+                decoder_layer.encoder_attn_2, hidden_states, key_states_2, value_states_2, encoder_attention_mask_2
+            )
+            hidden_states = decoder_layer.encoder_attn_layer_norm_2(hidden_states)
+
+            residual = hidden_states
+            hidden_states = decoder_layer.fc2(decoder_layer.activation_fn(decoder_layer.fc1(hidden_states)))
+            hidden_states = decoder_layer.final_layer_norm(residual + hidden_states)
+
+        return hidden_states
+
     def _prepare_decoder_attention_mask(self, attention_mask, input_shape, inputs_embeds, past_key_values_length):
         # create causal mask
         # [bsz, seq_len] -> [bsz, 1, tgt_seq_len, src_seq_len]
@@ -564,10 +622,9 @@ class PLBartModel(PLBartPreTrainedModel):
         encoder_outputs_1 = None
         encoder_outputs_2 = None
         if(encoder_outputs is not None):
-            encoder_outputs_1 = copy.deepcopy(encoder_outputs)
-            encoder_outputs_2 = copy.deepcopy(encoder_outputs)
-            encoder_outputs_1['last_hidden_state'] = torch.stack((list(map(lambda x:x[:encoder_outputs[0].shape[1]//2] , encoder_outputs[0]))), dim=0)
-            encoder_outputs_2['last_hidden_state'] = torch.stack((list(map(lambda x:x[encoder_outputs[0].shape[1]//2:] , encoder_outputs[0]))), dim=0)
+            # views on the concatenated encoder states, deep copying them would run on every generated token
+            encoder_outputs_1 = BaseModelOutput(last_hidden_state=encoder_outputs[0][:, :encoder_outputs[0].shape[1]//2])
+            encoder_outputs_2 = BaseModelOutput(last_hidden_state=encoder_outputs[0][:, encoder_outputs[0].shape[1]//2:])
 
 
 
@@ -731,10 +788,9 @@ class PLBartModel(PLBartPreTrainedModel):
         encoder_outputs_1 = None
         encoder_outputs_2 = None
         if(encoder_outputs is not None):
-            encoder_outputs_1 = copy.deepcopy(encoder_outputs)
-            encoder_outputs_2 = copy.deepcopy(encoder_outputs)
-            encoder_outputs_1['last_hidden_state'] = torch.stack((list(map(lambda x:x[:encoder_outputs[0].shape[1]//2] , encoder_outputs[0]))), dim=0)
-            encoder_outputs_2['last_hidden_state'] = torch.stack((list(map(lambda x:x[encoder_outputs[0].shape[1]//2:] , encoder_outputs[0]))), dim=0)
+            # views on the concatenated encoder states, deep copying them would run on every generated token
+            encoder_outputs_1 = BaseModelOutput(last_hidden_state=encoder_outputs[0][:, :encoder_outputs[0].shape[1]//2])
+            encoder_outputs_2 = BaseModelOutput(last_hidden_state=encoder_outputs[0][:, encoder_outputs[0].shape[1]//2:])
 
 
 
@@ -841,6 +897,12 @@ class PLBartForMultiSourceConditionalGeneration(PLBartPreTrainedModel):
         self.model = PLBartModel(config)
         self.register_buffer("final_logits_bias", torch.zeros((1, self.model.shared.num_embeddings)))
         self.lm_head = nn.Linear(config.d_model, self.model.shared.num_embeddings, bias=False)
+        self.beam_reorder_cache = BeamReorderCache()
+
+        # static cache decoding, see `enable_static_cache`
+        self.static_cache_max_length = None
+        self.static_decode_step = None
+        self.static_cache = None
 
         self.init_weights()
 
@@ -870,6 +932,80 @@ class PLBartForMultiSourceConditionalGeneration(PLBartPreTrainedModel):
     def set_output_embeddings(self, new_embeddings):
         self.lm_head = new_embeddings
 
+    def enable_static_cache(self, max_length, compile=False, cuda_graph=False):
+        """
+        Makes `generate()` decode over a preallocated `StaticKVCache` of `max_length` positions, which has to cover
+        the `max_length` passed to `generate()`. The per-token decoder step can be wrapped with `torch.compile` and / or
+        captured as a CUDA graph, the cache storage is reused by the following generations of the same shape.
+        """
+        step = self.model.decoder.static_step
+        if compile:
+            step = torch.compile(step)
+        if cuda_graph:
+            step = CUDAGraphDecodeStep(step)
+
+        self.static_cache_max_length = max_length
+        self.static_decode_step = step
+        self.static_cache = None
+
+    def disable_static_cache(self):
+        self.static_cache_max_length = None
+        self.static_decode_step = None
+        self.static_cache = None
+
+    def _prepare_static_cache(self, encoder_outputs, attention_mask):
+        encoder_hidden_states = encoder_outputs[0]
+        bsz, encoder_seq_length = encoder_hidden_states.shape[:2]
+        if attention_mask is None:
+            attention_mask = torch.ones(bsz, encoder_seq_length, device=encoder_hidden_states.device, dtype=torch.long)
+
+        dtype = encoder_hidden_states.dtype
+        cross_masks = (
+            _expand_mask(attention_mask[:, : encoder_seq_length // 2], dtype, tgt_len=1),
+            _expand_mask(attention_mask[:, encoder_seq_length // 2 :], dtype, tgt_len=1),
+        )
+        encoder_hidden_states_1 = encoder_hidden_states[:, : encoder_seq_length // 2]
+        encoder_hidden_states_2 = encoder_hidden_states[:, encoder_seq_length // 2 :]
+
+        cross_key_values = []
+        for decoder_layer in self.model.decoder.layers:
+            layer_cross_key_values = ()
+            for attention, states in ((decoder_layer.encoder_attn_1, encoder_hidden_states_1), (decoder_layer.encoder_attn_2, encoder_hidden_states_2)):
+                layer_cross_key_values += (attention._shape(attention.k_proj(states), -1, bsz), attention._shape(attention.v_proj(states), -1, bsz))
+            cross_key_values.append(layer_cross_key_values)
+
+        max_length = self.static_cache_max_length
+        if self.static_cache is not None and self.static_cache.matches(bsz, max_length, cross_key_values, cross_masks):
+            return self.static_cache.reset(cross_key_values, cross_masks)
+
+        # keys after the query position are masked out
+        self_attn = self.model.decoder.layers[0].self_attn
+        self_bias = torch.full((max_length, max_length), torch.finfo(dtype).min, dtype=dtype, device=encoder_hidden_states.device)
+        self_bias = self_bias.triu(1)[None, None, :, :]
+
+        self.static_cache = StaticKVCache.allocate(
+            num_layers=len(self.model.decoder.layers),
+            batch_size=bsz,
+            n_heads=self_attn.num_heads,
+            head_dim=self_attn.head_dim,
+            max_length=max_length,
+            cross_key_values=cross_key_values,
+            cross_masks=cross_masks,
+            self_bias=self_bias,
+        )
+        return self.static_cache
+
+    def _static_forward(self, decoder_input_ids, static_cache, return_dict):
+        sequence_output = self.static_decode_step(decoder_input_ids, static_cache)
+        static_cache.advance()
+
+        lm_logits = self.lm_head(sequence_output)
+        lm_logits = lm_logits + self.final_logits_bias.to(lm_logits.device)
+
+        if not return_dict:
+            return (lm_logits, static_cache)
+        return Seq2SeqLMOutput(logits=lm_logits, past_key_values=static_cache)
+
     def get_encoder_output(self, encoder_kwargs):
         input_ids = encoder_kwargs['input_ids']
         attention_mask = encoder_kwargs['attention_mask']
@@ -936,6 +1072,8 @@ class PLBartForMultiSourceConditionalGeneration(PLBartPreTrainedModel):
 
         """
         return_dict = return_dict if return_dict is not None else self.config.use_return_dict
+        if isinstance(past_key_values, StaticKVCache):
+            return self._static_forward(decoder_input_ids, past_key_values, return_dict)
 
         if labels is not None:
             if decoder_input_ids is None and decoder_inputs_embeds is None:
@@ -995,6 +1133,11 @@ class PLBartForMultiSourceConditionalGeneration(PLBartPreTrainedModel):
         encoder_outputs: Optional[List[torch.FloatTensor]] = None,
         **kwargs,  # TODO: Check if this is needed. It is unused?
     ) -> Dict[str, Any]:
+        if self.static_cache_max_length is not None and past_key_values is None:
+            if decoder_input_ids.shape[1] != 1:
+                raise ValueError("Static cache decoding has to start from the decoder start token only")
+            past_key_values = self._prepare_static_cache(encoder_outputs, attention_mask)
+
         # cut decoder_input_ids if past is used
         if past_key_values is not None:
             decoder_input_ids = decoder_input_ids[:, -1:]
@@ -1014,15 +1157,13 @@ class PLBartForMultiSourceConditionalGeneration(PLBartPreTrainedModel):
     def prepare_decoder_input_ids_from_labels(self, labels: torch.Tensor):
         return shift_tokens_right(labels, self.config.pad_token_id)
 
-    @staticmethod
-    def _reorder_cache(past_key_values, beam_idx):
-        reordered_past = ()
-        for layer_past in past_key_values:
-            # cached cross_attention states don't have to be reordered -> they are always the same
-            reordered_past += (
-                tuple(past_state.index_select(0, beam_idx) for past_state in layer_past[:2]) + layer_past[2:],
-            )
-        return reordered_past
+    def _reorder_cache(self, past_key_values, beam_idx):
+        if isinstance(past_key_values, StaticKVCache):
+            return past_key_values.reorder(beam_idx)
+
+        # cached cross_attention states don't have to be reordered -> they are always the same
+        # self-attention states are gathered into preallocated buffers (6 past states per layer)
+        return self.beam_reorder_cache.reorder(past_key_values, beam_idx)
 
 
     def _prepare_encoder_decoder_kwargs_for_generation(self, inputs_tensor: torch.Tensor, model_kwargs, model_input_name: Optional[str] = None) -> Dict[str, Any]:
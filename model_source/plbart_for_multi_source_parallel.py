@@ -24,6 +24,7 @@ import gc
 import inspect
 import json
 import os
+from model_source.kv_cache import BeamReorderCache
 
 class PLBartDecoderLayer(nn.Module):
     def __init__(self, config: PLBartConfig):
@@ -573,10 +574,9 @@ class PLBartModel(PLBartPreTrainedModel):
         encoder_outputs_1 = None
         encoder_outputs_2 = None
         if(encoder_outputs is not None):
-            encoder_outputs_1 = copy.deepcopy(encoder_outputs)
-            encoder_outputs_2 = copy.deepcopy(encoder_outputs)
-            encoder_outputs_1['last_hidden_state'] = torch.stack((list(map(lambda x:x[:encoder_outputs[0].shape[1]//2] , encoder_outputs[0]))), dim=0)
-            encoder_outputs_2['last_hidden_state'] = torch.stack((list(map(lambda x:x[encoder_outputs[0].shape[1]//2:] , encoder_outputs[0]))), dim=0)
+            # views on the concatenated encoder states, deep copying them would run on every generated token
+            encoder_outputs_1 = BaseModelOutput(last_hidden_state=encoder_outputs[0][:, :encoder_outputs[0].shape[1]//2])
+            encoder_outputs_2 = BaseModelOutput(last_hidden_state=encoder_outputs[0][:, encoder_outputs[0].shape[1]//2:])
 
 
 
@@ -678,6 +678,7 @@ class PLBartForMultiSourceParallelConditionalGeneration(PLBartPreTrainedModel):
         self.model = PLBartModel(config)
         self.register_buffer("final_logits_bias", torch.zeros((1, self.model.shared.num_embeddings)))
         self.lm_head = nn.Linear(config.d_model, self.model.shared.num_embeddings, bias=False)
+        self.beam_reorder_cache = BeamReorderCache()
 
         self.init_weights()
 
@@ -845,15 +846,10 @@ class PLBartForMultiSourceParallelConditionalGeneration(PLBartPreTrainedModel):
     def prepare_decoder_input_ids_from_labels(self, labels: torch.Tensor):
         return shift_tokens_right(labels, self.config.pad_token_id)
 
-    @staticmethod
-    def _reorder_cache(past_key_values, beam_idx):
-        reordered_past = ()
-        for layer_past in past_key_values:
-            # cached cross_attention states don't have to be reordered -> they are always the same
-            reordered_past += (
-                tuple(past_state.index_select(0, beam_idx) for past_state in layer_past[:2]) + layer_past[2:],
-            )
-        return reordered_past
+    def _reorder_cache(self, past_key_values, beam_idx):
+        # cached cross_attention states don't have to be reordered -> they are always the same
+        # self-attention states are gathered into preallocated buffers (4 past states per layer)
+        return self.beam_reorder_cache.reorder(past_key_values, beam_idx)
 
 
     def _prepare_encoder_decoder_kwargs_for_generation(self, inputs_tensor: torch.Tensor, model_kwargs, model_input_name: Optional[str] = None) -> Dict[str, Any]:
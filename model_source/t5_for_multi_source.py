@@ -15,12 +15,17 @@ import gc
 import inspect
 import json
 import os
+from model_source.kv_cache import BeamReorderCache, StaticKVCache, CUDAGraphDecodeStep
+from model_source.t5_sdpa_attention import set_attention_backend
+from model_source.numerics import INF_CLAMP_MODES, clamp_inf_values
 
 
 class T5BlockDecoder(nn.Module):
-    def __init__(self, config, has_relative_attention_bias=False):
+    def __init__(self, config, has_relative_attention_bias=False, layer_idx=None):
         super().__init__()
         self.is_decoder = True
+        self.layer_idx = layer_idx
+        self.inf_clamp_mode = getattr(config, "inf_clamp_mode", "clamp")
         self.layer = nn.ModuleList()
         self.layer.append(T5LayerSelfAttention(config, has_relative_attention_bias=has_relative_attention_bias))
         self.layer.append(T5LayerCrossAttention(config))
@@ -76,14 +81,7 @@ class T5BlockDecoder(nn.Module):
         hidden_states, present_key_value_state = self_attention_outputs[:2]
         attention_outputs = self_attention_outputs[2:]  # Keep self-attention outputs and relative position weights
 
-        # clamp inf values to enable fp16 training
-        if hidden_states.dtype == torch.float16:
-            clamp_value = torch.where(
-                torch.isinf(hidden_states).any(),
-                torch.finfo(hidden_states.dtype).max - 1000,
-                torch.finfo(hidden_states.dtype).max,
-            )
-            hidden_states = torch.clamp(hidden_states, min=-clamp_value, max=clamp_value)
+        hidden_states = clamp_inf_values(hidden_states, self.inf_clamp_mode, self.layer_idx, "self-attention")
 
 
         # 1st cross attention
@@ -111,14 +109,7 @@ class T5BlockDecoder(nn.Module):
             hidden_states = cross_attention_outputs[0]
             attention_outputs = attention_outputs + cross_attention_outputs[2:]
 
-            # clamp inf values to enable fp16 training
-            if hidden_states.dtype == torch.float16:
-                clamp_value = torch.where(
-                    torch.isinf(hidden_states).any(),
-                    torch.finfo(hidden_states.dtype).max - 1000,
-                    torch.finfo(hidden_states.dtype).max,
-                )
-                hidden_states = torch.clamp(hidden_states, min=-clamp_value, max=clamp_value)
+            hidden_states = clamp_inf_values(hidden_states, self.inf_clamp_mode, self.layer_idx, "1st cross attention")
 
             # Combine self attn and cross attn key value states
             if present_key_value_state is not None:
@@ -144,14 +135,7 @@ class T5BlockDecoder(nn.Module):
             )
             hidden_states = cross_attention_outputs[0]
 
-            # clamp inf values to enable fp16 training
-            if hidden_states.dtype == torch.float16:
-                clamp_value = torch.where(
-                    torch.isinf(hidden_states).any(),
-                    torch.finfo(hidden_states.dtype).max - 1000,
-                    torch.finfo(hidden_states.dtype).max,
-                )
-                hidden_states = torch.clamp(hidden_states, min=-clamp_value, max=clamp_value)
+            hidden_states = clamp_inf_values(hidden_states, self.inf_clamp_mode, self.layer_idx, "2nd cross attention")
 
             # Combine self attn and cross attn key value states
             if present_key_value_state is not None:
@@ -163,14 +147,7 @@ class T5BlockDecoder(nn.Module):
         # Apply Feed Forward layer
         hidden_states = self.layer[-1](hidden_states)
 
-        # clamp inf values to enable fp16 training
-        if hidden_states.dtype == torch.float16:
-            clamp_value = torch.where(
-                torch.isinf(hidden_states).any(),
-                torch.finfo(hidden_states.dtype).max - 1000,
-                torch.finfo(hidden_states.dtype).max,
-            )
-            hidden_states = torch.clamp(hidden_states, min=-clamp_value, max=clamp_value)
+        hidden_states = clamp_inf_values(hidden_states, self.inf_clamp_mode, self.layer_idx, "feed forward")
 
         outputs = (hidden_states,)
 
@@ -192,7 +169,7 @@ class T5StackDecoder(T5PreTrainedModel):
         self.is_decoder = config.is_decoder
 
         self.block = nn.ModuleList(
-            [T5BlockDecoder(config, has_relative_attention_bias=bool(i == 0)) for i in range(config.num_layers)]
+            [T5BlockDecoder(config, has_relative_attention_bias=bool(i == 0), layer_idx=i) for i in range(config.num_layers)]
         )
         self.final_layer_norm = T5LayerNorm(config.d_model, eps=config.layer_norm_epsilon)
         self.dropout = nn.Dropout(config.dropout_rate)
@@ -210,6 +187,63 @@ class T5StackDecoder(T5PreTrainedModel):
     def set_input_embeddings(self, new_embeddings):
         self.embed_tokens = new_embeddings
 
+    def _static_attention(self, attention, hidden_states, key_states, value_states, position_bias):
+        batch_size = hidden_states.shape[0]
+        query_states = attention.q(hidden_states).view(batch_size, -1, attention.n_heads, attention.key_value_proj_dim).transpose(1, 2)
+
+        scores = torch.matmul(query_states, key_states.transpose(3, 2)) + position_bias
+        attn_weights = nn.functional.softmax(scores.float(), dim=-1).type_as(scores)
+
+        attn_output = torch.matmul(attn_weights, value_states).transpose(1, 2).contiguous().view(batch_size, -1, attention.inner_dim)
+        return attention.o(attn_output)
+
+    def static_step(self, input_ids, static_cache):
+        """
+        Decodes the next token of every beam over a `StaticKVCache` (inference only, dropout is not applied).
+
+        The new self-attention keys / values are written at `static_cache.position` and the attention always spans
+        the `max_length` buffers, positions after the current one are masked by `static_cache.self_bias`. Shapes do not
+        depend on the position, so this step can be compiled or captured as a CUDA graph.
+        """
+        batch_size = input_ids.shape[0]
+        position = static_cache.position
+
+        hidden_states = self.embed_tokens(input_ids)
+        self_position_bias = static_cache.self_bias.index_select(2, position)
+
+        for i, layer_module in enumerate(self.block):
+            self_attention = layer_module.layer[0]
+            attention = self_attention.SelfAttention
+            normed_hidden_states = self_attention.layer_norm(hidden_states)
+
+            key_states = attention.k(normed_hidden_states).view(batch_size, -1, attention.n_heads, attention.key_value_proj_dim).transpose(1, 2)
+            value_states = attention.v(normed_hidden_states).view(batch_size, -1, attention.n_heads, attention.key_value_proj_dim).transpose(1, 2)
+            static_cache.self_keys[i].index_copy_(2, position, key_states)
+            static_cache.self_values[i].index_copy_(2, position, value_states)
+
+            hidden_states = hidden_states + self._static_attention(
+                attention, normed_hidden_states, static_cache.self_keys[i], static_cache.self_values[i], self_position_bias
+            )
+            hidden_states = clamp_inf_values(hidden_states, layer_module.inf_clamp_mode, i, "self-attention")
+
+            # the eager path shares the position bias of the 1st cross attention of the first block with every later
+            # cross attention, so only the first block attends to the 2nd source with its own mask
+            cross_masks = static_cache.cross_masks if i == 0 else (static_cache.cross_masks[0], static_cache.cross_masks[0])
+            for j, cross_attention in enumerate(layer_module.layer[1:3]):
+                normed_hidden_states = cross_attention.layer_norm(hidden_states)
+                hidden_states = hidden_states + self._static_attention(
+                    cross_attention.EncDecAttention,
+                    normed_hidden_states,
+                    static_cache.cross_key_values[i][2 * j],
+                    static_cache.cross_key_values[i][2 * j + 1],
+                    cross_masks[j],
+                )
+                hidden_states = clamp_inf_values(hidden_states, layer_module.inf_clamp_mode, i, ("1st cross attention", "2nd cross attention")[j])
+
+            hidden_states = clamp_inf_values(layer_module.layer[-1](hidden_states), layer_module.inf_clamp_mode, i, "feed forward")
+
+        return self.final_layer_norm(hidden_states)
+
     def forward(
         self,
         input_ids=None,
@@ -445,6 +479,30 @@ class T5StackDecoder(T5PreTrainedModel):
         )
 
 
+class T5SourceAdapter(nn.Module):
+    """Bottleneck adapter on the tied encoder output of one source, the identity until it is trained."""
+
+    def __init__(self, config):
+        super().__init__()
+        self.layer_norm = T5LayerNorm(config.d_model, eps=config.layer_norm_epsilon)
+        self.down = nn.Linear(config.d_model, config.source_adapter_dim, bias=False)
+        self.up = nn.Linear(config.source_adapter_dim, config.d_model, bias=False)
+        nn.init.zeros_(self.up.weight)
+
+    def forward(self, hidden_states):
+        return hidden_states + self.up(nn.functional.relu(self.down(self.layer_norm(hidden_states))))
+
+
+def _split_sources(states):
+    """Splits encoder states of the two sources batched together back into one value per source."""
+    if states is None:
+        return None, None
+    if isinstance(states, tuple):
+        splits = [_split_sources(state) for state in states]
+        return tuple(split[0] for split in splits), tuple(split[1] for split in splits)
+    return states.chunk(2, dim=0)
+
+
 
 # @add_start_docstrings("""T5 Model with a `language modeling` head on top.""", T5_START_DOCSTRING)
 class T5ForMultiSourceConditionalGeneration(T5PreTrainedModel):
@@ -468,7 +526,18 @@ class T5ForMultiSourceConditionalGeneration(T5PreTrainedModel):
         encoder_config.use_cache = False
         encoder_config.is_encoder_decoder = False
         self.encoder_1 = T5Stack(encoder_config, self.shared)
-        self.encoder_2 = T5Stack(encoder_config, self.shared)
+        if not getattr(config, "tie_encoders", False):
+            self.encoder_2 = T5Stack(encoder_config, self.shared)
+
+        # tied encoders can tell the sources apart through a source-type embedding and / or an adapter per source
+        self.source_type_embeddings = None
+        self.source_adapters = None
+        if getattr(config, "tie_encoders", False):
+            if getattr(config, "source_type_embeddings", False):
+                self.source_type_embeddings = nn.Embedding(2, config.d_model)
+                nn.init.zeros_(self.source_type_embeddings.weight)
+            if getattr(config, "source_adapter_dim", 0):
+                self.source_adapters = nn.ModuleList([T5SourceAdapter(config) for _ in range(2)])
 
         decoder_config = copy.deepcopy(config)
         decoder_config.is_decoder = True
@@ -478,15 +547,220 @@ class T5ForMultiSourceConditionalGeneration(T5PreTrainedModel):
 
         self.lm_head = nn.Linear(config.d_model, config.vocab_size, bias=False)
 
+        self.beam_reorder_cache = BeamReorderCache()
+
+        # static cache decoding, see `enable_static_cache`
+        self.static_cache_max_length = None
+        self.static_decode_step = None
+        self.static_cache = None
+
         # Initialize weights and apply final processing
         self.post_init()
 
+        # "eager" or "sdpa", stored in the config so that it is saved with the model
+        self.set_attention_backend(getattr(config, "attention_backend", "eager"))
+        self.set_inf_clamp_mode(getattr(config, "inf_clamp_mode", "clamp"))
+
         # Model parallel
         self.model_parallel = False
         self.device_map = None
 
 
 
+    @property
+    def encoder_2(self):
+        """
+        The encoder of the second source (`buggy`). With `config.tie_encoders` it is `encoder_1`, so the checkpoint
+        holds a single encoder stack. Loading an untied checkpoint with `tie_encoders` set in the config keeps its
+        `encoder_1` for both sources, which also accepts `source_type_embeddings` and `source_adapter_dim` (adapter
+        bottleneck size) options that start as the identity.
+        """
+        if "encoder_2" in self._modules:
+            return self._modules["encoder_2"]
+        return self.encoder_1
+
+    def encode_sources(self, input_ids_1, attention_mask_1, input_ids_2, attention_mask_2, **encoder_kwargs):
+        """
+        Runs `encoder_1` over the first source and `encoder_2` over the second one. Tied encoders encode both
+        sources in one call over the two inputs stacked along the batch when they have the same shape.
+        """
+        if not getattr(self.config, "tie_encoders", False):
+            encoder_outputs_1 = self.encoder_1(input_ids=input_ids_1, attention_mask=attention_mask_1, **encoder_kwargs)
+            encoder_outputs_2 = self.encoder_2(input_ids=input_ids_2, attention_mask=attention_mask_2, **encoder_kwargs)
+            return encoder_outputs_1, encoder_outputs_2
+
+        if encoder_kwargs.pop("inputs_embeds", None) is not None:
+            raise ValueError("inputs_embeds are not supported with tie_encoders, pass input_ids")
+
+        inputs_embeds_1 = self._source_inputs_embeds(input_ids_1, 0)
+        inputs_embeds_2 = self._source_inputs_embeds(input_ids_2, 1)
+
+        if input_ids_1.shape == input_ids_2.shape and (attention_mask_1 is None) == (attention_mask_2 is None):
+            encoder_outputs = self.encoder_1(
+                input_ids=torch.cat((input_ids_1, input_ids_2), dim=0) if inputs_embeds_1 is None else None,
+                attention_mask=torch.cat((attention_mask_1, attention_mask_2), dim=0) if attention_mask_1 is not None else None,
+                inputs_embeds=torch.cat((inputs_embeds_1, inputs_embeds_2), dim=0) if inputs_embeds_1 is not None else None,
+                **encoder_kwargs,
+            )
+            last_hidden_state_1, last_hidden_state_2 = _split_sources(encoder_outputs.last_hidden_state)
+            hidden_states_1, hidden_states_2 = _split_sources(encoder_outputs.hidden_states)
+            attentions_1, attentions_2 = _split_sources(encoder_outputs.attentions)
+            encoder_outputs_1 = BaseModelOutputWithPastAndCrossAttentions(
+                last_hidden_state=last_hidden_state_1, hidden_states=hidden_states_1, attentions=attentions_1
+            )
+            encoder_outputs_2 = BaseModelOutputWithPastAndCrossAttentions(
+                last_hidden_state=last_hidden_state_2, hidden_states=hidden_states_2, attentions=attentions_2
+            )
+        else:
+            encoder_outputs_1 = self.encoder_1(
+                input_ids=input_ids_1 if inputs_embeds_1 is None else None,
+                attention_mask=attention_mask_1,
+                inputs_embeds=inputs_embeds_1,
+                **encoder_kwargs,
+            )
+            encoder_outputs_2 = self.encoder_1(
+                input_ids=input_ids_2 if inputs_embeds_2 is None else None,
+                attention_mask=attention_mask_2,
+                inputs_embeds=inputs_embeds_2,
+                **encoder_kwargs,
+            )
+
+        if self.source_adapters is not None:
+            encoder_outputs_1["last_hidden_state"] = self.source_adapters[0](encoder_outputs_1.last_hidden_state)
+            encoder_outputs_2["last_hidden_state"] = self.source_adapters[1](encoder_outputs_2.last_hidden_state)
+        return encoder_outputs_1, encoder_outputs_2
+
+    def _source_inputs_embeds(self, input_ids, source):
+        if self.source_type_embeddings is None:
+            return None
+        return self.shared(input_ids) + self.source_type_embeddings.weight[source]
+
+    def set_attention_backend(self, backend):
+        """
+        Computes the attention of both encoders and of the decoder with the `eager` T5 implementation or with
+        `scaled_dot_product_attention` (`sdpa`), which falls back to `eager` when attention weights are requested.
+        """
+        set_attention_backend(self, backend)
+        self.config.attention_backend = backend
+
+    def set_inf_clamp_mode(self, mode):
+        """
+        Sets how the decoder blocks handle fp16 overflows after each sub-layer: `clamp` (default), `off` or the
+        per-layer `check` debug guard, see `clamp_inf_values`.
+        """
+        if mode not in INF_CLAMP_MODES:
+            raise ValueError(f"inf_clamp_mode should be one of {INF_CLAMP_MODES}, got {mode}")
+        for block in self.decoder.block:
+            block.inf_clamp_mode = mode
+        self.config.inf_clamp_mode = mode
+
+    def enable_half_precision_inference(self, dtype=torch.bfloat16, calibration_batches=None):
+        """
+        Casts the model to `dtype` and turns the decoder inf clamps off. bf16 has the exponent range of fp32 and never
+        needs them. fp16 first generates `calibration_batches` (dicts of `generate()` kwargs) with the `check` guards
+        and only turns the clamps off when none of them overflows. Returns whether the clamps were turned off.
+        """
+        if dtype not in (torch.bfloat16, torch.float16):
+            raise ValueError(f"dtype should be torch.bfloat16 or torch.float16, got {dtype}")
+
+        self.to(dtype)
+        if dtype == torch.bfloat16:
+            self.set_inf_clamp_mode("off")
+            return True
+
+        if not calibration_batches:
+            raise ValueError("fp16 inference without the inf clamps needs calibration_batches")
+        self.set_inf_clamp_mode("check")
+        try:
+            with torch.no_grad():
+                for batch in calibration_batches:
+                    self.generate(**batch)
+        except FloatingPointError as error:
+            warnings.warn(f"Keeping the fp16 inf clamps, the calibration overflowed: {error}")
+            self.set_inf_clamp_mode("clamp")
+            return False
+        self.set_inf_clamp_mode("off")
+        return True
+
+    def enable_static_cache(self, max_length, compile=False, cuda_graph=False):
+        """
+        Makes `generate()` decode over a preallocated `StaticKVCache` of `max_length` positions, which has to cover
+        the `max_length` passed to `generate()`. The per-token decoder step can be wrapped with `torch.compile` and / or
+        captured as a CUDA graph, the cache storage is reused by the following generations of the same shape.
+        """
+        step = self.decoder.static_step
+        if compile:
+            step = torch.compile(step)
+        if cuda_graph:
+            step = CUDAGraphDecodeStep(step)
+
+        self.static_cache_max_length = max_length
+        self.static_decode_step = step
+        self.static_cache = None
+
+    def disable_static_cache(self):
+        self.static_cache_max_length = None
+        self.static_decode_step = None
+        self.static_cache = None
+
+    def _prepare_static_cache(self, encoder_outputs, attention_mask):
+        encoder_hidden_states = encoder_outputs[0]
+        batch_size, encoder_seq_length = encoder_hidden_states.shape[:2]
+        if attention_mask is None:
+            attention_mask = torch.ones(batch_size, encoder_seq_length, device=encoder_hidden_states.device, dtype=torch.long)
+
+        cross_masks = (
+            self.decoder.invert_attention_mask(attention_mask[:, : encoder_seq_length // 2]),
+            self.decoder.invert_attention_mask(attention_mask[:, encoder_seq_length // 2 :]),
+        )
+        encoder_hidden_states_1 = encoder_hidden_states[:, : encoder_seq_length // 2]
+        encoder_hidden_states_2 = encoder_hidden_states[:, encoder_seq_length // 2 :]
+
+        cross_key_values = []
+        for layer_module in self.decoder.block:
+            layer_cross_key_values = ()
+            for cross_attention, states in zip(layer_module.layer[1:3], (encoder_hidden_states_1, encoder_hidden_states_2)):
+                attention = cross_attention.EncDecAttention
+                layer_cross_key_values = layer_cross_key_values + tuple(
+                    proj(states).view(batch_size, -1, attention.n_heads, attention.key_value_proj_dim).transpose(1, 2).contiguous()
+                    for proj in (attention.k, attention.v)
+                )
+            cross_key_values.append(layer_cross_key_values)
+
+        max_length = self.static_cache_max_length
+        if self.static_cache is not None and self.static_cache.matches(batch_size, max_length, cross_key_values, cross_masks):
+            return self.static_cache.reset(cross_key_values, cross_masks)
+
+        # relative position bias of every query / key pair, keys after the query are masked out
+        self_attention = self.decoder.block[0].layer[0].SelfAttention
+        dtype = cross_key_values[0][0].dtype
+        causal_mask = torch.full((max_length, max_length), torch.finfo(dtype).min, dtype=dtype, device=encoder_hidden_states.device)
+        self_bias = self_attention.compute_bias(max_length, max_length, device=encoder_hidden_states.device).to(dtype) + causal_mask.triu(1)
+
+        self.static_cache = StaticKVCache.allocate(
+            num_layers=len(self.decoder.block),
+            batch_size=batch_size,
+            n_heads=self_attention.n_heads,
+            head_dim=self_attention.key_value_proj_dim,
+            max_length=max_length,
+            cross_key_values=cross_key_values,
+            cross_masks=cross_masks,
+            self_bias=self_bias,
+        )
+        return self.static_cache
+
+    def _static_forward(self, decoder_input_ids, static_cache, return_dict):
+        sequence_output = self.static_decode_step(decoder_input_ids, static_cache)
+        static_cache.advance()
+
+        if self.config.tie_word_embeddings:
+            sequence_output = sequence_output * (self.model_dim**-0.5)
+        lm_logits = self.lm_head(sequence_output)
+
+        if not return_dict:
+            return (lm_logits, static_cache)
+        return Seq2SeqLMOutput(logits=lm_logits, past_key_values=static_cache)
+
     def get_input_embeddings(self):
         return self.shared
 
@@ -524,8 +798,11 @@ class T5ForMultiSourceConditionalGeneration(T5PreTrainedModel):
         encoder_kwargs_2['input_ids'] = input_ids_2
         encoder_kwargs_2['attention_mask'] = attention_mask_2
 
-        encoder_outputs_1 = self.encoder_1(**encoder_kwargs_1)
-        encoder_outputs_2 = self.encoder_2(**encoder_kwargs_2)
+        encoder_outputs_1, encoder_outputs_2 = self.encode_sources(
+            encoder_kwargs_1.pop('input_ids'), encoder_kwargs_1.pop('attention_mask'),
+            encoder_kwargs_2.pop('input_ids'), encoder_kwargs_2.pop('attention_mask'),
+            **encoder_kwargs_1,
+        )
 
 
         if(encoder_outputs_1.past_key_values or encoder_outputs_1.attentions or encoder_outputs_1.cross_attentions or 
@@ -605,6 +882,9 @@ class T5ForMultiSourceConditionalGeneration(T5PreTrainedModel):
         >>> # studies have shown that owning a dog is good for you.
         ```"""
 
+        return_dict = return_dict if return_dict is not None else self.config.use_return_dict
+        if isinstance(past_key_values, StaticKVCache):
+            return self._static_forward(decoder_input_ids, past_key_values, return_dict)
 
         input_ids_1 = None
         input_ids_2 = None
@@ -621,14 +901,12 @@ class T5ForMultiSourceConditionalGeneration(T5PreTrainedModel):
         encoder_outputs_1 = None
         encoder_outputs_2 = None
         if(encoder_outputs is not None):
-            encoder_outputs_1 = copy.deepcopy(encoder_outputs)
-            encoder_outputs_2 = copy.deepcopy(encoder_outputs)
-            encoder_outputs_1['last_hidden_state'] = torch.stack((list(map(lambda x:x[:encoder_outputs[0].shape[1]//2] , encoder_outputs[0]))), dim=0)
-            encoder_outputs_2['last_hidden_state'] = torch.stack((list(map(lambda x:x[encoder_outputs[0].shape[1]//2:] , encoder_outputs[0]))), dim=0)
+            # views on the concatenated encoder states, deep copying them would run on every generated token
+            encoder_outputs_1 = BaseModelOutput(last_hidden_state=encoder_outputs[0][:, :encoder_outputs[0].shape[1]//2])
+            encoder_outputs_2 = BaseModelOutput(last_hidden_state=encoder_outputs[0][:, encoder_outputs[0].shape[1]//2:])
 
 
         use_cache = use_cache if use_cache is not None else self.config.use_cache
-        return_dict = return_dict if return_dict is not None else self.config.use_return_dict
 
         # FutureWarning: head_mask was separated into two input args - head_mask, decoder_head_mask
         if head_mask is not None and decoder_head_mask is None:
@@ -639,18 +917,11 @@ class T5ForMultiSourceConditionalGeneration(T5PreTrainedModel):
         # Encode if needed (training, first prediction pass)
         if encoder_outputs_1 is None and encoder_outputs_2 is None:
             # Convert encoder inputs in embeddings if needed
-            encoder_outputs_1 = self.encoder_1(
-                input_ids=input_ids_1,
-                attention_mask=attention_mask_1,
-                inputs_embeds=inputs_embeds,
-                head_mask=head_mask,
-                output_attentions=output_attentions,
-                output_hidden_states=output_hidden_states,
-                return_dict=return_dict,
-            )
-            encoder_outputs_2 = self.encoder_2(
-                input_ids=input_ids_2,
-                attention_mask=attention_mask_2,
+            encoder_outputs_1, encoder_outputs_2 = self.encode_sources(
+                input_ids_1,
+                attention_mask_1,
+                input_ids_2,
+                attention_mask_2,
                 inputs_embeds=inputs_embeds,
                 head_mask=head_mask,
                 output_attentions=output_attentions,
@@ -784,6 +1055,11 @@ class T5ForMultiSourceConditionalGeneration(T5PreTrainedModel):
         encoder_outputs=None,
         **kwargs,
     ):
+        if self.static_cache_max_length is not None and past_key_values is None:
+            if input_ids.shape[1] != 1:
+                raise ValueError("Static cache decoding has to start from the decoder start token only")
+            past_key_values = self._prepare_static_cache(encoder_outputs, attention_mask)
+
         # cut decoder_input_ids if past is used
         if past_key_values is not None:
             input_ids = input_ids[:, -1:]
@@ -810,28 +1086,15 @@ class T5ForMultiSourceConditionalGeneration(T5PreTrainedModel):
             logger.warning("You might want to consider setting `use_cache=True` to speed up decoding")
             return past_key_values
 
-        reordered_decoder_past = ()
-        for layer_past_states in past_key_values:
-            # get the correct batch idx from layer past batch dim
-            # batch dim of `past` is at 2nd position
-            reordered_layer_past_states = ()
-            for layer_past_state in layer_past_states:
-                # need to set correct `past` for each of the four key / value states
-                reordered_layer_past_states = reordered_layer_past_states + (
-                    layer_past_state.index_select(0, beam_idx.to(layer_past_state.device)),
-                )
+        if isinstance(past_key_values, StaticKVCache):
+            return past_key_values.reorder(beam_idx)
 
-            if reordered_layer_past_states[0].shape != layer_past_states[0].shape:
-                raise ValueError(
-                    f"reordered_layer_past_states[0] shape {reordered_layer_past_states[0].shape} and layer_past_states[0] shape {layer_past_states[0].shape} mismatched"
-                )
-            if len(reordered_layer_past_states) != len(layer_past_states):
-                raise ValueError(
-                    f"length of reordered_layer_past_states {len(reordered_layer_past_states)} and length of layer_past_states {len(layer_past_states)} mismatched"
-                )
+        for layer_past_states in past_key_values:
+            if len(layer_past_states) != 6:
+                raise ValueError(f"There should be 6 past states per layer. Got {len(layer_past_states)} past key / value states")
 
-            reordered_decoder_past = reordered_decoder_past + (reordered_layer_past_states,)
-        return reordered_decoder_past
+        # self-attention states are gathered into preallocated buffers, cross-attention states are shared by the beams
+        return self.beam_reorder_cache.reorder(past_key_values, beam_idx)
 
 
     def _prepare_encoder_decoder_kwargs_for_generation(self, inputs_tensor: torch.Tensor, model_kwargs, model_input_name: Optional[str] = None) -> Dict[str, Any]:
@@ -15,12 +15,17 @@ import gc
 import inspect
 import json
 import os
+from model_source.kv_cache import BeamReorderCache
+from model_source.t5_sdpa_attention import set_attention_backend
+from model_source.numerics import INF_CLAMP_MODES, clamp_inf_values
 
 
 class T5BlockDecoder(nn.Module):
-    def __init__(self, config, has_relative_attention_bias=False):
+    def __init__(self, config, has_relative_attention_bias=False, layer_idx=None):
         super().__init__()
         self.is_decoder = True
+        self.layer_idx = layer_idx
+        self.inf_clamp_mode = getattr(config, "inf_clamp_mode", "clamp")
         self.layer = nn.ModuleList()
         self.layer.append(T5LayerSelfAttention(config, has_relative_attention_bias=has_relative_attention_bias))
         self.layer.append(T5LayerCrossAttention(config))
@@ -78,14 +83,7 @@ class T5BlockDecoder(nn.Module):
         hidden_states, present_key_value_state = self_attention_outputs[:2]
         attention_outputs = self_attention_outputs[2:]  # Keep self-attention outputs and relative position weights
 
-        # clamp inf values to enable fp16 training
-        if hidden_states.dtype == torch.float16:
-            clamp_value = torch.where(
-                torch.isinf(hidden_states).any(),
-                torch.finfo(hidden_states.dtype).max - 1000,
-                torch.finfo(hidden_states.dtype).max,
-            )
-            hidden_states = torch.clamp(hidden_states, min=-clamp_value, max=clamp_value)
+        hidden_states = clamp_inf_values(hidden_states, self.inf_clamp_mode, self.layer_idx, "self-attention")
 
         do_cross_attention = self.is_decoder and encoder_hidden_states_1 is not None and encoder_hidden_states_2 is not None
         if do_cross_attention:
@@ -126,14 +124,7 @@ class T5BlockDecoder(nn.Module):
             hidden_states = torch.add(cross_attention_outputs_1[0]*0.9, cross_attention_outputs_2[0]*0.1)
             # hidden_states = torch.cat((cross_attention_outputs_1[0], cross_attention_outputs_2[0]), dim=2)
 
-            # clamp inf values to enable fp16 training
-            if hidden_states.dtype == torch.float16:
-                clamp_value = torch.where(
-                    torch.isinf(hidden_states).any(),
-                    torch.finfo(hidden_states.dtype).max - 1000,
-                    torch.finfo(hidden_states.dtype).max,
-                )
-                hidden_states = torch.clamp(hidden_states, min=-clamp_value, max=clamp_value)
+            hidden_states = clamp_inf_values(hidden_states, self.inf_clamp_mode, self.layer_idx, "cross attention")
 
             # Combine self attn and cross attn key value states
             if present_key_value_state is not None:
@@ -152,14 +143,7 @@ class T5BlockDecoder(nn.Module):
         hidden_states = self.layer[-1](hidden_states)
         # print('hidden_states ff.shape', hidden_states.shape)
 
-        # clamp inf values to enable fp16 training
-        if hidden_states.dtype == torch.float16:
-            clamp_value = torch.where(
-                torch.isinf(hidden_states).any(),
-                torch.finfo(hidden_states.dtype).max - 1000,
-                torch.finfo(hidden_states.dtype).max,
-            )
-            hidden_states = torch.clamp(hidden_states, min=-clamp_value, max=clamp_value)
+        hidden_states = clamp_inf_values(hidden_states, self.inf_clamp_mode, self.layer_idx, "feed forward")
 
         outputs = (hidden_states,)
 
@@ -178,7 +162,7 @@ class T5StackDecoder(T5PreTrainedModel):
         self.is_decoder = config.is_decoder
 
         self.block = nn.ModuleList(
-            [T5BlockDecoder(config, has_relative_attention_bias=bool(i == 0)) for i in range(config.num_layers)]
+            [T5BlockDecoder(config, has_relative_attention_bias=bool(i == 0), layer_idx=i) for i in range(config.num_layers)]
         )
         self.final_layer_norm = T5LayerNorm(config.d_model, eps=config.layer_norm_epsilon)
         self.dropout = nn.Dropout(config.dropout_rate)
@@ -462,15 +446,68 @@ class T5ForMultiSourceParallelConditionalGeneration(T5PreTrainedModel):
 
         self.lm_head = nn.Linear(config.d_model, config.vocab_size, bias=False)
 
+        self.beam_reorder_cache = BeamReorderCache()
+
         # Initialize weights and apply final processing
         self.post_init()
 
+        # "eager" or "sdpa", stored in the config so that it is saved with the model
+        self.set_attention_backend(getattr(config, "attention_backend", "eager"))
+        self.set_inf_clamp_mode(getattr(config, "inf_clamp_mode", "clamp"))
+
         # Model parallel
         self.model_parallel = False
         self.device_map = None
 
 
 
+    def set_attention_backend(self, backend):
+        """
+        Computes the attention of both encoders and of the decoder with the `eager` T5 implementation or with
+        `scaled_dot_product_attention` (`sdpa`), which falls back to `eager` when attention weights are requested.
+        """
+        set_attention_backend(self, backend)
+        self.config.attention_backend = backend
+
+    def set_inf_clamp_mode(self, mode):
+        """
+        Sets how the decoder blocks handle fp16 overflows after each sub-layer: `clamp` (default), `off` or the
+        per-layer `check` debug guard, see `clamp_inf_values`.
+        """
+        if mode not in INF_CLAMP_MODES:
+            raise ValueError(f"inf_clamp_mode should be one of {INF_CLAMP_MODES}, got {mode}")
+        for block in self.decoder.block:
+            block.inf_clamp_mode = mode
+        self.config.inf_clamp_mode = mode
+
+    def enable_half_precision_inference(self, dtype=torch.bfloat16, calibration_batches=None):
+        """
+        Casts the model to `dtype` and turns the decoder inf clamps off. bf16 has the exponent range of fp32 and never
+        needs them. fp16 first generates `calibration_batches` (dicts of `generate()` kwargs) with the `check` guards
+        and only turns the clamps off when none of them overflows. Returns whether the clamps were turned off.
+        """
+        if dtype not in (torch.bfloat16, torch.float16):
+            raise ValueError(f"dtype should be torch.bfloat16 or torch.float16, got {dtype}")
+
+        self.to(dtype)
+        if dtype == torch.bfloat16:
+            self.set_inf_clamp_mode("off")
+            return True
+
+        if not calibration_batches:
+            raise ValueError("fp16 inference without the inf clamps needs calibration_batches")
+        self.set_inf_clamp_mode("check")
+        try:
+            with torch.no_grad():
+                for batch in calibration_batches:
+                    self.generate(**batch)
+        except FloatingPointError as error:
+            warnings.warn(f"Keeping the fp16 inf clamps, the calibration overflowed: {error}")
+            self.set_inf_clamp_mode("clamp")
+            return False
+        self.set_inf_clamp_mode("off")
+        return True
+
     def get_input_embeddings(self):
         return self.shared
 
@@ -598,10 +635,9 @@ class T5ForMultiSourceParallelConditionalGeneration(T5PreTrainedModel):
         encoder_outputs_1 = None
         encoder_outputs_2 = None
         if(encoder_outputs is not None):
-            encoder_outputs_1 = copy.deepcopy(encoder_outputs)
-            encoder_outputs_2 = copy.deepcopy(encoder_outputs)
-            encoder_outputs_1['last_hidden_state'] = torch.stack((list(map(lambda x:x[:encoder_outputs[0].shape[1]//2] , encoder_outputs[0]))), dim=0)
-            encoder_outputs_2['last_hidden_state'] = torch.stack((list(map(lambda x:x[encoder_outputs[0].shape[1]//2:] , encoder_outputs[0]))), dim=0)
+            # views on the concatenated encoder states, deep copying them would run on every generated token
+            encoder_outputs_1 = BaseModelOutput(last_hidden_state=encoder_outputs[0][:, :encoder_outputs[0].shape[1]//2])
+            encoder_outputs_2 = BaseModelOutput(last_hidden_state=encoder_outputs[0][:, encoder_outputs[0].shape[1]//2:])
 
 
         use_cache = use_cache if use_cache is not None else self.config.use_cache
@@ -787,28 +823,12 @@ class T5ForMultiSourceParallelConditionalGeneration(T5PreTrainedModel):
             logger.warning("You might want to consider setting `use_cache=True` to speed up decoding")
             return past_key_values
 
-        reordered_decoder_past = ()
         for layer_past_states in past_key_values:
-            # get the correct batch idx from layer past batch dim
-            # batch dim of `past` is at 2nd position
-            reordered_layer_past_states = ()
-            for layer_past_state in layer_past_states:
-                # need to set correct `past` for each of the four key / value states
-                reordered_layer_past_states = reordered_layer_past_states + (
-                    layer_past_state.index_select(0, beam_idx.to(layer_past_state.device)),
-                )
-
-            if reordered_layer_past_states[0].shape != layer_past_states[0].shape:
-                raise ValueError(
-                    f"reordered_layer_past_states[0] shape {reordered_layer_past_states[0].shape} and layer_past_states[0] shape {layer_past_states[0].shape} mismatched"
-                )
-            if len(reordered_layer_past_states) != len(layer_past_states):
-                raise ValueError(
-                    f"length of reordered_layer_past_states {len(reordered_layer_past_states)} and length of layer_past_states {len(layer_past_states)} mismatched"
-                )
+            if len(layer_past_states) != 4:
+                raise ValueError(f"There should be 4 past states per layer. Got {len(layer_past_states)} past key / value states")
 
-            reordered_decoder_past = reordered_decoder_past + (reordered_layer_past_states,)
-        return reordered_decoder_past
+        # self-attention states are gathered into preallocated buffers, cross-attention states are shared by the beams
+        return self.beam_reorder_cache.reorder(past_key_values, beam_idx)
 
 
     def _prepare_encoder_decoder_kwargs_for_generation(self, inputs_tensor: torch.Tensor, model_kwargs, model_input_name: Optional[str] = None) -> Dict[str, Any]:
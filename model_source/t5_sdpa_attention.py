@@ -0,0 +1,135 @@
+import torch
+import torch.nn as nn
+from transformers.models.t5.modeling_t5 import T5Attention
+
+
+ATTENTION_BACKENDS = ("eager", "sdpa")
+
+
+class T5SdpaAttention(T5Attention):
+    """
+    `T5Attention` computed with `torch.nn.functional.scaled_dot_product_attention` (torch >= 2.1).
+
+    The relative position bias and the padding mask are passed to SDPA as one additive mask, so the fused kernels never
+    materialize the `(batch_size, n_heads, seq_length, key_length)` attention matrix. Without relative attention bias
+    the eager implementation adds the mask to a zero bias of that full shape, here the mask alone is used and returned
+    as the shared position bias, which broadcasts to the same scores. Attention weights are only available from the
+    eager implementation, so requesting them (or head masks / pruned heads) falls back to it.
+    """
+
+    def forward(
+        self,
+        hidden_states,
+        mask=None,
+        key_value_states=None,
+        position_bias=None,
+        past_key_value=None,
+        layer_head_mask=None,
+        query_length=None,
+        use_cache=False,
+        output_attentions=False,
+    ):
+        if output_attentions or layer_head_mask is not None or self.pruned_heads:
+            return super().forward(
+                hidden_states,
+                mask=mask,
+                key_value_states=key_value_states,
+                position_bias=position_bias,
+                past_key_value=past_key_value,
+                layer_head_mask=layer_head_mask,
+                query_length=query_length,
+                use_cache=use_cache,
+                output_attentions=output_attentions,
+            )
+
+        batch_size, seq_length = hidden_states.shape[:2]
+
+        real_seq_length = seq_length
+
+        if past_key_value is not None:
+            if len(past_key_value) != 2:
+                raise ValueError(
+                    f"past_key_value should have 2 past states: keys and values. Got { len(past_key_value)} past states"
+                )
+            real_seq_length += past_key_value[0].shape[2] if query_length is None else query_length
+
+        key_length = real_seq_length if key_value_states is None else key_value_states.shape[1]
+
+        def shape(states):
+            """projection"""
+            return states.view(batch_size, -1, self.n_heads, self.key_value_proj_dim).transpose(1, 2)
+
+        def unshape(states):
+            """reshape"""
+            return states.transpose(1, 2).contiguous().view(batch_size, -1, self.inner_dim)
+
+        def project(hidden_states, proj_layer, key_value_states, past_key_value):
+            """projects hidden states correctly to key/query states"""
+            if key_value_states is None:
+                # self-attn
+                hidden_states = shape(proj_layer(hidden_states))
+            elif past_key_value is None:
+                # cross-attn
+                hidden_states = shape(proj_layer(key_value_states))
+
+            if past_key_value is not None:
+                if key_value_states is None:
+                    # self-attn
+                    hidden_states = torch.cat([past_key_value, hidden_states], dim=2)
+                elif past_key_value.shape[2] != key_value_states.shape[1]:
+                    # cross-attn with a `past_key_value` of another length (prefix tuning)
+                    hidden_states = shape(proj_layer(key_value_states))
+                else:
+                    # cross-attn
+                    hidden_states = past_key_value
+            return hidden_states
+
+        query_states = shape(self.q(hidden_states))
+        key_states = project(
+            hidden_states, self.k, key_value_states, past_key_value[0] if past_key_value is not None else None
+        )
+        value_states = project(
+            hidden_states, self.v, key_value_states, past_key_value[1] if past_key_value is not None else None
+        )
+
+        if position_bias is None:
+            if not self.has_relative_attention_bias:
+                if mask is not None:
+                    position_bias = mask
+                else:
+                    position_bias = torch.zeros((1, 1, 1, key_length), device=query_states.device, dtype=query_states.dtype)
+            else:
+                position_bias = self.compute_bias(real_seq_length, key_length, device=query_states.device)
+
+                # if key and values are already calculated
+                # we want only the last query position bias
+                if past_key_value is not None:
+                    position_bias = position_bias[:, :, -hidden_states.size(1) :, :]
+
+                if mask is not None:
+                    position_bias = position_bias + mask
+
+        # T5 does not scale the scores (Mesh TensorFlow initialization)
+        attn_output = nn.functional.scaled_dot_product_attention(
+            query_states,
+            key_states,
+            value_states,
+            attn_mask=position_bias.to(query_states.dtype),
+            dropout_p=self.dropout if self.training else 0.0,
+            scale=1.0,
+        )
+        attn_output = self.o(unshape(attn_output))
+
+        present_key_value_state = (key_states, value_states) if (self.is_decoder and use_cache) else None
+        return (attn_output,) + (present_key_value_state,) + (position_bias,)
+
+
+def set_attention_backend(model, backend):
+    """Switches every `T5Attention` of `model` to the `eager` or `sdpa` implementation, the weights are untouched."""
+    if backend not in ATTENTION_BACKENDS:
+        raise ValueError(f"attention_backend should be one of {ATTENTION_BACKENDS}, got {backend}")
+
+    attention_class = T5SdpaAttention if backend == "sdpa" else T5Attention
+    for module in model.modules():
+        if isinstance(module, T5Attention):
+            module.__class__ = attention_class
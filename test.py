@@ -1,70 +1,155 @@
 # Importing stock libraries
 import numpy as np
 import pandas as pd
-import torch, csv
+import torch
 import torch.nn.functional as F
 from torch.utils.data import Dataset, DataLoader, RandomSampler, SequentialSampler
 
 # Importing the T5 modules from huggingface/transformers
-from transformers import T5Tokenizer
+from transformers import LogitsProcessorList, T5Tokenizer
 # # Setting up the device for GPU usage
 from torch import cuda
 import gc
+import os
+import time
 import warnings
 import loader
+from inference.batching import BatchPlanner, available_memory, collate_multi_source, source_lengths
+from inference.memory import MemoryManager
+from inference.result_writer import ResultWriter
+from inference.manifest import RunManifest, fingerprint
+from inference.adaptive import AdaptiveBeamSearch, buggy_hunk, hunk_lengths
+from inference.candidates import dedup_candidates, detokenize
+from inference.php_constraints import PHPConstraintLogitsProcessor, PHPSyntaxTables, hunk_bracket_bounds
+from inference.sharding import (Shard, export_shared_weights, load_shared_weights, merge_shards, pin_threads, run_shards,
+                                shard_cores, shard_file, split_bugs)
 from model_source.t5_for_multi_source import T5ForMultiSourceConditionalGeneration
 
-        
-def test(epoch, tokenizer, model, device, loader):
+
+def generate_candidates(model, input_ids, attention_mask, return_sequences, token_logprobs=False, constraints=None):
+    """
+    Beam search for a batch of bugs, halving the batch when it does not fit in memory after all. Returns the
+    sequences, their beam scores and, with `token_logprobs`, the log-probability of each generated token (lists of
+    floats, None otherwise), one entry per candidate. `constraints` is a `PHPConstraintLogitsProcessor` for the bugs.
+    """
+    try:
+        outputs = model.generate(
+            input_ids = input_ids,
+            attention_mask = attention_mask, 
+            max_length=100, 
+            num_beams=return_sequences,
+            length_penalty=1.0, 
+            early_stopping = True,
+            num_return_sequences=return_sequences,
+            num_beam_groups = 1,
+            output_scores=True,
+            return_dict_in_generate=True,
+            logits_processor=LogitsProcessorList([constraints]) if constraints is not None else None
+            )
+    except torch.cuda.OutOfMemoryError:
+        if input_ids.shape[0] == 1:
+            raise
+        torch.cuda.empty_cache()
+        half = input_ids.shape[0] // 2
+        print('out of memory, splitting a batch of {} bugs'.format(input_ids.shape[0]))
+        first = generate_candidates(model, input_ids[:half], attention_mask[:half], return_sequences, token_logprobs,
+                                    constraints[:half] if constraints is not None else None)
+        second = generate_candidates(model, input_ids[half:], attention_mask[half:], return_sequences, token_logprobs,
+                                     constraints[half:] if constraints is not None else None)
+        return tuple(a + b for a, b in zip(first, second))
+
+    sequences = list(outputs.sequences)
+    scores = outputs.sequences_scores.float().tolist()
+    logprobs = [None] * len(sequences)
+    if token_logprobs:
+        transition_scores = model.compute_transition_scores(outputs.sequences, outputs.scores, outputs.beam_indices)
+        # the decoder start token has no score, the positions after the end of a beam are padding
+        lengths = (outputs.sequences[:, 1:] != model.config.pad_token_id).sum(dim=1).tolist()
+        logprobs = [[round(value, 4) for value in row[:length]]
+                    for row, length in zip(transition_scores.float().tolist(), lengths)]
+    return sequences, scores, logprobs
+
+
+def test(epoch, tokenizer, model, device, loader, memory=None, writer=None, adaptive=None, bug_hunk_lengths=None, dedup=False,
+         token_logprobs=False, php_tables=None, bracket_bounds=None):
     return_sequences = 100
     model.eval()
+    memory = memory or MemoryManager(device, on_trim=[model.beam_reorder_cache.release])
+    own_writer = writer is None
+    writer = writer or ResultWriter('result.csv')
 
+    start = time.time()
+    bugs = 0
+    duplicates = 0
     with torch.no_grad():
         for _, data in enumerate(loader, 0):
-            gc.collect()
-            torch.cuda.empty_cache()
             y = data['target_ids'].to(device, dtype = torch.long)
             input_ids_1 = data['input_ids_1'].to(device, dtype = torch.long)
             attention_mask_1 = data['attention_mask_1'].to(device, dtype = torch.long)
             input_ids_2 = data['input_ids_1'].to(device, dtype = torch.long)
             attention_mask_2 = data['attention_mask_1'].to(device, dtype = torch.long)
-            bugid = data['bugid'].to(device, dtype = torch.long)
+            bugid = data['bugid']
 
             input_ids = torch.cat((input_ids_1, input_ids_2), dim=1)
             attention_mask = torch.cat((attention_mask_1, attention_mask_2), dim=1)
             
             if _%10==0:
-                print(_)
+                print(_, 'bugs/hour: {:.1f}'.format(bugs * 3600 / max(time.time() - start, 1e-9)), memory.format_stats())
        
-            generated_ids = model.generate(
-                input_ids = input_ids,
-                attention_mask = attention_mask, 
-                max_length=100, 
-                num_beams=return_sequences,
-                length_penalty=1.0, 
-                early_stopping = True,
-                num_return_sequences=return_sequences,
-                num_beam_groups = 1,
-                output_scores=True
-                )
-           
-
-            preds = [tokenizer.decode(g, skip_special_tokens=True, clean_up_tokenization_spaces=True) for g in generated_ids]
+            # the allocator pools are kept between batches, they are only trimmed past the high-water mark
+            with memory.track():
+                if adaptive is not None:
+                    results = adaptive.generate(model, input_ids, attention_mask, [bug_hunk_lengths[b.item()] for b in bugid])
+                    results = [(candidates, scores.tolist(), None) for candidates, scores in results]
+                else:
+                    constraints = None
+                    if php_tables is not None:
+                        constraints = PHPConstraintLogitsProcessor(php_tables, [bracket_bounds[b.item()] for b in bugid])
+                    generated_ids, sequences_scores, logprobs = generate_candidates(
+                        model, input_ids, attention_mask, return_sequences, token_logprobs, constraints)
 
-            
-            with open('result.csv', 'a') as csvfile:
-                filewriter = csv.writer(csvfile, delimiter='\t',escapechar=' ',quoting=csv.QUOTE_NONE)
-                for i in range(0,return_sequences):
-                    predstr=preds[i]
-                    predstr=predstr.replace('> =','>=').replace('< =','<=').replace('= =','==').replace('! =','!=')
-                    filewriter.writerow([bugid.item(), data['bug'][0] , predstr])
+            if adaptive is None:
+                preds = [tokenizer.decode(g, skip_special_tokens=True, clean_up_tokenization_spaces=True) for g in generated_ids]
+                # generate() returns the candidates of each bug of the batch one after the other
+                results = [
+                    (preds[b * return_sequences:(b + 1) * return_sequences],
+                     sequences_scores[b * return_sequences:(b + 1) * return_sequences],
+                     logprobs[b * return_sequences:(b + 1) * return_sequences] if token_logprobs else None)
+                    for b in range(len(bugid))
+                    ]
+
+            for b in range(len(bugid)):
+                candidates = [detokenize(predstr) for predstr in results[b][0]]
+                scores = results[b][1]
+                candidate_logprobs = results[b][2]
+                if dedup:
+                    # every duplicate would cost a full test run of the validation
+                    candidates, scores, _, ranks = dedup_candidates(candidates, scores)
+                    if candidate_logprobs is not None:
+                        candidate_logprobs = [candidate_logprobs[rank] for rank in ranks]
+                    duplicates += len(results[b][0]) - len(candidates)
+                writer.write(bugid[b].item(), data['bug'][b], candidates, scores, candidate_logprobs)
+            bugs += len(bugid)
+
+    if own_writer:
+        writer.close()
 
+    elapsed = time.time() - start
+    print('{} bugs in {:.1f} s, bugs/hour: {:.1f}'.format(bugs, elapsed, bugs * 3600 / max(elapsed, 1e-9)))
+    print(memory.format_stats())
+    if dedup:
+        print('{} duplicate candidates dropped'.format(duplicates))
+    if adaptive is not None and bugs:
+        # a fixed search runs 100 beams for up to 99 steps on every bug
+        print('adaptive beams: {} beam steps in {} generations, {:.1%} of a fixed 100-beam search running to max_length'.format(
+            adaptive.beam_steps, adaptive.generations, adaptive.beam_steps / (bugs * return_sequences * 99)))
 
 
 
 
 
-def main():
+
+def main(shard=None):
      
     TRAIN_BATCH_SIZE =20    # input batch size for training (default: 64)
     VAL_EPOCHS = 1 
@@ -73,6 +158,27 @@ def main():
     MAX_LEN = 512
     SUMMARY_LEN = 512 
     SAVE_MODEL='./model/t5-base-serial'
+    STATIC_CACHE = False    # decode over a preallocated, static-shape KV cache
+    COMPILE_DECODER = False # torch.compile the per-token decoder step (static cache only)
+    CUDA_GRAPH = False      # replay the per-token decoder step as a CUDA graph (static cache only)
+    ATTENTION_BACKEND = 'eager' # 'sdpa' computes the attention with torch scaled_dot_product_attention
+    BF16 = False            # bf16 inference without the fp16 inf clamps of the decoder
+    MAX_BATCH_SIZE = 16     # bugs per generate() call, fewer when their beams do not fit in memory
+    MEMORY_FRACTION = 0.8   # share of the free GPU memory the batch planner may fill
+    HIGH_WATER_MARK = 0.9   # share of the GPU memory reserved by the allocator past which it is trimmed
+    RESULT_FORMAT = 'tsv'   # 'tsv' writes the result.csv rows the validation reads, 'jsonl' also keeps the rank and beam score of each candidate
+    TOKEN_LOGPROBS = False  # also keep the log-probability of every generated token (jsonl, fixed beam search only)
+    RESULT_FILE = 'result.csv' if RESULT_FORMAT == 'tsv' else 'result.jsonl'
+    MANIFEST_FILE = RESULT_FILE + '.manifest.json' # completed bugs, a restarted run skips them
+    TEST_DATA = './data/test.csv'
+    ADAPTIVE_BEAMS = False  # start with 10 beams and widen per bug, max_length from the buggy hunk length
+    DEDUP_CANDIDATES = False # write each patch once per bug, ranked by its best beam (fewer than 100 rows per bug)
+    PHP_CONSTRAINTS = False # mask unclosed strings, dangling ->, and brackets the buggy hunk does not balance (fixed beam search only)
+    CPU_SHARDS = 1          # worker processes on CPU, each pinned to its share of the cores and of the bugs
+    SHARED_WEIGHTS = SAVE_MODEL.rstrip('/') + '.weights.pt' # the weights the CPU shards memory-map
+
+    if shard is not None:
+        pin_threads(shard.cores)
 
     # Set random seeds and deterministic pytorch for reproducibility
     torch.manual_seed(SEED) # pytorch random seed
@@ -85,16 +191,62 @@ def main():
     # tokenizer.add_tokens(['{', '}','<','^'])
 
     device = 'cuda' if cuda.is_available() else 'cpu'
-    model = T5ForMultiSourceConditionalGeneration.from_pretrained(SAVE_MODEL).to(device)
+    if shard is not None:
+        # every shard maps the same copy of the weights instead of loading its own
+        model = load_shared_weights(T5ForMultiSourceConditionalGeneration, SAVE_MODEL, SHARED_WEIGHTS)
+    else:
+        model = T5ForMultiSourceConditionalGeneration.from_pretrained(SAVE_MODEL).to(device)
     # Further this model is sent to device (GPU/TPU) for using the hardware.
+    model.set_attention_backend(ATTENTION_BACKEND)
+    if BF16:
+        model.enable_half_precision_inference(torch.bfloat16)
+    if STATIC_CACHE:
+        # max_length has to cover the max_length passed to generate() in test()
+        model.enable_static_cache(max_length=100, compile=COMPILE_DECODER, cuda_graph=CUDA_GRAPH and device == 'cuda')
 
 
-    test_df = pd.read_csv('./data/test.csv',encoding='latin-1',delimiter='\t')
+    test_df = pd.read_csv(TEST_DATA,encoding='latin-1',delimiter='\t')
     print(test_df.head())
     test_df = test_df[['bugid', 'bug','buggy', 'additional_info','patch']]
     print(test_df.head())
 
     
+    # the results of a run are only resumed with the same checkpoint, data and output settings
+    settings = {'num_beams': 100, 'max_length': 100, 'max_len': MAX_LEN, 'bf16': BF16, 'attention_backend': ATTENTION_BACKEND,
+                'result_format': RESULT_FORMAT, 'adaptive_beams': ADAPTIVE_BEAMS, 'dedup_candidates': DEDUP_CANDIDATES,
+                'token_logprobs': TOKEN_LOGPROBS, 'php_constraints': PHP_CONSTRAINTS}
+    if shard is None:
+        result_file = RESULT_FILE
+        manifest = RunManifest(MANIFEST_FILE, fingerprint([SAVE_MODEL, TEST_DATA], settings), RESULT_FILE)
+        if manifest.completed:
+            print("Skipping {} bugs completed by a previous run".format(len(manifest.completed)))
+        test_df = test_df[~test_df.bugid.isin(manifest.completed)]
+    else:
+        # a shard resumes from its own result file and manifest until they are merged
+        result_file = shard_file(RESULT_FILE, shard)
+        settings['shard'] = [shard.index, shard.count, shard.bugids]
+        manifest = RunManifest(result_file + '.manifest.json', fingerprint([SAVE_MODEL, TEST_DATA], settings), result_file)
+        test_df = test_df[test_df.bugid.isin(shard.bugids) & ~test_df.bugid.isin(manifest.completed)]
+
+    if shard is None and device == 'cpu' and CPU_SHARDS > 1:
+        export_shared_weights(model, SHARED_WEIGHTS)
+        del model
+        bugids = test_df.bugid.tolist()
+        source_chars = (test_df.buggy.astype(str).str.len() + test_df.additional_info.astype(str).str.len()).tolist()
+        shards = [
+            Shard(index, CPU_SHARDS, shard_bugids, cores)
+            for index, (shard_bugids, cores) in enumerate(zip(split_bugs(bugids, source_chars, CPU_SHARDS), shard_cores(CPU_SHARDS)))
+            ]
+        run_shards(main, shards)
+
+        # the merged results follow the order of the test data, whichever shard ran a bug
+        shard_files = [shard_file(RESULT_FILE, shard) for shard in shards]
+        manifest.record(bugids, merge_shards(shard_files, RESULT_FILE, RESULT_FORMAT, bugids))
+        for path in shard_files:
+            os.remove(path)
+            os.remove(path + '.manifest.json')
+        return
+
     test_dataset=test_df.reset_index(drop=True)
 
 
@@ -105,10 +257,22 @@ def main():
     test_set = loader.GeneratorDatasetForMultiSource(test_dataset, tokenizer, MAX_LEN, SUMMARY_LEN)
 
     
+    # batches of bugs of similar length, padded to the longest source of the batch only
+    planner = BatchPlanner(
+        model.config,
+        num_beams=100,
+        max_length=100,
+        memory_budget=available_memory(device, MEMORY_FRACTION),
+        # on CPU the 100 beams of one bug already keep every core busy
+        max_batch_size=MAX_BATCH_SIZE if device == 'cuda' else 1,
+        dtype_bytes=torch.finfo(model.dtype).bits // 8,
+        )
+    lengths = source_lengths(tokenizer, test_dataset.additional_info, test_dataset.buggy, MAX_LEN)
     test_params = {
-        'batch_size': 1,
-        'shuffle': False,
-        'num_workers': 2
+        'batch_sampler': planner.plan(lengths),
+        'collate_fn': collate_multi_source,
+        # a shard keeps its data loading on its own cores
+        'num_workers': 2 if shard is None else 0
         }
 
     test_loader = DataLoader(test_set, **test_params)  
@@ -116,9 +280,25 @@ def main():
     # Defining the optimizer that will be used to tune the weights of the network in the training session. 
     optimizer = torch.optim.Adam(params =  model.parameters(), lr=LEARNING_RATE)
 
+    adaptive = None
+    bug_hunk_lengths = None
+    if ADAPTIVE_BEAMS:
+        adaptive = AdaptiveBeamSearch(
+            lambda g: tokenizer.decode(g, skip_special_tokens=True, clean_up_tokenization_spaces=True))
+        bug_hunk_lengths = dict(zip(map(int, test_dataset.bugid), hunk_lengths(tokenizer, test_dataset.buggy)))
+
+    php_tables = None
+    bug_bracket_bounds = None
+    if PHP_CONSTRAINTS:
+        php_tables = PHPSyntaxTables(tokenizer, model.config.vocab_size)
+        bug_bracket_bounds = {int(bugid): hunk_bracket_bounds(buggy_hunk(buggy)) for bugid, buggy in zip(test_dataset.bugid, test_dataset.buggy)}
+
     for epoch in range(0,1):
    
-        test(epoch, tokenizer, model, device, test_loader)
+        memory = MemoryManager(device, high_water_mark=HIGH_WATER_MARK, on_trim=[model.beam_reorder_cache.release])
+        with ResultWriter(result_file, format=RESULT_FORMAT, on_flush=manifest.record) as writer:
+            test(epoch, tokenizer, model, device, test_loader, memory, writer, adaptive, bug_hunk_lengths, DEDUP_CANDIDATES,
+                 TOKEN_LOGPROBS, php_tables, bug_bracket_bounds)
         
         
         
@@ -0,0 +1,82 @@
+import torch
+from transformers import T5Config
+
+from inference.batching import BatchPlanner, collate_multi_source
+
+
+CONFIG = T5Config(vocab_size=100, d_model=32, d_kv=8, d_ff=64, num_layers=2, num_heads=4)
+
+
+def planner(**kwargs):
+    return BatchPlanner(CONFIG, num_beams=100, max_length=100, **kwargs)
+
+
+def test_plan_without_budget_only_caps_the_batch_size():
+    batches = planner(max_batch_size=2).plan([10, 50, 30, 20, 40])
+
+    # longest first
+    assert batches == [[1, 4], [2, 3], [0]]
+
+
+def test_plan_keeps_every_bug_once():
+    lengths = [(index * 37) % 512 + 1 for index in range(50)]
+    batches = planner(max_batch_size=4).plan(lengths)
+
+    assert sorted(index for batch in batches for index in batch) == list(range(50))
+    assert all(len(batch) <= 4 for batch in batches)
+
+
+def test_plan_fills_batches_within_the_memory_budget():
+    bug_planner = planner()
+    budget = 3 * bug_planner.bug_bytes(100) * bug_planner.safety_factor
+    bug_planner.memory_budget = budget
+    lengths = [100] * 7
+
+    batches = bug_planner.plan(lengths)
+
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert all(bug_planner.fits(len(batch), 100) for batch in batches)
+
+
+def test_plan_budgets_a_batch_by_its_longest_bug():
+    bug_planner = planner()
+    bug_planner.memory_budget = 2 * bug_planner.bug_bytes(400) * bug_planner.safety_factor
+
+    batches = bug_planner.plan([400, 10, 10, 10, 10, 10])
+
+    # two bugs fit in a batch as long as the long one, more of them in a batch of short ones
+    assert batches == [[0, 1], [2, 3, 4, 5]]
+
+
+def test_plan_gives_an_oversized_bug_a_batch_of_its_own():
+    bug_planner = planner(memory_budget=1)
+
+    assert bug_planner.plan([5, 3]) == [[0], [1]]
+
+
+def test_plan_in_data_order():
+    assert planner(max_batch_size=2, sort_by_length=False).plan([10, 50, 30]) == [[0, 1], [2]]
+
+
+def test_bug_bytes_grow_with_the_source_length():
+    bug_planner = planner()
+
+    assert bug_planner.bug_bytes(200) > bug_planner.bug_bytes(100)
+
+
+def test_collate_multi_source_drops_the_unused_padding():
+    def item(length_1, length_2):
+        mask_1 = torch.zeros(8, dtype=torch.long)
+        mask_1[:length_1] = 1
+        mask_2 = torch.zeros(8, dtype=torch.long)
+        mask_2[:length_2] = 1
+        return {'input_ids_1': mask_1 * 5, 'attention_mask_1': mask_1, 'input_ids_2': mask_2 * 7,
+                'attention_mask_2': mask_2, 'bugid': torch.tensor(0)}
+
+    batch = collate_multi_source([item(3, 2), item(1, 5)])
+
+    # both sources keep the same length, the longest of either
+    for key in ('input_ids_1', 'attention_mask_1', 'input_ids_2', 'attention_mask_2'):
+        assert batch[key].shape == (2, 5)
+    assert batch['attention_mask_2'][1].tolist() == [1, 1, 1, 1, 1]
+    assert batch['input_ids_1'][0].tolist() == [5, 5, 5, 0, 0]
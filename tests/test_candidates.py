@@ -0,0 +1,59 @@
+import pytest
+
+from inference.candidates import dedup_candidates, detokenize, token_key
+
+
+@pytest.mark.parametrize('candidate, expected', [
+    ('if ( $a > = $b )', 'if ( $a >= $b )'),
+    ('$a = = = $b', '$a === $b'),
+    ('$a ! = = $b', '$a !== $b'),
+    ('$this - > foo ( )', '$this -> foo ( )'),
+    ("[ 'a' = > 1 ]", "[ 'a' => 1 ]"),
+    ('self : : FOO', 'self :: FOO'),
+    ('$a < = > $b', '$a <=> $b'),
+    ('< ? php', '<?php'),
+])
+def test_detokenize_joins_spaced_operators(candidate, expected):
+    assert detokenize(candidate) == expected
+
+
+def test_detokenize_keeps_single_character_operators():
+    assert detokenize('$a = $b > $c') == '$a = $b > $c'
+
+
+def test_token_key_ignores_whitespace_outside_of_strings():
+    assert token_key('$x=foo( $a,$b );') == token_key('$x = foo($a, $b);')
+    assert token_key("$x = 'a b';") != token_key("$x = 'ab';")
+
+
+@pytest.mark.parametrize('spaced, joined', [('$x + = 1;', '$x += 1;'), ('$a & & $b', '$a && $b'), ('$i + +;', '$i++;')])
+def test_token_key_keeps_compound_operators_whole(spaced, joined):
+    assert token_key(spaced) != token_key(joined)
+
+
+def test_dedup_candidates_keeps_the_first_spelling_and_the_best_score():
+    candidates = ['$x = 1;', '$x=1;', '$y = 2;', '$x = 1 ;']
+    scores = [-0.5, -0.1, -0.3, -0.9]
+
+    unique, unique_scores, counts, ranks = dedup_candidates(candidates, scores)
+
+    assert unique == ['$x = 1;', '$y = 2;']
+    assert unique_scores == [-0.1, -0.3]
+    assert counts == [3, 1]
+    assert ranks == [0, 2]
+
+
+def test_dedup_candidates_without_scores_keeps_the_rank_order():
+    unique, unique_scores, counts, ranks = dedup_candidates(['b;', 'a;', 'b ;', 'c;'])
+
+    assert unique == ['b;', 'a;', 'c;']
+    assert unique_scores is None
+    assert counts == [2, 1, 1]
+    assert ranks == [0, 1, 3]
+
+
+def test_dedup_candidates_keeps_spaced_compound_operators_apart():
+    unique, _, counts, _ = dedup_candidates(['$x + = 1;', '$x += 1;'], [-0.1, -0.2])
+
+    assert unique == ['$x + = 1;', '$x += 1;']
+    assert counts == [1, 1]
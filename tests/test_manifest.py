@@ -0,0 +1,71 @@
+import json
+import os
+
+import pytest
+
+from inference.manifest import RunManifest, fingerprint
+
+
+def test_fingerprint_changes_with_the_files_and_the_settings(tmp_path):
+    data = tmp_path / 'test.csv'
+    data.write_text('bugid\n1\n')
+    base = fingerprint([str(data)], {'num_beams': 100})
+
+    assert fingerprint([str(data)], {'num_beams': 100}) == base
+    assert fingerprint([str(data)], {'num_beams': 10}) != base
+    data.write_text('bugid\n2\n')
+    assert fingerprint([str(data)], {'num_beams': 100}) != base
+
+
+def test_resume_truncates_the_rows_of_an_unfinished_bug(tmp_path):
+    result_file = tmp_path / 'result.csv'
+    manifest_file = str(tmp_path / 'result.csv.manifest.json')
+    manifest = RunManifest(manifest_file, 'run', str(result_file))
+    result_file.write_text('1\ta\n1\tb\n')
+    manifest.record([1], os.path.getsize(result_file))
+    with open(result_file, 'a') as handle:
+        # the run stopped while the rows of bug 2 were written
+        handle.write('2\ta\n2\t')
+
+    resumed = RunManifest(manifest_file, 'run', str(result_file))
+
+    assert resumed.completed == {1}
+    assert result_file.read_text() == '1\ta\n1\tb\n'
+
+
+def test_resume_keeps_complete_results(tmp_path):
+    result_file = tmp_path / 'result.csv'
+    manifest_file = str(tmp_path / 'manifest.json')
+    RunManifest(manifest_file, 'run', str(result_file)).record([1, 2], 0)
+    result_file.write_text('')
+
+    assert RunManifest(manifest_file, 'run', str(result_file)).completed == {1, 2}
+    with open(manifest_file) as handle:
+        assert json.load(handle)['completed'] == [1, 2]
+
+
+def test_resume_refuses_another_run(tmp_path):
+    result_file = str(tmp_path / 'result.csv')
+    manifest_file = str(tmp_path / 'manifest.json')
+    RunManifest(manifest_file, 'run', result_file)
+
+    with pytest.raises(ValueError):
+        RunManifest(manifest_file, 'other run', result_file)
+
+
+def test_results_without_a_manifest_are_not_overwritten(tmp_path):
+    result_file = tmp_path / 'result.csv'
+    result_file.write_text('1\ta\n')
+
+    with pytest.raises(ValueError):
+        RunManifest(str(tmp_path / 'manifest.json'), 'run', str(result_file))
+
+
+def test_result_file_shorter_than_recorded_is_an_error(tmp_path):
+    result_file = tmp_path / 'result.csv'
+    manifest_file = str(tmp_path / 'manifest.json')
+    RunManifest(manifest_file, 'run', str(result_file)).record([1], 100)
+    result_file.write_text('1\ta\n')
+
+    with pytest.raises(ValueError):
+        RunManifest(manifest_file, 'run', str(result_file))
@@ -0,0 +1,70 @@
+import json
+import os
+
+import pytest
+
+from validation.metadata import BugMetadataIndex, bug_key, build_index, load_metadata
+
+
+BUGS = [
+    {'repo_name': 'laravel', 'bug_no': 1, 'changed_file_paths': ['src/A.php'], 'changed_lines': [[{'buggy': [3], 'fixed': [3]}]]},
+    {'repo_name': 'Carbon', 'bug_no': 1, 'changed_file_paths': ['src/B.php', 'src/C.php'],
+     'changed_lines': [[{'buggy': [1], 'fixed': [1]}], [{'buggy': [], 'fixed': [7]}]]},
+]
+
+
+@pytest.fixture
+def metadata_path(tmp_path):
+    path = tmp_path / 'bug_metadata.json'
+    path.write_text(json.dumps(BUGS))
+    return str(path)
+
+
+def test_bug_key():
+    assert bug_key('laravel_framework_0a1b2c_12_0') == ('laravel', 'framework', 12)
+
+
+def test_index_finds_every_bug(metadata_path):
+    index = BugMetadataIndex(build_index(metadata_path, metadata_path + '.index'))
+
+    assert len(index) == 2
+    assert ('Carbon', 1) in index and ('Carbon', '1') in index
+    assert index.get('laravel', 1) == BUGS[0]
+    assert index.get('Carbon', '1') == BUGS[1]
+    with pytest.raises(KeyError):
+        index.get('Carbon', 2)
+
+
+def test_records_are_copies(metadata_path):
+    index = BugMetadataIndex(build_index(metadata_path, metadata_path + '.index'))
+
+    index.get('Carbon', 1)['changed_file_paths'].pop()
+
+    assert index.get('Carbon', 1)['changed_file_paths'] == ['src/B.php', 'src/C.php']
+
+
+def test_build_index_leaves_no_temporary_file(metadata_path, tmp_path):
+    build_index(metadata_path, metadata_path + '.index')
+    build_index(metadata_path, metadata_path + '.index')
+
+    assert sorted(os.listdir(tmp_path)) == ['bug_metadata.json', 'bug_metadata.json.index']
+
+
+def test_not_an_index(tmp_path):
+    path = tmp_path / 'bug_metadata.json.index'
+    path.write_bytes(b'[' * 64)
+
+    with pytest.raises(ValueError):
+        BugMetadataIndex(str(path))
+
+
+def test_load_metadata_rebuilds_a_stale_index(metadata_path):
+    build_index(metadata_path, metadata_path + '.index')
+    with open(metadata_path, 'w') as handle:
+        json.dump(BUGS[:1], handle)
+    os.utime(metadata_path, (os.path.getmtime(metadata_path + '.index') + 10,) * 2)
+
+    index = load_metadata(metadata_path)
+
+    assert len(index) == 1
+    assert load_metadata(metadata_path) is index
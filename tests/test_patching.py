@@ -0,0 +1,105 @@
+import os
+import stat
+
+import pytest
+
+from validation.patching import Hunk, apply_candidate, file_hunks, hunk_count, patch_bug, source_lines, unified_diff, write_atomically
+
+
+FILE = source_lines('<?php\n$a = 1;\n$b = 2;\n$c = 3;\n$d = 4;\n')
+
+
+def test_file_hunks_shift_insertions_by_the_lines_added_before():
+    changed_lines = [
+        {'buggy': [2, 3], 'fixed': [2]},      # one line less
+        {'buggy': [], 'fixed': [4]},          # inserted before buggy line 5
+        {'buggy': [5], 'fixed': [6, 7]},
+    ]
+
+    assert file_hunks(changed_lines) == [Hunk(1, 2), Hunk(4, 0), Hunk(4, 1)]
+
+
+def test_replaces_a_line():
+    patched = apply_candidate(FILE, [{'buggy': [3], 'fixed': [3]}], '$b = 20;')
+
+    assert ''.join(patched) == '<?php\n$a = 1;\n$b = 20;\n$c = 3;\n$d = 4;\n'
+
+
+def test_replaces_the_lines_of_a_hunk_with_one_candidate():
+    patched = apply_candidate(FILE, [{'buggy': [2, 3, 4], 'fixed': [2]}], '$abc = 6;\n')
+
+    assert ''.join(patched) == '<?php\n$abc = 6;\n$d = 4;\n'
+
+
+def test_inserts_before_the_line():
+    patched = apply_candidate(FILE, [{'buggy': [], 'fixed': [3]}], '$x = 0;')
+
+    assert ''.join(patched) == '<?php\n$a = 1;\n$x = 0;\n$b = 2;\n$c = 3;\n$d = 4;\n'
+
+
+def test_one_candidate_per_hunk_in_metadata_order():
+    changed_lines = [{'buggy': [5], 'fixed': [5]}, {'buggy': [2], 'fixed': [2]}]
+
+    patched = apply_candidate(FILE, changed_lines, ['$d = 40;', '$a = 10;'])
+
+    assert ''.join(patched) == '<?php\n$a = 10;\n$b = 2;\n$c = 3;\n$d = 40;\n'
+
+
+def test_the_last_line_keeps_its_missing_line_break():
+    patched = apply_candidate(source_lines('<?php\n$a = 1;'), [{'buggy': [2], 'fixed': [2]}], '$a = 2;')
+
+    assert ''.join(patched) == '<?php\n$a = 2;'
+
+
+def test_source_lines_split_at_line_feeds_only():
+    assert source_lines('a\r\nb\rc\n') == ['a\r\n', 'b\rc\n']
+
+
+@pytest.mark.parametrize('changed_lines, candidate', [
+    ([{'buggy': [2], 'fixed': [2]}], ['a', 'b']),
+    ([{'buggy': [2, 3], 'fixed': [2]}, {'buggy': [3], 'fixed': [3]}], 'a'),
+    ([{'buggy': [6], 'fixed': [6]}], 'a'),
+])
+def test_invalid_hunks_or_candidates(changed_lines, candidate):
+    with pytest.raises(ValueError):
+        apply_candidate(FILE, changed_lines, candidate)
+
+
+BUG = {
+    'changed_file_paths': ['src/A.php', 'src/B.php'],
+    'changed_lines': [[{'buggy': [2], 'fixed': [2]}], [{'buggy': [2], 'fixed': [2]}, {'buggy': [3], 'fixed': [3]}]],
+}
+BUGGY_SOURCES = {'src/A.php': '<?php\n$a = 1;\n', 'src/B.php': '<?php\n$b = 1;\n$c = 1;\n'}
+
+
+def test_patch_bug_runs_the_candidates_over_the_hunks_of_every_file():
+    assert hunk_count(BUG) == 3
+    assert patch_bug(BUG, BUGGY_SOURCES, ['$a = 2;', '$b = 2;', '$c = 2;']) == {
+        'src/A.php': '<?php\n$a = 2;\n',
+        'src/B.php': '<?php\n$b = 2;\n$c = 2;\n',
+    }
+    assert patch_bug(BUG, BUGGY_SOURCES, '$x;')['src/B.php'] == '<?php\n$x;\n$x;\n'
+    with pytest.raises(ValueError):
+        patch_bug(BUG, BUGGY_SOURCES, ['$a = 2;'])
+
+
+def test_unified_diff():
+    patched = patch_bug(BUG, BUGGY_SOURCES, ['$a = 2;', '$b = 1;', '$c = 1;'])
+
+    diff = unified_diff(BUGGY_SOURCES, patched)
+
+    assert diff.startswith('--- a/src/A.php\n+++ b/src/A.php\n')
+    assert '-$a = 1;\n+$a = 2;\n' in diff
+    assert 'src/B.php' not in diff
+
+
+def test_write_atomically_keeps_the_permissions(tmp_path):
+    path = tmp_path / 'A.php'
+    path.write_text('old')
+    os.chmod(path, 0o640)
+
+    write_atomically(str(path), 'new')
+
+    assert path.read_text() == 'new'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+    assert os.listdir(tmp_path) == ['A.php']
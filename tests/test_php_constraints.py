@@ -0,0 +1,94 @@
+import torch
+
+from inference.php_constraints import PHPConstraintLogitsProcessor, PHPSyntaxTables, hunk_bracket_bounds, scan
+
+
+class Tokenizer:
+    """A sentencepiece-like vocabulary of a few PHP pieces."""
+
+    tokens = ['<pad>', '</s>', '▁(', ')', '▁$a', '->', 'b', "'", ';', '▁}', '{']
+    all_special_ids = [0, 1]
+    eos_token_id = 1
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def convert_ids_to_tokens(self, ids):
+        return [self.tokens[token_id] for token_id in ids]
+
+
+PAD, EOS, OPEN, CLOSE, VARIABLE, ARROW, NAME, QUOTE, SEMICOLON, CLOSE_BRACE, OPEN_BRACE = range(11)
+
+TABLES = PHPSyntaxTables(Tokenizer())
+
+
+def masked(scores):
+    return (scores == -float('inf')).tolist()
+
+
+def test_scan_ignores_brackets_in_strings_and_comments():
+    _, depth, low = scan("foo(')', \"(\") // )\n}")
+
+    assert depth == [0, 0, -1]
+    assert low == [0, 0, -1]
+
+
+def test_hunk_bracket_bounds():
+    assert hunk_bracket_bounds('} else {') == ([0, 0, -1], [0, 0, 0])
+
+
+def test_masks_a_bracket_the_hunk_does_not_close():
+    processor = PHPConstraintLogitsProcessor(TABLES, [hunk_bracket_bounds('$a;')])
+
+    scores = processor(torch.tensor([[PAD, VARIABLE]]), torch.zeros(1, len(Tokenizer.tokens)))
+
+    assert masked(scores)[0][CLOSE] and masked(scores)[0][CLOSE_BRACE]
+    assert not masked(scores)[0][OPEN] and not masked(scores)[0][EOS]
+
+
+def test_masks_the_end_inside_a_string_and_after_a_dangling_arrow():
+    processor = PHPConstraintLogitsProcessor(TABLES, [hunk_bracket_bounds('$a;')])
+
+    scores = processor(torch.tensor([[PAD, QUOTE], [PAD, ARROW]]), torch.zeros(2, len(Tokenizer.tokens)))
+
+    assert masked(scores)[0][EOS] and masked(scores)[1][EOS]
+
+
+def test_masks_the_end_until_the_brackets_match_the_hunk():
+    processor = PHPConstraintLogitsProcessor(TABLES, [hunk_bracket_bounds('} else {')])
+
+    scores = processor(torch.tensor([[PAD, CLOSE_BRACE], [PAD, CLOSE_BRACE], [PAD, OPEN]]), torch.zeros(3, len(Tokenizer.tokens)))
+    scores = processor(torch.tensor([[PAD, CLOSE_BRACE, OPEN_BRACE], [PAD, CLOSE_BRACE, NAME], [PAD, OPEN, CLOSE]]),
+                       torch.zeros(3, len(Tokenizer.tokens)))
+
+    assert [row[EOS] for row in masked(scores)] == [False, True, False]
+
+
+def expected_scores(bounds, input_ids):
+    # a new processor scans every sequence from the start
+    return PHPConstraintLogitsProcessor(TABLES, bounds)(input_ids, torch.zeros(input_ids.shape[0], len(Tokenizer.tokens)))
+
+
+def test_follows_the_reordered_beams():
+    bounds = [hunk_bracket_bounds('$a;')]
+    processor = PHPConstraintLogitsProcessor(TABLES, bounds)
+    processor(torch.tensor([[PAD, OPEN], [PAD, QUOTE]]), torch.zeros(2, len(Tokenizer.tokens)))
+
+    # both beams continue the first one
+    input_ids = torch.tensor([[PAD, OPEN, VARIABLE], [PAD, OPEN, OPEN]])
+    scores = processor(input_ids, torch.zeros(2, len(Tokenizer.tokens)))
+
+    assert torch.equal(scores, expected_scores(bounds, input_ids))
+
+
+def test_rescans_the_beams_without_a_parent():
+    bounds = [hunk_bracket_bounds('$a;'), hunk_bracket_bounds('$a;')]
+    processor = PHPConstraintLogitsProcessor(TABLES, bounds)
+    processor(torch.tensor([[PAD, VARIABLE], [PAD, VARIABLE], [PAD, OPEN], [PAD, SEMICOLON]]),
+              torch.zeros(4, len(Tokenizer.tokens)))
+
+    # the processor is reused for another generation of the same length: only the last beam has a parent
+    input_ids = torch.tensor([[PAD, QUOTE, NAME], [PAD, OPEN, OPEN], [PAD, ARROW, NAME], [PAD, OPEN, NAME]])
+    scores = processor(input_ids, torch.zeros(4, len(Tokenizer.tokens)))
+
+    assert torch.equal(scores, expected_scores(bounds, input_ids))
@@ -0,0 +1,83 @@
+import pytest
+
+from validation.metadata import BugKey
+from validation.result_cache import ResultCache, content_key, get_result_cache
+
+
+BUG = BugKey('briannesbitt', 'Carbon', 5)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results.sqlite'))
+    yield cache
+    cache.close()
+
+
+def test_content_key_follows_the_files_the_bug_and_the_command():
+    key = content_key(BUG, {'src/A.php': 'a', 'src/B.php': 'b'}, 'test')
+
+    assert content_key(BUG, {'src/B.php': 'b', 'src/A.php': 'a'}, 'test') == key
+    assert content_key(BUG, {'src/A.php': 'a', 'src/B.php': 'c'}, 'test') != key
+    assert content_key(BugKey('briannesbitt', 'Carbon', 6), {'src/A.php': 'a', 'src/B.php': 'b'}, 'test') != key
+    assert content_key(BUG, {'src/A.php': 'a', 'src/B.php': 'b'}, 'other') != key
+    # the length of every file is part of the key, content cannot move from one file to the next
+    assert content_key(BUG, {'src/A.php': 'ab', 'src/B.php': ''}, 'test') != content_key(BUG, {'src/A.php': 'a', 'src/B.php': 'b'}, 'test')
+
+
+def test_put_and_get(cache):
+    cache.put('key', BUG, 'test', 'passAllTests', 'OK (1 test)')
+
+    assert cache.get('key') == ('passAllTests', 'OK (1 test)')
+    assert cache.get('other') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_results_are_shared_through_the_file(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    writer, reader = ResultCache(path), ResultCache(path)
+    writer.put('key', BUG, 'test', 'failedFailingTests', 'FAILURES!')
+
+    assert reader.get('key') == ('failedFailingTests', 'FAILURES!')
+
+
+def test_eviction_drops_the_least_recently_used_results(tmp_path):
+    output = 'x' * 1000
+    size = len('key0') + len('failedFailingTests') + len(output)
+    cache = ResultCache(str(tmp_path / 'results.sqlite'), max_bytes=3 * size)
+    for index in range(3):
+        cache.put('key{}'.format(index), BUG, 'test', 'failedFailingTests', output)
+    # key0 is used again, key1 and key2 are the least recently used ones now
+    assert cache.get('key0') is not None
+
+    # over max_bytes, evicted down to 90% of it: two results go
+    cache.put('key3', BUG, 'test', 'failedFailingTests', output)
+
+    assert [key for key in ('key0', 'key1', 'key2', 'key3') if cache.get(key) is not None] == ['key0', 'key3']
+
+
+def test_eviction_goes_down_to_90_percent(tmp_path):
+    output = 'x' * 96
+    size = len('key00') + len('noTestResults') + len(output)
+    cache = ResultCache(str(tmp_path / 'results.sqlite'), max_bytes=10 * size)
+    for index in range(11):
+        cache.put('key{:02}'.format(index), BUG, 'test', 'noTestResults', output)
+
+    kept = [index for index in range(11) if cache.get('key{:02}'.format(index)) is not None]
+
+    assert kept == list(range(2, 11))
+
+
+def test_buggy_sources_need_every_path(cache):
+    cache.put_buggy_sources(BUG, {'src/A.php': 'a', 'src/B.php': 'b'})
+
+    assert cache.buggy_sources(BUG, ['src/B.php', 'src/A.php']) == {'src/B.php': 'b', 'src/A.php': 'a'}
+    assert cache.buggy_sources(BUG, ['src/A.php', 'src/C.php']) is None
+    assert cache.buggy_sources(BugKey('briannesbitt', 'Carbon', 6), ['src/A.php']) is None
+
+
+def test_get_result_cache(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+
+    assert get_result_cache(None) is None
+    assert get_result_cache(path) is get_result_cache(path)
@@ -0,0 +1,150 @@
+import json
+import os
+
+import pytest
+
+from validation.schemata import (
+    PHPUNIT_RUN_FILE, PHPUnitRun, build_schema, parse_schema_output, phpunit_bootstrap, probe_phpunit, schema_eligible,
+    variant_path,
+)
+from validation.test_runner import FAILED, NO_RESULTS, PASSED, TIMED_OUT
+
+
+def test_schema_eligible():
+    assert schema_eligible({'changed_lines': [[{'buggy': [3], 'fixed': [3]}]]})
+    assert not schema_eligible({'changed_lines': [[{'buggy': [3], 'fixed': [3]}, {'buggy': [7], 'fixed': [7]}]]})
+
+
+def test_build_schema():
+    files = build_schema('src/A.php', {0: '<?php // 0', 3: '<?php // 3'})
+
+    assert sorted(files) == ['src/A.php', variant_path('src/A.php', 0), variant_path('src/A.php', 3)]
+    assert "getenv('PHPFIXER_CANDIDATE')" in files['src/A.php']
+    assert files[variant_path('src/A.php', 3)] == '<?php // 3'
+
+
+def test_parse_schema_output():
+    output = '\n'.join([
+        'PHPFIXER-SCHEMA boot 1.250',
+        'PHPFIXER-SCHEMA 0 begin',
+        'PHPUnit 9.6.0',
+        '\x1b[31mF\x1b[0m  1 / 1 (100%)',
+        'FAILURES!',
+        '',
+        'PHPFIXER-SCHEMA 0 end 1 0.400',
+        'PHPFIXER-SCHEMA 2 begin',
+        'OK (1 test, 1 assertion)',
+        '',
+        'PHPFIXER-SCHEMA 2 end 0 0.300',
+        'PHPFIXER-SCHEMA 3 begin',
+        'PHP Fatal error:  Cannot redeclare foo()',
+        'PHPFIXER-SCHEMA 3 end 255 0.100',
+        'PHPFIXER-SCHEMA 4 begin',
+        '.',
+        '',
+        'PHPFIXER-SCHEMA 4 end timeout 600.000',
+        # the runner died during this run
+        'PHPFIXER-SCHEMA 5 begin',
+        '..',
+    ])
+
+    schema = parse_schema_output(output)
+
+    assert schema.boot_seconds == 1.25
+    assert sorted(schema.outcomes) == [0, 2, 3, 4]
+    assert [schema.outcomes[index].status for index in (0, 2, 3, 4)] == [FAILED, PASSED, NO_RESULTS, TIMED_OUT]
+    assert schema.outcomes[2].output == 'OK (1 test, 1 assertion)'
+    assert schema.outcomes[2].seconds == 0.3
+    assert schema.outcomes[4].killed
+
+
+def test_parse_schema_output_boot_failed():
+    assert parse_schema_output('PHPFIXER-SCHEMA boot-failed the bootstrap loads the changed file\n') is None
+    assert parse_schema_output('PHP Fatal error:  Uncaught Error\n') is None
+
+
+@pytest.fixture
+def checkout(tmp_path):
+    (tmp_path / 'tests').mkdir()
+    (tmp_path / 'tests' / 'bootstrap.php').write_text('<?php\n')
+    return tmp_path
+
+
+def test_bootstrap_of_the_configuration(checkout):
+    (checkout / 'phpunit.xml.dist').write_text('<phpunit bootstrap="tests/bootstrap.php"><testsuites/></phpunit>')
+
+    assert phpunit_bootstrap(str(checkout), ['--filter', 'testA']) == str(checkout / 'tests' / 'bootstrap.php')
+    assert phpunit_bootstrap(str(checkout), ['--no-configuration']) is None
+
+
+def test_bootstrap_of_a_configuration_option(checkout):
+    (checkout / 'tests' / 'phpunit.xml').write_text('<phpunit bootstrap="bootstrap.php"/>')
+
+    assert phpunit_bootstrap(str(checkout), ['-c', 'tests/phpunit.xml']) == str(checkout / 'tests' / 'bootstrap.php')
+    assert phpunit_bootstrap(str(checkout), ['--configuration=tests']) == str(checkout / 'tests' / 'bootstrap.php')
+    assert phpunit_bootstrap(str(checkout), ['--bootstrap', 'tests/bootstrap.php', '-c', 'none.xml']) == str(
+        checkout / 'tests' / 'bootstrap.php')
+
+
+def test_no_bootstrap_before_the_php_section(checkout):
+    (checkout / 'phpunit.xml').write_text(
+        '<phpunit bootstrap="tests/bootstrap.php"><php><env name="APP_ENV" value="testing"/></php></phpunit>')
+
+    assert phpunit_bootstrap(str(checkout), []) is None
+
+
+def test_no_bootstrap(checkout):
+    assert phpunit_bootstrap(str(checkout), []) is None
+    (checkout / 'phpunit.xml').write_text('<phpunit bootstrap="tests/missing.php"/>')
+    assert phpunit_bootstrap(str(checkout), []) is None
+
+
+class Workspace:
+    def __init__(self, root):
+        self.root = str(root)
+        self.path = str(root / 'repo')
+        self.snapshot_dir = str(root / 'snapshots')
+        self.bugsphp_dir = str(root)
+        self.key = {'repo_owner': 'owner', 'repo_name': 'repo', 'bug_no': 1}
+        os.makedirs(os.path.join(self.path, 'vendor', 'bin'))
+        os.makedirs(self.snapshot_dir)
+
+
+# the failing-test-only task of a fake BugsPHP: runs vendor/bin/phpunit in the checkout with PHP (here the recorder
+# script is read and its record written the way PHP would)
+MAIN = '''import json, os, re, sys
+task, root = sys.argv[sys.argv.index('-t') + 1], sys.argv[sys.argv.index('-o') + 1]
+checkout = os.path.join(root, 'repo')
+phpunit = os.path.join(checkout, 'vendor', 'bin', 'phpunit')
+source = open(phpunit).read()
+with open(os.path.join(root, 'tasks.log'), 'a') as handle:
+    handle.write(task + '\\n')
+match = re.search(r'file_put_contents\\(("[^"]*")', source)
+if match:
+    with open(json.loads(match.group(1)), 'w') as handle:
+        json.dump({'cwd': checkout, 'argv': ['vendor/bin/phpunit', '--filter', 'testA']}, handle)
+'''
+
+
+def test_probe_phpunit_records_the_command_once(tmp_path):
+    workspace = Workspace(tmp_path)
+    (tmp_path / 'main.py').write_text(MAIN)
+    (tmp_path / 'repo' / 'vendor' / 'bin' / 'phpunit').write_text('the phpunit proxy')
+
+    run = probe_phpunit(workspace)
+
+    assert run == PHPUnitRun(workspace.path, ['vendor/bin/phpunit', '--filter', 'testA'],
+                             os.path.realpath(os.path.join(workspace.path, 'vendor', 'autoload.php')), None)
+    assert (tmp_path / 'repo' / 'vendor' / 'bin' / 'phpunit').read_text() == 'the phpunit proxy'
+    assert sorted(os.listdir(tmp_path / 'repo' / 'vendor' / 'bin')) == ['phpunit']
+    # kept with the snapshots, BugsPHP is not asked again
+    assert probe_phpunit(workspace) == run
+    assert len((tmp_path / 'tasks.log').read_text().splitlines()) == 1
+
+
+def test_probe_phpunit_without_phpunit(tmp_path):
+    workspace = Workspace(tmp_path)
+    (tmp_path / 'main.py').write_text(MAIN)
+
+    assert probe_phpunit(workspace) is None
+    assert json.loads((tmp_path / 'snapshots' / PHPUNIT_RUN_FILE).read_text()) is None
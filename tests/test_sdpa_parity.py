@@ -0,0 +1,125 @@
+import copy
+
+import pytest
+import torch
+from transformers import T5Config
+from transformers.models.t5.modeling_t5 import T5Attention
+
+from model_source.t5_for_multi_source import T5ForMultiSourceConditionalGeneration
+from model_source.t5_for_multi_source_parallel_weighted import T5ForMultiSourceParallelConditionalGeneration
+from model_source.t5_sdpa_attention import T5SdpaAttention
+
+
+ATOL = 1e-5
+
+CONFIG = T5Config(
+    vocab_size=64, d_model=32, d_kv=8, d_ff=64, num_layers=2, num_decoder_layers=2, num_heads=4,
+    decoder_start_token_id=0, pad_token_id=0, eos_token_id=1,
+)
+
+MODEL_CLASSES = [T5ForMultiSourceConditionalGeneration, T5ForMultiSourceParallelConditionalGeneration]
+
+
+def build(model_class, backend):
+    torch.manual_seed(0)
+    model = model_class(copy.deepcopy(CONFIG)).eval()
+    model.set_attention_backend(backend)
+    return model
+
+
+def padded_inputs():
+    # two sources of 10 tokens concatenated like in test.py, the second sample is padded in both sources
+    generator = torch.Generator().manual_seed(1)
+    input_ids = torch.randint(3, CONFIG.vocab_size, (2, 20), generator=generator)
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[1, 6:10] = 0
+    attention_mask[1, 17:] = 0
+    input_ids[attention_mask == 0] = CONFIG.pad_token_id
+    return input_ids, attention_mask
+
+
+def attention_pair(has_relative_attention_bias, is_decoder):
+    config = copy.deepcopy(CONFIG)
+    config.is_decoder = is_decoder
+    torch.manual_seed(0)
+    eager = T5Attention(config, has_relative_attention_bias=has_relative_attention_bias).eval()
+    sdpa = copy.deepcopy(eager)
+    sdpa.__class__ = T5SdpaAttention
+    return eager, sdpa
+
+
+def padding_mask(batch_size, key_length, padded_from):
+    mask = torch.zeros(batch_size, 1, 1, key_length)
+    mask[-1, ..., padded_from:] = torch.finfo(torch.float32).min
+    return mask
+
+
+@pytest.mark.parametrize('has_relative_attention_bias', [False, True], ids=['mask-only', 'relative-bias'])
+@pytest.mark.parametrize('masked', [False, True], ids=['unmasked', 'padded'])
+def test_self_attention_matches_eager(has_relative_attention_bias, masked):
+    eager, sdpa = attention_pair(has_relative_attention_bias, is_decoder=False)
+    hidden_states = torch.randn(2, 7, CONFIG.d_model)
+    mask = padding_mask(2, 7, 4) if masked else None
+
+    with torch.no_grad():
+        expected = eager(hidden_states, mask=mask)
+        actual = sdpa(hidden_states, mask=mask)
+
+    torch.testing.assert_close(actual[0], expected[0], atol=ATOL, rtol=0)
+    # the position bias is shared with the next layers, it has to give the same scores there
+    torch.testing.assert_close(actual[2].expand_as(expected[2]), expected[2], atol=ATOL, rtol=0)
+
+
+@pytest.mark.parametrize('has_relative_attention_bias', [False, True], ids=['mask-only', 'relative-bias'])
+def test_cached_decoder_step_matches_eager(has_relative_attention_bias):
+    eager, sdpa = attention_pair(has_relative_attention_bias, is_decoder=True)
+    past = (torch.randn(2, CONFIG.num_heads, 5, CONFIG.d_kv), torch.randn(2, CONFIG.num_heads, 5, CONFIG.d_kv))
+    hidden_states = torch.randn(2, 1, CONFIG.d_model)
+
+    with torch.no_grad():
+        expected = eager(hidden_states, mask=padding_mask(2, 6, 6), past_key_value=past, use_cache=True)
+        actual = sdpa(hidden_states, mask=padding_mask(2, 6, 6), past_key_value=past, use_cache=True)
+
+    torch.testing.assert_close(actual[0], expected[0], atol=ATOL, rtol=0)
+    torch.testing.assert_close(actual[1][0], expected[1][0])
+    torch.testing.assert_close(actual[1][1], expected[1][1])
+
+
+def test_cross_attention_matches_eager():
+    eager, sdpa = attention_pair(has_relative_attention_bias=False, is_decoder=True)
+    hidden_states = torch.randn(2, 3, CONFIG.d_model)
+    key_value_states = torch.randn(2, 8, CONFIG.d_model)
+
+    with torch.no_grad():
+        expected = eager(hidden_states, mask=padding_mask(2, 8, 5), key_value_states=key_value_states)
+        actual = sdpa(hidden_states, mask=padding_mask(2, 8, 5), key_value_states=key_value_states)
+
+    torch.testing.assert_close(actual[0], expected[0], atol=ATOL, rtol=0)
+
+
+@pytest.mark.parametrize('model_class', MODEL_CLASSES, ids=['serial', 'parallel'])
+def test_teacher_forced_logits_match_eager(model_class):
+    input_ids, attention_mask = padded_inputs()
+    labels = torch.randint(2, CONFIG.vocab_size, (2, 6), generator=torch.Generator().manual_seed(2))
+
+    with torch.no_grad():
+        expected = build(model_class, 'eager')(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
+        actual = build(model_class, 'sdpa')(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
+
+    torch.testing.assert_close(actual.logits, expected.logits, atol=ATOL, rtol=0)
+
+
+@pytest.mark.parametrize('num_beams', [1, 4], ids=['greedy', 'beam'])
+@pytest.mark.parametrize('model_class', MODEL_CLASSES, ids=['serial', 'parallel'])
+def test_generate_matches_eager(model_class, num_beams):
+    input_ids, attention_mask = padded_inputs()
+    outputs = {}
+    for backend in ('eager', 'sdpa'):
+        with torch.no_grad():
+            outputs[backend] = build(model_class, backend).generate(
+                input_ids=input_ids, attention_mask=attention_mask, max_length=12, num_beams=num_beams,
+                num_return_sequences=num_beams, early_stopping=True, return_dict_in_generate=True, output_scores=True)
+
+    assert torch.equal(outputs['sdpa'].sequences, outputs['eager'].sequences)
+    if num_beams > 1:
+        torch.testing.assert_close(outputs['sdpa'].sequences_scores, outputs['eager'].sequences_scores, atol=ATOL, rtol=0)
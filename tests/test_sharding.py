@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from inference.sharding import merge_shards, shard_cores, split_bugs
+
+
+def test_split_bugs_deals_the_longest_first():
+    shards = split_bugs([10, 11, 12, 13, 14], [5, 50, 20, 40, 30], 2)
+
+    assert shards == [[11, 14, 10], [13, 12]]
+    assert split_bugs([10, 11, 12, 13, 14], [5, 50, 20, 40, 30], 2) == shards
+
+
+def test_shard_cores():
+    assert shard_cores(3, cores=[7, 0, 1, 2, 3, 4, 5]) == [[0, 1, 2], [3, 4], [5, 7]]
+    with pytest.raises(ValueError):
+        shard_cores(3, cores=[0, 1])
+
+
+def test_merge_shards_in_the_order_of_the_bugs(tmp_path):
+    shard_0, shard_1 = tmp_path / 'result.csv.shard-0-of-2', tmp_path / 'result.csv.shard-1-of-2'
+    shard_0.write_text('3\tbug3\tpatch a\n1\tbug1\tpatch a\n3\tbug3\tpatch b\n')
+    shard_1.write_text('2\tbug2\tpatch a\n')
+    result = tmp_path / 'result.csv'
+    result.write_text('0\tbug0\tpatch a\n')
+
+    size = merge_shards([str(shard_0), str(shard_1)], str(result), 'tsv', [1, 2, 3])
+
+    assert result.read_text() == '0\tbug0\tpatch a\n1\tbug1\tpatch a\n2\tbug2\tpatch a\n3\tbug3\tpatch a\n3\tbug3\tpatch b\n'
+    assert size == len(result.read_bytes())
+
+
+def test_merge_jsonl_shards(tmp_path):
+    rows = [{'bugid': 2, 'patch': 'a'}, {'bugid': 1, 'patch': 'b'}]
+    shard = tmp_path / 'result.jsonl.shard-0-of-1'
+    shard.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+
+    merge_shards([str(shard)], str(tmp_path / 'result.jsonl'), 'jsonl', [1, 2])
+
+    assert [json.loads(line) for line in (tmp_path / 'result.jsonl').read_text().splitlines()] == rows[::-1]
@@ -0,0 +1,67 @@
+import pytest
+
+from validation.syntax import SyntaxPreScreen, check_syntax
+
+
+VALID = [
+    '<?php\n$a = foo($b, [1, 2])->bar();\n',
+    "<?php\n$a = ')' . \"(\" . '\\'';\n",
+    '<?php\n// ) unmatched in a comment\n# ] too\n/* { */\n$a = 1;\n',
+    '<?php\n$a = "{$b->c[\'d\']} and ${e}";\n',
+    '<?php\n$a = <<<EOT\n  ) ] }\n  EOT;\n$b = 1;\n',
+    '<?php\nif ($a) { ?>\n<div>)</div>\n<?php }\n',
+    '<?php\n#[Attribute]\nclass A { public function b(): ?int { return $this?->c ?? null; } }\n',
+    '<?php\n$a = -1 + +2;\n$b = [1, 2,];\nfoo(...$args);\n',
+    '<html>( no php here',
+]
+
+
+@pytest.mark.parametrize('source', VALID)
+def test_valid_code_passes(source):
+    assert check_syntax(source) is None
+
+
+@pytest.mark.parametrize('source, line, message', [
+    ('<?php\n$a = foo($b;\n', 2, "unclosed '('"),
+    ('<?php\n$a = 1;\n}\n', 3, "unmatched '}'"),
+    ('<?php\n$a = [1, 2);\n', 2, "')' closes '[' of line 2"),
+    ("<?php\n$a = 'abc;\n", 2, 'unterminated string'),
+    ('<?php\n/* comment\n$a = 1;\n', 2, 'unterminated comment'),
+    ('<?php\n$a = $b->;\n', 2, "'->' without a member"),
+    ('<?php\n$a = A::;\n', 2, "'::' without a member"),
+    ('<?php\n$a = 1 +;\n', 2, "'+' without an operand before ';'"),
+    ('<?php\nfoo($a ==);\n', 2, "'==' without an operand before ')'"),
+    ('<?php\n$a = <<<EOT\ntext\n', 2, 'unterminated heredoc'),
+])
+def test_errors_are_found(source, line, message):
+    issue = check_syntax(source)
+
+    assert issue is not None
+    assert (issue.line, issue.message) == (line, message)
+
+
+BUGGY = '<?php\nif ($a) {\n    $b = 1;\n}\n'
+
+
+def test_prescreen_rejects_a_candidate_that_breaks_the_file():
+    prescreen = SyntaxPreScreen(lint=False)
+
+    rejection = prescreen.screen({'src/A.php': (BUGGY, '<?php\nif ($a) {\n    $b = (1;\n}\n')})
+
+    assert rejection == "src/A.php:4: '}' closes '(' of line 3"
+    assert (prescreen.screened, prescreen.rejected_scan, prescreen.rejected_lint) == (1, 1, 0)
+
+
+def test_prescreen_passes_a_valid_candidate():
+    prescreen = SyntaxPreScreen(lint=False)
+
+    assert prescreen.screen({'src/A.php': (BUGGY, '<?php\nif ($a) {\n    $b = 2;\n}\n')}) is None
+    assert prescreen.rejected_scan == 0
+
+
+def test_prescreen_does_not_reject_what_the_buggy_file_fails_already():
+    # syntax the scan gets wrong fails the buggy file as well, the scan is not trusted for that file
+    buggy = '<?php\n$a = `ls ${b`;\n'
+
+    assert check_syntax(buggy) is not None
+    assert SyntaxPreScreen(lint=False).screen({'src/A.php': (buggy, buggy + '$c = (;\n')}) is None
@@ -0,0 +1,72 @@
+import pytest
+
+from validation.test_runner import FAILED, NO_RESULTS, PASSED, TIMED_OUT, line_status, run_tests
+
+
+@pytest.mark.parametrize('line, status', [
+    ('OK (3 tests, 5 assertions)', PASSED),
+    ('OK, but incomplete, skipped, or risky tests!', PASSED),
+    ('OK', PASSED),
+    ('FAILURES!', FAILED),
+    ('ERRORS!', FAILED),
+    ('There was 1 failure:', FAILED),
+    ('There were 2 errors:', FAILED),
+    ('..F.E   5 / 10 ( 50%)', FAILED),
+    ('.....  63 / 126 ( 50%)', None),
+    ('..S.I  5 / 5 (100%)', None),
+    ('  ..F 3 / 9 ( 33%)  ', FAILED),
+    # test output that looks like progress letters without the counter
+    ('END', None),
+    ('FINE', None),
+    ('DIE', None),
+    ('OKAY', None),
+    ('Tests: 3, Assertions: 5, Failures: 1.', None),
+])
+def test_line_status(line, status):
+    assert line_status(line) == status
+
+
+MAIN = '''import sys, time
+for line in {lines!r}:
+    if isinstance(line, float):
+        time.sleep(line)
+    else:
+        print(line, flush=True)
+'''
+
+
+def run(tmp_path, lines, **kwargs):
+    (tmp_path / 'main.py').write_text(MAIN.format(lines=lines))
+    return run_tests('owner', 'repo', 1, 'failing-test-only', str(tmp_path), bugsphp_dir=str(tmp_path), **kwargs)
+
+
+def test_passed(tmp_path):
+    outcome = run(tmp_path, ['PHPUnit 9.5', '\x1b[32m...\x1b[0m  3 / 3 (100%)', '\x1b[30;42mOK (3 tests, 3 assertions)\x1b[0m'])
+
+    assert (outcome.status, outcome.killed) == (PASSED, False)
+    assert 'OK (3 tests, 3 assertions)' in outcome.output.split('\n')
+
+
+def test_failed_without_fail_fast_runs_to_the_end(tmp_path):
+    outcome = run(tmp_path, ['..F  3 / 9 ( 33%)', '......  9 / 9 (100%)', 'FAILURES!'])
+
+    assert (outcome.status, outcome.killed) == (FAILED, False)
+    assert outcome.output.endswith('FAILURES!')
+
+
+def test_fail_fast_kills_at_the_first_failure(tmp_path):
+    outcome = run(tmp_path, ['..F  3 / 9 ( 33%)', 30.0, 'FAILURES!'], fail_fast=True)
+
+    assert (outcome.status, outcome.killed) == (FAILED, True)
+    assert outcome.seconds < 10
+
+
+def test_no_results(tmp_path):
+    assert run(tmp_path, ['Could not open input file: vendor/bin/phpunit']).status == NO_RESULTS
+
+
+def test_timeout(tmp_path):
+    outcome = run(tmp_path, ['.', 30.0, 'OK (1 test, 1 assertion)'], timeout=1)
+
+    assert (outcome.status, outcome.killed) == (TIMED_OUT, True)
+    assert outcome.seconds < 10
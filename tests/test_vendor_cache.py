@@ -0,0 +1,62 @@
+import os
+
+from validation.vendor_cache import GENERATED, VendorCache, dependency_key, link_tree, vendor_dir
+
+
+def test_vendor_dir(tmp_path):
+    assert vendor_dir(str(tmp_path)) == 'vendor'
+    (tmp_path / 'composer.json').write_text('{"config": {"vendor-dir": "lib/vendor"}}')
+    assert vendor_dir(str(tmp_path)) == 'lib/vendor'
+
+
+def test_dependency_key(tmp_path):
+    assert dependency_key(str(tmp_path)) is None
+
+    (tmp_path / 'composer.json').write_text('{"require": {"a/b": "^1"}}')
+    without_lock = dependency_key(str(tmp_path))
+    (tmp_path / 'composer.lock').write_text('{"packages": []}')
+    key = dependency_key(str(tmp_path))
+    assert key != without_lock
+
+    # the autoload sections of composer.json are part of the key, its other content only without a lockfile
+    (tmp_path / 'composer.json').write_text('{"require": {"a/b": "^2"}}')
+    assert dependency_key(str(tmp_path)) == key
+    (tmp_path / 'composer.json').write_text('{"autoload": {"psr-4": {"App\\\\": "src/"}}}')
+    assert dependency_key(str(tmp_path)) != key
+
+
+def test_link_tree_links_files_and_copies_the_generated_ones(tmp_path):
+    source = tmp_path / 'source'
+    (source / 'composer').mkdir(parents=True)
+    (source / 'a' / 'b').mkdir(parents=True)
+    (source / 'a' / 'b' / 'C.php').write_text('<?php')
+    (source / 'autoload.php').write_text('<?php // autoload')
+    (source / 'composer' / 'autoload_classmap.php').write_text('<?php // classmap')
+    os.symlink('../a/b/C.php', str(source / 'a' / 'link.php'))
+
+    link_tree(str(source), str(tmp_path / 'target'), copied=GENERATED)
+
+    target = tmp_path / 'target'
+    assert os.path.samefile(str(source / 'a' / 'b' / 'C.php'), str(target / 'a' / 'b' / 'C.php'))
+    assert os.readlink(str(target / 'a' / 'link.php')) == '../a/b/C.php'
+    assert not os.path.samefile(str(source / 'autoload.php'), str(target / 'autoload.php'))
+    assert not os.path.samefile(str(source / 'composer' / 'autoload_classmap.php'),
+                                str(target / 'composer' / 'autoload_classmap.php'))
+    assert (target / 'composer' / 'autoload_classmap.php').read_text() == '<?php // classmap'
+
+
+def test_store_once_per_dependencies(tmp_path):
+    cache = VendorCache(str(tmp_path / 'cache'))
+    checkout = tmp_path / 'checkout'
+    (checkout / 'vendor' / 'a').mkdir(parents=True)
+    (checkout / 'composer.lock').write_text('{}')
+    (checkout / 'vendor' / 'a' / 'A.php').write_text('<?php')
+
+    cache.store(str(checkout))
+    (checkout / 'vendor' / 'a' / 'B.php').write_text('<?php')
+    cache.store(str(checkout))
+
+    entry = tmp_path / 'cache' / dependency_key(str(checkout))
+    assert sorted(os.listdir(str(entry))) == ['.phpfixer-complete', 'vendor']
+    assert os.listdir(str(entry / 'vendor' / 'a')) == ['A.php']
+    assert [name for name in os.listdir(str(tmp_path / 'cache')) if name.startswith('.tmp-')] == []
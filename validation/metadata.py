@@ -0,0 +1,115 @@
+import copy
+import json
+import mmap
+import os
+import struct
+import tempfile
+from collections import namedtuple
+
+
+METADATA_FILE = './bugsPHP/bug_metadata.json'
+
+INDEX_MAGIC = b'BUGIDX1\n'
+_HEADER_LENGTH = struct.Struct('<Q')
+
+# a BugsPHP bug, as named in the `bug` column of the test data: <owner>_<repo>_<commit>_<bug_no>_<hunk>
+BugKey = namedtuple('BugKey', ['repo_owner', 'repo_name', 'bug_no'])
+
+
+def bug_key(bug):
+    bug_data = bug.split('_')
+    return BugKey(bug_data[0], bug_data[1], int(bug_data[3]))
+
+
+def _index_key(repo_name, bug_no):
+    return '{}:{}'.format(repo_name, int(bug_no))
+
+
+def build_index(metadata_path, index_path):
+    """
+    Writes the compact index of `bug_metadata.json`: a header mapping `repo_name:bug_no` to the offset and length of
+    the JSON record of the bug, followed by the records. The file is replaced atomically.
+    """
+    with open(metadata_path, 'r') as handle:
+        bugs = json.load(handle)
+
+    offsets, records, offset = {}, [], 0
+    for bug in bugs:
+        record = json.dumps(bug, separators=(',', ':')).encode()
+        offsets[_index_key(bug['repo_name'], bug['bug_no'])] = (offset, len(record))
+        records.append(record)
+        offset += len(record)
+    header = json.dumps(offsets, separators=(',', ':')).encode()
+
+    # a temporary file of its own: the validation workers may all rebuild a missing or stale index at once
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(index_path) or '.', prefix='.bug-index-')
+    try:
+        with os.fdopen(descriptor, 'wb') as handle:
+            handle.write(INDEX_MAGIC)
+            handle.write(_HEADER_LENGTH.pack(len(header)))
+            handle.write(header)
+            handle.writelines(records)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, index_path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    return index_path
+
+
+class BugMetadataIndex:
+    """
+    O(1) lookup of the BugsPHP metadata (`changed_file_paths`, `changed_lines`, ...) of a bug by repository name and
+    bug number.
+
+    The index file is memory-mapped read-only, so the validation workers of a machine share its pages instead of
+    each holding a parsed copy of `bug_metadata.json`. Only the offsets are parsed when the index is opened, a record
+    is decoded on its first lookup and kept; every lookup returns a copy of it that the caller may change.
+    """
+
+    def __init__(self, index_path):
+        self.path = index_path
+        with open(index_path, 'rb') as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError('{} is not a bug metadata index'.format(index_path))
+        start = len(INDEX_MAGIC) + _HEADER_LENGTH.size
+        (header_length,) = _HEADER_LENGTH.unpack(self._map[len(INDEX_MAGIC):start])
+        self._offsets = json.loads(self._map[start:start + header_length])
+        self._records_start = start + header_length
+        self._records = {}
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, key):
+        return _index_key(*key) in self._offsets
+
+    def get(self, repo_name, bug_no):
+        """The metadata record of a bug, a `KeyError` when the metadata has no such bug."""
+        try:
+            offset, length = self._offsets[_index_key(repo_name, bug_no)]
+        except KeyError:
+            raise KeyError('{} bug {} is not in {}'.format(repo_name, bug_no, self.path)) from None
+        if offset not in self._records:
+            start = self._records_start + offset
+            self._records[offset] = json.loads(self._map[start:start + length])
+        return copy.deepcopy(self._records[offset])
+
+
+_indexes = {}
+
+
+def load_metadata(metadata_path=METADATA_FILE):
+    """
+    The index of `metadata_path`, built next to it (`<metadata_path>.index`) when it is missing or older than the
+    metadata, and opened once per process.
+    """
+    index_path = metadata_path + '.index'
+    if index_path not in _indexes:
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(metadata_path):
+            build_index(metadata_path, index_path)
+        _indexes[index_path] = BugMetadataIndex(index_path)
+    return _indexes[index_path]
@@ -0,0 +1,113 @@
+import difflib
+import io
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+
+
+# a hunk of a changed file in buggy-file lines: `length` lines replaced from index `start`, 0 for an insertion
+Hunk = namedtuple('Hunk', ['start', 'length'])
+
+
+def file_hunks(changed_lines):
+    """
+    The hunks of a changed file, from its `changed_lines` in the BugsPHP metadata, in their metadata order.
+
+    The buggy line numbers of a hunk are lines of the buggy file already. An insertion (a hunk without buggy lines) only
+    has the fixed line numbers, which are shifted by the lines the hunks before it add or remove.
+    """
+    hunks = []
+    line_added = 0
+    for lines in changed_lines:
+        if lines['buggy']:
+            hunks.append(Hunk(lines['buggy'][0] - 1, lines['buggy'][-1] - lines['buggy'][0] + 1))
+        else:
+            hunks.append(Hunk(lines['fixed'][0] - 1 - line_added, 0))
+        line_added += len(lines['fixed']) - len(lines['buggy'])
+    return hunks
+
+
+def hunk_count(bug):
+    """The number of hunks of a bug over all its changed files, the length of a per-hunk candidate list."""
+    return sum(len(changed_lines) for changed_lines in bug['changed_lines'])
+
+
+def source_lines(source):
+    """The lines of `source` as `readlines()` gives them, split at line feeds only."""
+    return io.StringIO(source).readlines()
+
+
+def _candidate_lines(candidate, ends_line):
+    if ends_line and not candidate.endswith('\n'):
+        candidate += '\n'
+    return [candidate]
+
+
+def apply_candidate(file_lines, changed_lines, candidate):
+    """
+    The lines of a changed file with a candidate at the place of every hunk of `changed_lines`, built in one pass.
+
+    `candidate` is one string for every hunk or a list with the candidate of each hunk in metadata order. A
+    candidate replaces the buggy lines of its hunk (an insertion goes before the line it was inserted at) and gets the
+    line break of the lines it replaces, so it never runs into the next line.
+    """
+    hunks = file_hunks(changed_lines)
+    candidates = [candidate] * len(hunks) if isinstance(candidate, str) else list(candidate)
+    if len(candidates) != len(hunks):
+        raise ValueError('{} candidates for {} hunks'.format(len(candidates), len(hunks)))
+
+    patched_lines = []
+    position = 0
+    for hunk, hunk_candidate in sorted(zip(hunks, candidates), key=lambda item: item[0]):
+        end = hunk.start + hunk.length
+        if hunk.start < position or end > len(file_lines):
+            raise ValueError('hunk at line {} overlaps another hunk or the end of the file'.format(hunk.start + 1))
+        patched_lines.extend(file_lines[position:hunk.start])
+        replaced_line = file_lines[end - 1] if hunk.length else '\n'
+        patched_lines.extend(_candidate_lines(hunk_candidate, replaced_line.endswith('\n')))
+        position = end
+    patched_lines.extend(file_lines[position:])
+    return patched_lines
+
+
+def patch_bug(bug, buggy_sources, candidate):
+    """
+    The patched content of the changed files of `bug` (its BugsPHP metadata), from their `buggy_sources` (path to
+    content), without touching the disk. A per-hunk `candidate` list runs over the hunks of the files in order.
+    """
+    per_hunk = not isinstance(candidate, str)
+    if per_hunk and len(candidate) != hunk_count(bug):
+        raise ValueError('{} candidates for {} hunks'.format(len(candidate), hunk_count(bug)))
+
+    patched_sources = {}
+    used = 0
+    for path, changed_lines in zip(bug['changed_file_paths'], bug['changed_lines']):
+        file_candidate = candidate[used:used + len(changed_lines)] if per_hunk else candidate
+        used += len(changed_lines)
+        file_lines = source_lines(buggy_sources[path])
+        patched_sources[path] = ''.join(apply_candidate(file_lines, changed_lines, file_candidate))
+    return patched_sources
+
+
+def unified_diff(buggy_sources, patched_sources):
+    """The unified diff of the patched files against the buggy ones, both mapping paths to content."""
+    return ''.join(
+        ''.join(difflib.unified_diff(
+            source_lines(buggy_sources[path]), source_lines(patched_sources[path]),
+            'a/' + path, 'b/' + path))
+        for path in patched_sources)
+
+
+def write_atomically(path, content):
+    """Replaces the file at `path` by `content` in one rename, keeping its permissions."""
+    handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.phpfixer-')
+    try:
+        with os.fdopen(handle, 'w') as file:
+            file.write(content)
+        if os.path.exists(path):
+            shutil.copymode(path, temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
@@ -0,0 +1,110 @@
+import multiprocessing
+import os
+import time
+import traceback
+from collections import namedtuple
+
+from validation.workspace import set_task_limits
+
+
+# a candidate to validate: `job_id` is the caller's handle, `bug` the bug name of the test data
+ValidationJob = namedtuple('ValidationJob', ['job_id', 'bug', 'candidate', 'epoch'])
+
+# `exec_result` is what getResults returned, None when it raised (`error` holds the traceback then) or when the job
+# was `cancelled` before a worker started it
+ValidationResult = namedtuple('ValidationResult', ['job_id', 'bug', 'exec_result', 'seconds', 'worker', 'error', 'cancelled'])
+
+
+def _worker(index, workspace_root, limits, jobs, results, epoch):
+    # imported in the worker, it is the only process that runs getResults
+    import BugsPHPDiscriminator
+
+    os.makedirs(workspace_root, exist_ok=True)
+    set_task_limits(limits)
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        if job.epoch < epoch.value:
+            results.put(ValidationResult(job.job_id, job.bug, None, 0.0, index, None, True))
+            continue
+        start = time.time()
+        try:
+            exec_result = BugsPHPDiscriminator.getResults(None, job.candidate, None, [job.bug], workspace_root=workspace_root)
+            error = None
+        except Exception:
+            exec_result, error = None, traceback.format_exc()
+        results.put(ValidationResult(job.job_id, job.bug, exec_result, time.time() - start, index, error, False))
+
+
+class ValidationPool:
+    """
+    Validates candidates with `getResults` in `workers` processes at once.
+
+    Every worker has its own workspace root (`<workspace_base>/worker-<i>`, BugsPHP checks the bugs out below it), so
+    candidates of the same bug or of bugs of the same repository never share a checkout. A worker keeps its prepared
+    checkout between jobs (see `BugWorkspace`), so the candidates of a bug cost one checkout and install per worker
+    that gets one of them. `limits` (`ResourceLimits`) caps the memory and CPU time of each BugsPHP task process.
+
+    `submit()` queues jobs, `results()` yields a `ValidationResult` per submitted job in completion order and
+    `cancel_pending()` drops the queued ones.
+    """
+
+    def __init__(self, workers=None, workspace_base='/tmp/phpfixer-workers', limits=None):
+        self.workers = workers or os.cpu_count()
+        self.workspace_base = workspace_base
+        context = multiprocessing.get_context('spawn')
+        self._jobs = context.Queue()
+        self._results = context.Queue()
+        self._epoch = context.Value('i', 0)
+        self._pending = 0
+        self._processes = [
+            context.Process(
+                target=_worker,
+                args=(index, os.path.join(workspace_base, 'worker-{}'.format(index)), limits, self._jobs, self._results,
+                      self._epoch),
+                name='validation-worker-{}'.format(index),
+                daemon=True,
+                )
+            for index in range(self.workers)
+            ]
+        for process in self._processes:
+            process.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, job_id, bug, candidate):
+        self._jobs.put(ValidationJob(job_id, bug, candidate, self._epoch.value))
+        self._pending += 1
+
+    def cancel_pending(self):
+        """
+        Cancels the jobs submitted so far that no worker has started: they still get a result, with `cancelled` set.
+        Jobs that are running finish.
+        """
+        with self._epoch.get_lock():
+            self._epoch.value += 1
+
+    def results(self):
+        """Yields the result of every submitted job as soon as a worker finishes it."""
+        while self._pending:
+            result = self._results.get()
+            self._pending -= 1
+            yield result
+
+    def validate(self, jobs):
+        """Validates `(job_id, bug, candidate)` jobs and yields their results in completion order."""
+        for job_id, bug, candidate in jobs:
+            self.submit(job_id, bug, candidate)
+        yield from self.results()
+
+    def close(self):
+        """Lets the workers finish the queued jobs and stops them."""
+        for _ in self._processes:
+            self._jobs.put(None)
+        for process in self._processes:
+            process.join()
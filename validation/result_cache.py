@@ -0,0 +1,144 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+
+RESULT_CACHE_FILE = '/tmp/phpfixer-results.sqlite'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    bug TEXT NOT NULL,
+    command TEXT NOT NULL,
+    exec_result TEXT NOT NULL,
+    output TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE TABLE IF NOT EXISTS sources (
+    bug TEXT NOT NULL,
+    path TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (bug, path)
+);
+'''
+
+
+def content_key(bug, files, command):
+    """The cache key of the patched `files` (path to content) of `bug` (a `BugKey`) tested with `command`."""
+    digest = hashlib.sha256()
+    digest.update('{}--{}-{}\0{}\0'.format(bug.repo_owner, bug.repo_name, bug.bug_no, command).encode())
+    for path in sorted(files):
+        content = files[path].encode()
+        digest.update('{}\0{}\0'.format(path, len(content)).encode())
+        digest.update(content)
+    return digest.hexdigest()
+
+
+def _bug_name(bug):
+    return '{}--{}-{}'.format(bug.repo_owner, bug.repo_name, bug.bug_no)
+
+
+class ResultCache:
+    """
+    Test results of candidates, keyed by the content of the files they patched (see `content_key`), so the same
+    patch coming back from another beam, checkpoint or run is not tested again.
+
+    The cache is a SQLite database in WAL mode, the validation workers of a machine can read and write it at the same
+    time. It also keeps the buggy content of the changed files of every bug it has seen, which is all it takes to
+    build the patched files of a candidate and look its result up without a checkout. When the results add up to more
+    than `max_bytes`, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path=RESULT_CACHE_FILE, max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(_SCHEMA)
+
+    def get(self, key):
+        """The `(exec_result, output)` cached under `key`, None on a miss."""
+        row = self._connection.execute('SELECT exec_result, output FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self._connection.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        self.hits += 1
+        return row
+
+    def put(self, key, bug, command, exec_result, output):
+        size = len(key) + len(exec_result) + len(output.encode())
+        with self._transaction():
+            self._connection.execute(
+                'INSERT OR REPLACE INTO results (key, bug, command, exec_result, output, size, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, _bug_name(bug), command, exec_result, output, size, time.time()))
+            self._evict()
+
+    def buggy_sources(self, bug, paths):
+        """The buggy content of the changed `paths` of `bug`, None unless the cache holds all of them."""
+        rows = self._connection.execute('SELECT path, content FROM sources WHERE bug = ?', (_bug_name(bug),)).fetchall()
+        sources = dict(rows)
+        if any(path not in sources for path in paths):
+            return None
+        return {path: sources[path] for path in paths}
+
+    def put_buggy_sources(self, bug, sources):
+        with self._transaction():
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO sources (bug, path, content) VALUES (?, ?, ?)',
+                [(_bug_name(bug), path, content) for path, content in sources.items()])
+
+    def _evict(self):
+        (total,) = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()
+        if total <= self.max_bytes:
+            return
+        # the least recently used results until the cache is back to 90% of max_bytes
+        evicted = 0
+        for key, size in self._connection.execute('SELECT key, size FROM results ORDER BY last_used').fetchall():
+            if total - evicted <= self.max_bytes * 0.9:
+                break
+            self._connection.execute('DELETE FROM results WHERE key = ?', (key,))
+            evicted += size
+
+    def _transaction(self):
+        return _Transaction(self._connection)
+
+    def format_stats(self):
+        return 'result cache: {} hits, {} misses'.format(self.hits, self.misses)
+
+    def close(self):
+        self._connection.close()
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, concurrent writers wait for it instead of failing on upgrade
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __enter__(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+_caches = {}
+
+
+def get_result_cache(path=RESULT_CACHE_FILE, max_bytes=1 << 30):
+    """The result cache of `path` in this process, None when `path` is None."""
+    if path is None:
+        return None
+    if path not in _caches:
+        _caches[path] = ResultCache(path, max_bytes)
+    return _caches[path]
@@ -0,0 +1,95 @@
+<?php
+// Runs the failing tests of a PHPFixer patch schema (see validation/schemata.py) for every candidate in one PHP
+// process: loads the composer autoloader, the PHPUnit bootstrap and the PHPUnit runner once, then forks a child per
+// candidate that selects it through the schema variable and runs PHPUnit. Usage: php schema_runner.php <spec.json>
+//
+// Prints `PHPFIXER-SCHEMA boot <seconds>`, then the PHPUnit output of every candidate between
+// `PHPFIXER-SCHEMA <index> begin` and `PHPFIXER-SCHEMA <index> end <exit code|signal|timeout> <seconds>`, or
+// `PHPFIXER-SCHEMA boot-failed <reason>` and exits with 3 when the candidates cannot share the process.
+
+function phpfixer_schema_boot_failed($reason)
+{
+    echo "PHPFIXER-SCHEMA boot-failed $reason\n";
+    exit(3);
+}
+
+$phpfixerStart = microtime(true);
+$phpfixerSpec = json_decode(file_get_contents($argv[1]), true);
+if (!function_exists('pcntl_fork') || !function_exists('posix_kill')) {
+    phpfixer_schema_boot_failed('PHP has no pcntl and posix');
+}
+
+chdir($phpfixerSpec['cwd']);
+if (!defined('PHPUNIT_COMPOSER_INSTALL')) {
+    define('PHPUNIT_COMPOSER_INSTALL', $phpfixerSpec['autoload']);
+}
+require_once $phpfixerSpec['autoload'];
+if ($phpfixerSpec['bootstrap'] !== null) {
+    // PHPUnit loads its bootstrap with include_once, the runs of the candidates skip it
+    include_once $phpfixerSpec['bootstrap'];
+}
+
+if (class_exists('PHPUnit\TextUI\Application')) {
+    $phpfixerRun = function (array $argv) {
+        $application = new PHPUnit\TextUI\Application();
+        return $application->run($argv);
+    };
+} elseif (class_exists('PHPUnit\TextUI\Command')) {
+    $phpfixerRun = function (array $argv) {
+        $command = new PHPUnit\TextUI\Command();
+        return $command->run($argv, false);
+    };
+} elseif (class_exists('PHPUnit_TextUI_Command')) {
+    $phpfixerRun = function (array $argv) {
+        $command = new PHPUnit_TextUI_Command();
+        return $command->run($argv, false);
+    };
+} else {
+    phpfixer_schema_boot_failed('no PHPUnit runner found');
+}
+
+// a class of the changed file that is loaded now cannot be loaded again from the copy of a candidate
+if (in_array($phpfixerSpec['changed_file'], get_included_files(), true)) {
+    phpfixer_schema_boot_failed('the bootstrap loads the changed file');
+}
+
+while (ob_get_level() > 0) {
+    ob_end_flush();
+}
+printf("PHPFIXER-SCHEMA boot %.3f\n", microtime(true) - $phpfixerStart);
+
+foreach ($phpfixerSpec['candidates'] as $phpfixerIndex) {
+    echo "PHPFIXER-SCHEMA $phpfixerIndex begin\n";
+    fflush(STDOUT);
+    $phpfixerBegin = microtime(true);
+    $phpfixerPid = pcntl_fork();
+    if ($phpfixerPid === -1) {
+        break;
+    }
+    if ($phpfixerPid === 0) {
+        // a process group of its own, a timeout kills the processes the tests start as well
+        posix_setpgid(0, 0);
+        putenv($phpfixerSpec['variable'] . '=' . $phpfixerIndex);
+        $_ENV[$phpfixerSpec['variable']] = $_SERVER[$phpfixerSpec['variable']] = (string) $phpfixerIndex;
+        $_SERVER['argv'] = $GLOBALS['argv'] = $phpfixerSpec['argv'];
+        $_SERVER['argc'] = $GLOBALS['argc'] = count($phpfixerSpec['argv']);
+        exit($phpfixerRun($phpfixerSpec['argv']));
+    }
+
+    $phpfixerEnd = null;
+    while (pcntl_waitpid($phpfixerPid, $phpfixerStatus, WNOHANG) === 0) {
+        if ($phpfixerSpec['timeout'] !== null && microtime(true) - $phpfixerBegin > $phpfixerSpec['timeout']) {
+            posix_kill(-$phpfixerPid, SIGKILL);
+            posix_kill($phpfixerPid, SIGKILL);
+            pcntl_waitpid($phpfixerPid, $phpfixerStatus);
+            $phpfixerEnd = 'timeout';
+            break;
+        }
+        usleep(10000);
+    }
+    if ($phpfixerEnd === null) {
+        $phpfixerEnd = pcntl_wifexited($phpfixerStatus) ? pcntl_wexitstatus($phpfixerStatus) : 'signal';
+    }
+    printf("\nPHPFIXER-SCHEMA %d end %s %.3f\n", $phpfixerIndex, $phpfixerEnd, microtime(true) - $phpfixerBegin);
+    fflush(STDOUT);
+}
@@ -0,0 +1,242 @@
+import json
+import os
+import signal
+import subprocess as sp
+import tempfile
+import xml.etree.ElementTree as ElementTree
+from collections import namedtuple
+
+from validation.patching import hunk_count
+from validation.test_runner import ANSI_ESCAPE, FAILED, NO_RESULTS, PASSED, TIMED_OUT, TestOutcome, line_status
+from validation.vendor_cache import vendor_dir
+from validation.workspace import run_task, task_preexec
+
+
+# names the candidate a patch schema loads, the index of the candidate in the schema
+CANDIDATE_VARIABLE = 'PHPFIXER_CANDIDATE'
+
+_VARIANT_SUFFIX = '.phpfixer-candidate-'
+
+# takes the place of the changed file: every candidate is a full copy of the file next to it, loaded by the
+# include that would have loaded the file, so __DIR__ and the relative paths of the copies stay the same
+_DISPATCHER = '''<?php
+$phpfixerCandidate = getenv('{variable}');
+if ($phpfixerCandidate === false || !ctype_digit($phpfixerCandidate)) {{
+    throw new \\RuntimeException('{variable} does not name a candidate of the PHPFixer patch schema');
+}}
+return require __DIR__ . '/' . basename(__FILE__) . '{suffix}' . $phpfixerCandidate;
+'''
+
+# boots PHPUnit once and forks a run of it for every candidate, see `run_schema`
+SCHEMA_RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema_runner.php')
+
+# starts the lines of SCHEMA_RUNNER that frame the PHPUnit output of the candidates
+MARKER = 'PHPFIXER-SCHEMA'
+
+# seconds the runner may take to boot, on top of the timeout of the candidates
+BOOT_TIMEOUT = 300
+
+# the PHPUnit command of the failing tests of a prepared workspace, kept next to its snapshots
+PHPUNIT_RUN_FILE = 'phpunit-run.json'
+
+# takes the place of vendor/bin/phpunit while the failing-test-only task of BugsPHP runs, records its command
+_RECORDER = '''#!/usr/bin/env php
+<?php
+file_put_contents({record}, json_encode(array('cwd' => getcwd(), 'argv' => $argv)));
+'''
+
+# the PHPUnit command BugsPHP runs for the failing tests of a bug: its working directory and arguments, the
+# composer autoloader of the checkout and the PHPUnit bootstrap file the runner loads before it forks (None when
+# PHPUnit has to load it in every run)
+PHPUnitRun = namedtuple('PHPUnitRun', ['cwd', 'argv', 'autoload', 'bootstrap'])
+
+# the outcome of a schema run: the seconds to boot and the failing-test-only outcome of every candidate that ran
+SchemaRun = namedtuple('SchemaRun', ['boot_seconds', 'outcomes'])
+
+
+def schema_eligible(bug):
+    """Whether the candidates of `bug` (its BugsPHP metadata) can share one patch schema: a single hunk."""
+    return hunk_count(bug) == 1
+
+
+def variant_path(path, index):
+    return path + _VARIANT_SUFFIX + str(index)
+
+
+def build_schema(path, patched_sources):
+    """
+    The files of the patch schema of a changed file for the candidates of `patched_sources` (candidate index to the
+    patched content of the file): the dispatcher at `path`, which loads the copy of the candidate named by the
+    CANDIDATE_VARIABLE environment variable, and the copies.
+    """
+    files = {path: _DISPATCHER.format(variable=CANDIDATE_VARIABLE, suffix=_VARIANT_SUFFIX)}
+    for index, patched_source in patched_sources.items():
+        files[variant_path(path, index)] = patched_source
+    return files
+
+
+def _option(argv, names):
+    for index, arg in enumerate(argv):
+        for name in names:
+            if arg == name and index + 1 < len(argv):
+                return argv[index + 1]
+            if name.startswith('--') and arg.startswith(name + '='):
+                return arg[len(name) + 1:]
+    return None
+
+
+def _existing(path):
+    return os.path.realpath(path) if os.path.isfile(path) else None
+
+
+def phpunit_bootstrap(cwd, argv):
+    """
+    The bootstrap file of a PHPUnit command, from its --bootstrap option or the bootstrap attribute of its
+    configuration (-c, or phpunit.xml, phpunit.dist.xml or phpunit.xml.dist in `cwd`). None without one, and when the
+    configuration has a <php> section: PHPUnit applies its ini settings, constants and environment variables before
+    the bootstrap, so the bootstrap is left to every run. None as well for a bootstrap file that does not exist.
+    """
+    bootstrap = _option(argv, ['--bootstrap'])
+    if bootstrap is not None:
+        return _existing(os.path.join(cwd, bootstrap))
+    if '--no-configuration' in argv:
+        return None
+
+    configuration = os.path.join(cwd, _option(argv, ['-c', '--configuration']) or '')
+    if os.path.isdir(configuration):
+        for name in ('phpunit.xml', 'phpunit.dist.xml', 'phpunit.xml.dist'):
+            if os.path.isfile(os.path.join(configuration, name)):
+                configuration = os.path.join(configuration, name)
+                break
+    try:
+        root = ElementTree.parse(configuration).getroot()
+    except (OSError, ElementTree.ParseError):
+        return None
+    if root.get('bootstrap') is None or root.find('php') is not None:
+        return None
+    return _existing(os.path.join(os.path.dirname(configuration), root.get('bootstrap')))
+
+
+def probe_phpunit(workspace):
+    """
+    The `PHPUnitRun` of the failing tests of the bug prepared in `workspace`, None when it was not found. The
+    failing-test-only task of BugsPHP runs once with vendor/bin/phpunit replaced by a script that records its
+    working directory and arguments; the result is kept with the snapshots of the workspace, so it is probed once
+    per prepared bug. The phpunit entry is renamed away and back, never written through: the vendor files may be
+    hard links into the vendor cache.
+    """
+    run_file = os.path.join(workspace.snapshot_dir, PHPUNIT_RUN_FILE)
+    if os.path.exists(run_file):
+        with open(run_file) as handle:
+            run = json.load(handle)
+        return PHPUnitRun(**run) if run is not None else None
+
+    repo_owner, repo_name, bug_no = workspace.key['repo_owner'], workspace.key['repo_name'], workspace.key['bug_no']
+    phpunit = os.path.join(workspace.path, vendor_dir(workspace.path), 'bin', 'phpunit')
+    record = run_file + '.record'
+    run = None
+    if os.path.lexists(phpunit):
+        original = phpunit + '.phpfixer-original'
+        os.rename(phpunit, original)
+        try:
+            with open(phpunit, 'w') as handle:
+                handle.write(_RECORDER.format(record=json.dumps(record)))
+            os.chmod(phpunit, 0o755)
+            run_task(repo_owner, repo_name, bug_no, 'failing-test-only', workspace.root, bugsphp_dir=workspace.bugsphp_dir)
+        finally:
+            os.replace(original, phpunit)
+        try:
+            with open(record) as handle:
+                recorded = json.load(handle)
+            os.remove(record)
+        except (OSError, ValueError):
+            recorded = None
+        if recorded is not None:
+            cwd = recorded['cwd']
+            run = {
+                'cwd': cwd,
+                'argv': recorded['argv'],
+                'autoload': os.path.realpath(os.path.join(workspace.path, vendor_dir(workspace.path), 'autoload.php')),
+                'bootstrap': phpunit_bootstrap(cwd, recorded['argv'][1:]),
+            }
+    with open(run_file, 'w') as handle:
+        json.dump(run, handle)
+    return PHPUnitRun(**run) if run is not None else None
+
+
+def _outcome(lines, end, seconds):
+    if end == 'timeout':
+        return TestOutcome(TIMED_OUT, '\n'.join(lines), seconds, True)
+    statuses = {line_status(line) for line in lines}
+    status = FAILED if FAILED in statuses else PASSED if PASSED in statuses else NO_RESULTS
+    return TestOutcome(status, '\n'.join(lines), seconds, False)
+
+
+def parse_schema_output(output):
+    """The `SchemaRun` of the output of SCHEMA_RUNNER, None when it could not boot."""
+    boot_seconds = None
+    outcomes = {}
+    index, lines = None, []
+    for line in output.split('\n'):
+        line = ANSI_ESCAPE.sub('', line)
+        fields = line.split()
+        if not fields or fields[0] != MARKER:
+            if index is not None:
+                lines.append(line)
+            continue
+        if fields[1] == 'boot-failed':
+            print('Patch schema not booted:', ' '.join(fields[2:]))
+            return None
+        if fields[1] == 'boot':
+            boot_seconds = float(fields[2])
+        elif fields[2] == 'begin':
+            index, lines = int(fields[1]), []
+        elif fields[2] == 'end' and index == int(fields[1]):
+            # the runner starts the end marker on a line of its own, after the last line of PHPUnit
+            outcomes[index] = _outcome(lines[:-1] if lines and not lines[-1] else lines, fields[3], float(fields[4]))
+            index = None
+    return SchemaRun(boot_seconds, outcomes) if boot_seconds is not None else None
+
+
+def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_schema(phpunit_run, changed_file, indices, timeout=None, fail_fast=False, php='php'):
+    """
+    Runs the failing tests of the patch schema at `changed_file` (written with `build_schema`) for the candidates
+    `indices` in one PHP process and returns its `SchemaRun`, None when the process could not boot.
+
+    SCHEMA_RUNNER loads the composer autoloader, the PHPUnit bootstrap and the PHPUnit runner classes once, then
+    forks a child for every candidate that sets CANDIDATE_VARIABLE to its index and runs PHPUnit with the arguments
+    of `phpunit_run`, so a candidate only pays for its tests, not for PHP start-up, autoloading and bootstrap. Every
+    run is killed after `timeout` seconds; with `fail_fast` PHPUnit stops at the first failure or error. The runner
+    refuses to boot when the bootstrap loads the changed file already (its classes could not be loaded per
+    candidate) or when PHP has no pcntl and posix. A candidate without an outcome did not run, the runner died.
+    """
+    argv = list(phpunit_run.argv)
+    if fail_fast:
+        argv += ['--stop-on-failure', '--stop-on-error']
+    spec = dict(phpunit_run._asdict(), argv=argv, changed_file=os.path.realpath(changed_file), candidates=list(indices),
+                variable=CANDIDATE_VARIABLE, timeout=timeout)
+    descriptor, spec_file = tempfile.mkstemp(prefix='phpfixer-schema-', suffix='.json')
+    with os.fdopen(descriptor, 'w') as handle:
+        json.dump(spec, handle)
+
+    process = sp.Popen([php, '-d', 'opcache.enable_cli=0', SCHEMA_RUNNER, spec_file], cwd=phpunit_run.cwd,
+                       stdout=sp.PIPE, stderr=sp.DEVNULL, preexec_fn=task_preexec(), start_new_session=True)
+    try:
+        output, _ = process.communicate(timeout=BOOT_TIMEOUT + timeout * len(spec['candidates']) if timeout else None)
+    except sp.TimeoutExpired:
+        # the runs that ended are kept, the candidate that hung gets no outcome
+        _kill(process)
+        output, _ = process.communicate()
+    except BaseException:
+        _kill(process)
+        raise
+    finally:
+        os.remove(spec_file)
+    return parse_schema_output(output.decode(errors='replace'))
@@ -0,0 +1,105 @@
+import time
+from collections import namedtuple
+
+
+PLAUSIBLE = 'passAllTests'
+
+# a validated candidate of a bug: `rank` is its position in the ranked candidate stream
+CandidateResult = namedtuple('CandidateResult', ['rank', 'candidate', 'exec_result', 'seconds'])
+
+# `plausible` holds the best ranked plausible candidates (up to the goal), `evaluated` how many candidates were
+# validated for it, `first_plausible_evaluated` / `first_plausible_seconds` the same at the first plausible one
+SearchResult = namedtuple('SearchResult', [
+    'bug', 'plausible', 'results', 'evaluated', 'seconds', 'first_plausible_evaluated', 'first_plausible_seconds',
+    ])
+
+
+class BugSearch:
+    """
+    Validates the ranked candidates of a bug until `goal` of them are plausible (pass all tests), instead of all of
+    them. `goal=1` stops at the first plausible patch, `goal=None` validates every candidate.
+
+    Without a `pool`, the candidates are validated one after the other in rank order with `getResults`. With a
+    `ValidationPool`, up to `lookahead` candidates (the number of workers by default) are in flight at once; once
+    the goal is met no new candidate is submitted and the queued ones are cancelled. The candidates that are running
+    by then still finish, a better ranked one among them can replace a plausible patch found later in the ranking.
+    """
+
+    def __init__(self, goal=1, pool=None, lookahead=None, workspace_root='/tmp'):
+        self.goal = goal
+        self.pool = pool
+        self.lookahead = lookahead or (pool.workers if pool is not None else 1)
+        self.workspace_root = workspace_root
+
+    def run(self, bug, candidates):
+        """Searches the `candidates` (an iterable, best first) of `bug` (its name in the test data)."""
+        if self.pool is None:
+            return self._run_in_order(bug, candidates)
+        return self._run_in_pool(bug, candidates)
+
+    def _goal_met(self, plausible):
+        return self.goal is not None and len(plausible) >= self.goal
+
+    def _run_in_order(self, bug, candidates):
+        # imported here, like in the pool workers, BugsPHPDiscriminator is only needed to validate
+        import BugsPHPDiscriminator
+
+        start = time.time()
+        results, plausible = [], []
+        first_plausible = (None, None)
+        for rank, candidate in enumerate(candidates):
+            candidate_start = time.time()
+            exec_result = BugsPHPDiscriminator.getResults(None, candidate, None, [bug], workspace_root=self.workspace_root)
+            result = CandidateResult(rank, candidate, exec_result, time.time() - candidate_start)
+            results.append(result)
+            if exec_result == PLAUSIBLE:
+                plausible.append(result)
+                if first_plausible[0] is None:
+                    first_plausible = (len(results), time.time() - start)
+                if self._goal_met(plausible):
+                    break
+        return SearchResult(bug, plausible, results, len(results), time.time() - start, *first_plausible)
+
+    def _run_in_pool(self, bug, candidates):
+        start = time.time()
+        candidates = enumerate(candidates)
+        submitted = {}
+        results, plausible = [], []
+        first_plausible = (None, None)
+
+        def submit_next():
+            for rank, candidate in candidates:
+                submitted[rank] = candidate
+                self.pool.submit(rank, bug, candidate)
+                return
+
+        for _ in range(self.lookahead):
+            submit_next()
+
+        goal_met = False
+        # every submitted job gets its result, running ones are drained so that the next search starts clean
+        for job in self.pool.results():
+            if job.cancelled:
+                continue
+            if job.error is not None:
+                print('validation of candidate {} of {} failed:\n{}'.format(job.job_id, bug, job.error))
+            result = CandidateResult(job.job_id, submitted[job.job_id], job.exec_result, job.seconds)
+            results.append(result)
+            if result.exec_result == PLAUSIBLE:
+                plausible.append(result)
+                if first_plausible[0] is None:
+                    first_plausible = (len(results), time.time() - start)
+
+            if goal_met:
+                continue
+            if self._goal_met(plausible):
+                goal_met = True
+                self.pool.cancel_pending()
+            else:
+                submit_next()
+
+        results.sort(key=lambda result: result.rank)
+        plausible.sort(key=lambda result: result.rank)
+        if self.goal is not None:
+            plausible = plausible[:self.goal]
+        return SearchResult(bug, plausible, results, len(results), time.time() - start, *first_plausible)
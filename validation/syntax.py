@@ -0,0 +1,218 @@
+import re
+import shutil
+import subprocess as sp
+from collections import namedtuple
+
+
+SyntaxIssue = namedtuple('SyntaxIssue', ['line', 'message'])
+
+_OPEN_TAG = re.compile(r'<\?(?:php\b|=)?', re.IGNORECASE)
+_WORD = re.compile(r'[A-Za-z_\x80-\uffff][\w\x80-\uffff]*')
+_NUMBER = re.compile(r'(?:\d[\w]*(?:\.[\d_]*)?|\.\d[\d_]*)(?:[eE][+-]?\d+)?')
+_HEREDOC = re.compile(r'<<<[ \t]*(["\']?)([A-Za-z_][\w]*)\1\r?\n')
+_OPERATORS = sorted([
+    '<=>', '**=', '...', '<<=', '>>=', '===', '!==', '??=', '?->',
+    '->', '=>', '::', '==', '!=', '<>', '<=', '>=', '&&', '||', '??', '++', '--', '+=', '-=', '*=', '/=', '.=', '%=',
+    '&=', '|=', '^=', '<<', '>>', '**',
+    '=', '+', '-', '*', '/', '%', '.', '<', '>', '!', '&', '|', '^', '~', '?', ':', ',', ';', '@', '\\',
+], key=len, reverse=True)
+
+BRACKETS = {'(': ')', '[': ']', '{': '}'}
+CLOSING = set(BRACKETS.values())
+
+# operators that need an operand after them
+BINARY_OPERATORS = {
+    '<=>', '**=', '<<=', '>>=', '===', '!==', '??=', '=>', '==', '!=', '<>', '<=', '>=', '&&', '||', '??',
+    '+=', '-=', '*=', '/=', '.=', '%=', '&=', '|=', '^=', '<<', '>>', '**', '=', '+', '-', '*', '/', '%', '.', '<',
+    '>', '|', '^',
+}
+MEMBER_OPERATORS = {'->', '?->', '::'}
+
+
+class _Error(Exception):
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.issue = SyntaxIssue(line, message)
+
+
+def _skip_quoted(source, position, quote, line):
+    """Position after the closing `quote` of a string starting at `position`, and the line it ends on."""
+    start_line = line
+    interpolation = 0
+    while position < len(source):
+        character = source[position]
+        if character == '\n':
+            line += 1
+        if character == '\\':
+            position += 2
+            continue
+        if quote != "'":
+            # code inside "{$...}" / "${...}" can hold its own strings and braces
+            if interpolation:
+                if character in '\'"':
+                    position, line = _skip_quoted(source, position + 1, character, line)
+                    continue
+                interpolation += {'{': 1, '}': -1}.get(character, 0)
+            elif source.startswith('{$', position) or source.startswith('${', position):
+                interpolation = 1
+                position += 2
+                continue
+        if character == quote and not interpolation:
+            return position + 1, line
+        position += 1
+    raise _Error(start_line, 'unterminated string')
+
+
+_TOKEN = re.compile('|'.join([
+    r'(?P<space>\s+)',
+    r'(?P<close_tag>\?>)',
+    r'(?P<attribute>#\[)',
+    r'(?P<line_comment>#|//)',
+    r'(?P<block_comment>/\*)',
+    r'(?P<quote>[\'"`])',
+    r'(?P<heredoc><<<(?=[ \t]*["\']?[A-Za-z_]))',
+    r'(?P<variable>\$' + _WORD.pattern + ')',
+    r'(?P<number>' + _NUMBER.pattern + ')',
+    r'(?P<word>' + _WORD.pattern + ')',
+    r'(?P<bracket>[()\[\]{}])',
+    r'(?P<operator>' + '|'.join(re.escape(operator) for operator in _OPERATORS) + ')',
+    r'(?P<other>.)',
+]), re.DOTALL)
+_LINE_COMMENT_END = re.compile(r'\n|\?>')
+
+
+def tokens(source):
+    """Yields the `(line, token)` of the PHP code of `source`, without whitespace, comments, strings and inline HTML."""
+    position, line = 0, 1
+    in_php = False
+    while position < len(source):
+        if not in_php:
+            match = _OPEN_TAG.search(source, position)
+            if match is None:
+                return
+            line += source.count('\n', position, match.end())
+            position, in_php = match.end(), True
+            continue
+
+        match = _TOKEN.match(source, position)
+        kind = match.lastgroup
+        position = match.end()
+        if kind == 'space':
+            line += match.group().count('\n')
+        elif kind == 'close_tag':
+            # a closing tag ends the statement
+            yield line, ';'
+            in_php = False
+        elif kind == 'attribute':
+            yield line, '['
+        elif kind == 'line_comment':
+            end = _LINE_COMMENT_END.search(source, position)
+            position = end.start() if end else len(source)
+        elif kind == 'block_comment':
+            end = source.find('*/', position)
+            if end < 0:
+                raise _Error(line, 'unterminated comment')
+            line += source.count('\n', position, end)
+            position = end + 2
+        elif kind == 'quote':
+            position, line = _skip_quoted(source, position, match.group(), line)
+            yield line, 'string'
+        elif kind == 'heredoc':
+            heredoc = _HEREDOC.match(source, match.start())
+            if heredoc is None:
+                raise _Error(line, 'invalid heredoc')
+            end = re.compile(r'^[ \t]*' + heredoc.group(2) + r'\b', re.MULTILINE).search(source, heredoc.end())
+            if end is None:
+                raise _Error(line, 'unterminated heredoc')
+            line += source.count('\n', match.start(), end.end())
+            position = end.end()
+            yield line, 'string'
+        elif kind in ('variable', 'number', 'word'):
+            yield line, kind
+        else:
+            yield line, match.group()
+
+
+def check_syntax(source):
+    """
+    The first syntax error of the PHP `source` a token scan can find, None when it finds none: unterminated
+    strings, comments and heredocs, unbalanced or mismatched brackets, a `->` / `::` without a member and an
+    operator directly followed by a closing bracket, `;` or `,`. Passing does not mean that PHP parses the code.
+    """
+    stack = []
+    previous = None
+    try:
+        for line, token in tokens(source):
+            if previous in MEMBER_OPERATORS and token not in ('word', 'variable', '{', '$'):
+                return SyntaxIssue(line, "'{}' without a member".format(previous))
+            if previous in BINARY_OPERATORS and (token in CLOSING or token in (';', ',')):
+                return SyntaxIssue(line, "'{}' without an operand before '{}'".format(previous, token))
+            if token in BRACKETS:
+                stack.append((line, token))
+            elif token in CLOSING:
+                if not stack:
+                    return SyntaxIssue(line, "unmatched '{}'".format(token))
+                opening_line, opening = stack.pop()
+                if BRACKETS[opening] != token:
+                    return SyntaxIssue(line, "'{}' closes '{}' of line {}".format(token, opening, opening_line))
+            previous = token
+    except _Error as error:
+        return error.issue
+    if stack:
+        line, opening = stack[-1]
+        return SyntaxIssue(line, "unclosed '{}'".format(opening))
+    return None
+
+
+def php_lint(source, php='php', timeout=30):
+    """`php -l` of `source`: None when PHP parses it, its error message otherwise."""
+    process = sp.run([php, '-l'], input=source, stdout=sp.PIPE, stderr=sp.STDOUT, universal_newlines=True, timeout=timeout)
+    return None if process.returncode == 0 else process.stdout.strip()
+
+
+class SyntaxPreScreen:
+    """
+    Rejects a candidate before any test runs when a file it patched does not parse: first the token scan of
+    `check_syntax`, then `php -l` when a PHP binary is available and `lint` is on.
+
+    A check only rejects errors of the candidate: a file whose buggy version already fails a check (which the
+    scan can get wrong, e.g. on rare syntax it does not know) is not screened by that check. The counters report
+    how many candidates each check rejected.
+    """
+
+    def __init__(self, lint=True, php=None):
+        self.php = php or shutil.which('php')
+        self.lint = lint and self.php is not None
+        self.screened = 0
+        self.rejected_scan = 0
+        self.rejected_lint = 0
+        self._buggy_results = {}
+
+    def _buggy_passes(self, check, buggy_source):
+        key = (check, hash(buggy_source))
+        if key not in self._buggy_results:
+            self._buggy_results[key] = (check_syntax(buggy_source) if check == 'scan' else php_lint(buggy_source, self.php)) is None
+        return self._buggy_results[key]
+
+    def screen(self, files):
+        """
+        `files` maps the changed paths to `(buggy_source, patched_source)`. Returns the reason to reject the
+        candidate, None when every patched file passes.
+        """
+        self.screened += 1
+        for path, (buggy_source, patched_source) in files.items():
+            issue = check_syntax(patched_source)
+            if issue is not None and self._buggy_passes('scan', buggy_source):
+                self.rejected_scan += 1
+                return '{}:{}: {}'.format(path, issue.line, issue.message)
+        if self.lint:
+            for path, (buggy_source, patched_source) in files.items():
+                error = php_lint(patched_source, self.php)
+                if error is not None and self._buggy_passes('lint', buggy_source):
+                    self.rejected_lint += 1
+                    return '{}: {}'.format(path, error)
+        return None
+
+    def format_stats(self):
+        return 'syntax pre-screen: {} candidates, {} rejected by the token scan, {} by php -l{}'.format(
+            self.screened, self.rejected_scan, self.rejected_lint, '' if self.lint else ' (off)')
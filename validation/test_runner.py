@@ -0,0 +1,110 @@
+import os
+import re
+import selectors
+import signal
+import subprocess as sp
+import time
+from collections import namedtuple
+
+from validation.workspace import BUGSPHP_DIR, bugsphp_command, task_preexec
+
+
+PASSED = 'passed'
+FAILED = 'failed'
+NO_RESULTS = 'noResults'
+TIMED_OUT = 'timedOut'
+
+ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+# the PHPUnit summary lines, and the progress line of the tests run so far (`..F.E   5 / 10 ( 50%)`); a progress line
+# needs its counter, letters alone can be any output of a test (`END`, `DIE`, ...)
+_PASSED_SUMMARY = re.compile(r'^OK(?:$| \(|, but )')
+_FAILED_SUMMARY = re.compile(r'^(?:FAILURES!|ERRORS!|There (?:was|were) \d+ (?:failure|error)s?:)')
+_PROGRESS = re.compile(r'^([.FEWRSIND]+)\s+\d+\s*/\s*\d+\s*\(\s*\d+%\)$')
+
+# the output of a test task, `status` is one of PASSED, FAILED, NO_RESULTS or TIMED_OUT, `killed` when the task was
+# stopped before it finished
+TestOutcome = namedtuple('TestOutcome', ['status', 'output', 'seconds', 'killed'])
+
+
+def line_status(line):
+    """FAILED when an ANSI-stripped PHPUnit output line decides the run failed, PASSED for the OK summary, else None."""
+    line = line.strip()
+    progress = _PROGRESS.match(line)
+    if _FAILED_SUMMARY.match(line) or (progress and ('F' in progress.group(1) or 'E' in progress.group(1))):
+        return FAILED
+    if _PASSED_SUMMARY.match(line):
+        return PASSED
+    return None
+
+
+def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_tests(repo_owner, repo_name, bug_no, task, root, fail_fast=False, timeout=None, bugsphp_dir=BUGSPHP_DIR):
+    """
+    Runs a BugsPHP test task (`failing-test-only` or `test`) and decides its outcome while its output streams in.
+
+    A failure is decided by the first failed test of the PHPUnit progress line (with its `N / M (P%)` counter) or
+    its failure summary; with
+    `fail_fast` the task and every process it started in its process group are killed right there instead of
+    running the remaining tests. A pass is only decided when the task ends with the OK summary. After `timeout`
+    seconds the task is killed and TIMED_OUT.
+    """
+    start = time.time()
+    deadline = start + timeout if timeout is not None else None
+    process = sp.Popen(bugsphp_command(repo_owner, repo_name, bug_no, task, root), cwd=bugsphp_dir,
+                       stdout=sp.PIPE, stderr=sp.DEVNULL, preexec_fn=task_preexec(), start_new_session=True)
+    selector = selectors.DefaultSelector()
+    selector.register(process.stdout, selectors.EVENT_READ)
+
+    lines = []
+    status = None
+    killed = False
+    pending = b''
+    try:
+        while True:
+            remaining = deadline - time.time() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                _kill(process)
+                status, killed = TIMED_OUT, True
+                break
+            if not selector.select(remaining):
+                continue
+            chunk = os.read(process.stdout.fileno(), 1 << 16)
+            if not chunk:
+                break
+            *complete, pending = (pending + chunk).split(b'\n')
+            for raw_line in complete:
+                line = ANSI_ESCAPE.sub('', raw_line.decode(errors='replace'))
+                lines.append(line)
+                if line_status(line) == FAILED:
+                    status = FAILED
+            if status == FAILED and fail_fast:
+                _kill(process)
+                killed = True
+                break
+
+        if pending and not killed:
+            lines.append(ANSI_ESCAPE.sub('', pending.decode(errors='replace')))
+        if status is None:
+            statuses = {line_status(line) for line in lines}
+            status = FAILED if FAILED in statuses else PASSED if PASSED in statuses else NO_RESULTS
+    except BaseException:
+        _kill(process)
+        raise
+    finally:
+        selector.close()
+        process.stdout.close()
+        try:
+            process.wait(timeout=None if killed or deadline is None else max(deadline - time.time(), 0))
+        except sp.TimeoutExpired:
+            # the task closed its output but did not exit
+            _kill(process)
+            process.wait()
+            status, killed = TIMED_OUT, True
+    return TestOutcome(status, '\n'.join(lines), time.time() - start, killed)
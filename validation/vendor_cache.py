@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess as sp
+import tempfile
+
+
+VENDOR_CACHE_DIR = '/tmp/phpfixer-vendor'
+
+# written into a cached vendor directory once it is complete
+COMPLETE_FILE = '.phpfixer-complete'
+
+# the files of a vendor directory `composer dump-autoload` writes for the checkout, copied instead of linked so that
+# regenerating them never changes the cached copies
+GENERATED = ('autoload.php', 'composer')
+
+
+def vendor_dir(checkout):
+    """The composer vendor directory of a checkout, `config.vendor-dir` of its composer.json or `vendor`."""
+    try:
+        with open(os.path.join(checkout, 'composer.json')) as handle:
+            return json.load(handle).get('config', {}).get('vendor-dir', 'vendor')
+    except (OSError, ValueError, AttributeError):
+        return 'vendor'
+
+
+def dependency_key(checkout):
+    """
+    The hash of the composer.lock of a checkout (its composer.json without a lockfile) and of the `autoload` and
+    `autoload-dev` sections of its composer.json, None without either file.
+    """
+    for name in ('composer.lock', 'composer.json'):
+        path = os.path.join(checkout, name)
+        if os.path.exists(path):
+            digest = hashlib.sha256(name.encode() + b'\0')
+            with open(path, 'rb') as handle:
+                digest.update(handle.read())
+            break
+    else:
+        return None
+    try:
+        with open(os.path.join(checkout, 'composer.json')) as handle:
+            composer = json.load(handle)
+        autoload = {section: composer.get(section) for section in ('autoload', 'autoload-dev')}
+    except (OSError, ValueError, AttributeError):
+        autoload = None
+    digest.update(b'\0' + json.dumps(autoload, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def link_tree(source, target, copied=()):
+    """
+    Recreates the `source` directory at `target` with hard links to its files (copies across file systems) and its
+    symlinks as they are, so materializing a vendor directory costs metadata operations instead of file copies. The
+    top-level entries named in `copied` are copied instead.
+    """
+    for directory, directories, files in os.walk(source):
+        relative = os.path.relpath(directory, source)
+        target_directory = os.path.normpath(os.path.join(target, relative))
+        os.makedirs(target_directory, exist_ok=True)
+        for name in directories + files:
+            source_path = os.path.join(directory, name)
+            target_path = os.path.join(target_directory, name)
+            if relative == '.' and name in copied:
+                if os.path.isdir(source_path) and not os.path.islink(source_path):
+                    shutil.copytree(source_path, target_path, symlinks=True)
+                    directories.remove(name)
+                else:
+                    shutil.copy2(source_path, target_path, follow_symlinks=False)
+            elif os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), target_path)
+                if name in directories:
+                    # os.walk does not go into symlinked directories
+                    directories.remove(name)
+            elif name in files:
+                try:
+                    os.link(source_path, target_path)
+                except OSError:
+                    shutil.copy2(source_path, target_path)
+
+
+def composer_environment(composer_home):
+    """
+    The environment of an offline composer install against the local mirror of `composer_home`: its config.json
+    points composer at the mirror repositories (with packagist.org disabled) and its cache holds the dist archives.
+    """
+    return dict(os.environ, COMPOSER_HOME=composer_home, COMPOSER_CACHE_DIR=os.path.join(composer_home, 'cache'),
+                COMPOSER_DISABLE_NETWORK='1')
+
+
+class VendorCache:
+    """
+    The installed composer vendor directories of the checkouts, shared by the bugs with the same dependencies
+    (the same composer.lock, or composer.json without one, and the same autoload sections), which the bugs of a
+    repository often have.
+
+    `materialize()` links the cached vendor directory into a fresh checkout instead of running the install, then
+    regenerates its autoloader from the checkout with `composer dump-autoload` (the classmap depends on the source
+    tree of the commit, not only on the dependencies); `store()` adds the vendor directory of a checkout that was
+    installed. The package files are hard links, the tests must not change them in place; the autoloader files
+    (GENERATED) are copies. Without a `composer` binary the cache only stores. Entries are written under a temporary
+    name and renamed, so the workers of a machine can share the cache.
+    """
+
+    def __init__(self, root=VENDOR_CACHE_DIR, composer='composer', env=None):
+        self.root = root
+        self.composer = shutil.which(composer)
+        self.env = env
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def materialize(self, checkout):
+        """Links the cached vendor directory of `checkout` into it, False when the cache does not have it."""
+        key = dependency_key(checkout)
+        entry = self._entry(key) if key is not None else None
+        if self.composer is None or entry is None or not os.path.exists(os.path.join(entry, COMPLETE_FILE)):
+            self.misses += 1
+            return False
+        target = os.path.join(checkout, vendor_dir(checkout))
+        shutil.rmtree(target, ignore_errors=True)
+        link_tree(os.path.join(entry, 'vendor'), target, copied=GENERATED)
+        dump = sp.run([self.composer, 'dump-autoload', '--no-interaction', '--working-dir', checkout],
+                      stdout=sp.DEVNULL, stderr=sp.DEVNULL, env=self.env)
+        if dump.returncode != 0:
+            # the checkout is installed the usual way instead
+            shutil.rmtree(target, ignore_errors=True)
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, checkout):
+        """Caches the installed vendor directory of `checkout`, unless the cache has one for its dependencies."""
+        key = dependency_key(checkout)
+        source = os.path.join(checkout, vendor_dir(checkout))
+        if key is None or not os.path.isdir(source) or os.path.exists(self._entry(key)):
+            return
+        temporary_entry = tempfile.mkdtemp(dir=self.root, prefix='.tmp-')
+        try:
+            link_tree(source, os.path.join(temporary_entry, 'vendor'), copied=GENERATED)
+            open(os.path.join(temporary_entry, COMPLETE_FILE), 'w').close()
+            os.rename(temporary_entry, self._entry(key))
+        except OSError:
+            # another worker stored the same dependencies first
+            shutil.rmtree(temporary_entry, ignore_errors=True)
+
+    def format_stats(self):
+        return 'vendor cache: {} hits, {} misses'.format(self.hits, self.misses)
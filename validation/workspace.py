@@ -0,0 +1,146 @@
+import json
+import os
+import resource
+import shutil
+import subprocess as sp
+from collections import namedtuple
+
+from validation.vendor_cache import VendorCache, composer_environment
+
+
+BUGSPHP_DIR = './bugsPHP/'
+
+# written into a prepared checkout, names the bug it was prepared for
+MARKER_FILE = '.phpfixer-workspace.json'
+
+
+# limits of every BugsPHP task process (and the PHP processes it starts), None for no limit
+ResourceLimits = namedtuple('ResourceLimits', ['memory_bytes', 'cpu_seconds'])
+
+_task_limits = None
+
+
+def set_task_limits(limits):
+    """Applies `limits` (a `ResourceLimits` or None) to the BugsPHP tasks this process runs from now on."""
+    global _task_limits
+    _task_limits = limits
+
+
+def _apply_limits(limits):
+    def preexec():
+        if limits.memory_bytes is not None:
+            resource.setrlimit(resource.RLIMIT_AS, (limits.memory_bytes, limits.memory_bytes))
+        if limits.cpu_seconds is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (limits.cpu_seconds, limits.cpu_seconds))
+    return preexec
+
+
+def task_preexec():
+    """The `preexec_fn` that applies the task limits of this process to a BugsPHP task, None without limits."""
+    return _apply_limits(_task_limits) if _task_limits is not None else None
+
+
+def bugsphp_command(repo_owner, repo_name, bug_no, task, root):
+    """The BugsPHP `main.py` command of `task` (checkout, install, failing-test-only, test) on the buggy version."""
+    return ['python3', 'main.py', '-p', repo_owner + '--' + repo_name, '-b', str(bug_no), '-t', task, '-v', 'buggy', '-o', root]
+
+
+def run_task(repo_owner, repo_name, bug_no, task, root, capture=True, bugsphp_dir=BUGSPHP_DIR, env=None):
+    """Runs a BugsPHP task and returns its (stdout, stderr), both None without `capture`."""
+    preexec_fn = task_preexec()
+    if not capture:
+        return sp.Popen(bugsphp_command(repo_owner, repo_name, bug_no, task, root), cwd=bugsphp_dir,
+                        preexec_fn=preexec_fn, env=env).communicate()
+    return sp.Popen(bugsphp_command(repo_owner, repo_name, bug_no, task, root), cwd=bugsphp_dir, preexec_fn=preexec_fn,
+                    env=env, universal_newlines=True, stdout=sp.PIPE, stderr=sp.PIPE).communicate()
+
+
+class BugWorkspace:
+    """
+    The buggy checkout of a bug under `root` (`<root>/<repo_name>`, where BugsPHP checks it out), prepared once and
+    reset between candidates.
+
+    `prepare()` runs the BugsPHP checkout and composer install only when the checkout does not belong to the bug
+    yet, then snapshots the original content of its `changed_file_paths` (the only files a candidate touches) under
+    `<root>/.snapshots/`. `restore()` copies them back before the next candidate is applied, so the 100 candidates
+    of a bug pay for one checkout and install instead of 100.
+
+    With a `vendor_cache` (`VendorCache`), a checkout whose dependencies were installed before gets its vendor
+    directory linked from the cache instead of the install. With a `composer_home` the install runs offline against
+    its local package mirror (see `composer_environment`).
+    """
+
+    def __init__(self, root='/tmp', bugsphp_dir=BUGSPHP_DIR, vendor_cache=None, composer_home=None):
+        self.root = root
+        self.bugsphp_dir = bugsphp_dir
+        self.vendor_cache = vendor_cache
+        self.composer_home = composer_home
+        self.key = None
+        self.path = None
+        self.changed_file_paths = []
+        self.snapshot_dir = None
+        self.prepares = 0
+        self.restores = 0
+
+    def prepare(self, repo_owner, repo_name, bug_no, changed_file_paths):
+        """Checks out and installs the bug unless this workspace already holds it, returns the checkout path."""
+        key = {'repo_owner': repo_owner, 'repo_name': repo_name, 'bug_no': int(bug_no)}
+        path = os.path.join(self.root, repo_name)
+        snapshot_dir = os.path.join(self.root, '.snapshots', '{}--{}-{}'.format(repo_owner, repo_name, bug_no))
+        if self.key == key and self._marker(path) == key and os.path.isdir(snapshot_dir):
+            return path
+
+        # another bug (or another process) may have used the checkout since, it is prepared again
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+        run_task(repo_owner, repo_name, bug_no, 'checkout', self.root, capture=False, bugsphp_dir=self.bugsphp_dir)
+        if self.vendor_cache is None or not self.vendor_cache.materialize(path):
+            env = composer_environment(self.composer_home) if self.composer_home is not None else None
+            run_task(repo_owner, repo_name, bug_no, 'install', self.root, bugsphp_dir=self.bugsphp_dir, env=env)
+            if self.vendor_cache is not None:
+                self.vendor_cache.store(path)
+
+        for changed_file_path in changed_file_paths:
+            snapshot = os.path.join(snapshot_dir, changed_file_path)
+            os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+            shutil.copy2(os.path.join(path, changed_file_path), snapshot)
+        with open(os.path.join(path, MARKER_FILE), 'w') as handle:
+            json.dump(key, handle)
+
+        self.key = key
+        self.path = path
+        self.changed_file_paths = list(changed_file_paths)
+        self.snapshot_dir = snapshot_dir
+        self.prepares += 1
+        return path
+
+    def restore(self):
+        """Puts the buggy content of the changed files back, undoing the previous candidate."""
+        for changed_file_path in self.changed_file_paths:
+            target = os.path.join(self.path, changed_file_path)
+            temporary_path = target + '.phpfixer-restore'
+            shutil.copy2(os.path.join(self.snapshot_dir, changed_file_path), temporary_path)
+            os.replace(temporary_path, target)
+        self.restores += 1
+
+    @staticmethod
+    def _marker(path):
+        try:
+            with open(os.path.join(path, MARKER_FILE)) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+
+_workspaces = {}
+
+
+def get_workspace(root='/tmp', vendor_cache_dir=None, composer_home=None):
+    """
+    The workspace of `root` in this process, shared by the `getResults` calls of the candidates. `vendor_cache_dir`
+    is the directory of its `VendorCache`, None for none.
+    """
+    if root not in _workspaces:
+        env = composer_environment(composer_home) if composer_home is not None else None
+        vendor_cache = VendorCache(vendor_cache_dir, env=env) if vendor_cache_dir is not None else None
+        _workspaces[root] = BugWorkspace(root, vendor_cache=vendor_cache, composer_home=composer_home)
+    return _workspaces[root]